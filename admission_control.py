@@ -0,0 +1,435 @@
+"""
+Admission control for chat turns and backpressure for provider calls.
+
+`AdmissionController` runs at most one turn per thread (so two tabs cannot
+interleave checkpoints on the same thread) and at most `max_concurrent_turns`
+turns overall. Excess turns queue in arrival order for up to
+`max_wait_seconds`, reporting their position and an estimated wait.
+
+`ProviderGate` caps simultaneous LLM/embedding requests. When a request
+is rate limited (HTTP 429), the gate pauses every caller until the time the
+provider's rate-limit headers give, then retries; other transient failures
+(timeouts, connection errors, 5xx) are retried by the caller alone. The
+clients it wraps are built with `max_retries=0`, so that the gate sees every
+429 and its headers instead of the SDK retrying on its own first.
+
+A caller that stops waiting for a call (turn_budget's deadlines) cannot stop
+the request itself. It marks the call abandoned through `CALL_ABANDON`
+instead: the call's slot is given back at once, so timed-out turns cannot
+fill the gate and stall new ones, and the call is not retried. The provider
+may then briefly see more than `max_concurrent_calls` requests; `metrics()`
+reports how many abandoned ones are still running.
+"""
+from __future__ import annotations
+
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+
+class AdmissionTimeout(RuntimeError):
+    """A turn waited longer than the controller's bound for a free slot."""
+
+
+class _Ticket:
+    __slots__ = ("thread_id", "enqueued")
+
+    def __init__(self, thread_id: str):
+        self.thread_id = thread_id
+        self.enqueued = time.monotonic()
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        max_concurrent_turns: int = 8,
+        max_wait_seconds: float = 60.0,
+        poll_seconds: float = 1.0,
+        initial_turn_seconds: float = 10.0,
+    ):
+        self.max_concurrent_turns = max_concurrent_turns
+        self.max_wait_seconds = max_wait_seconds
+        self.poll_seconds = poll_seconds
+
+        self._cond = threading.Condition()
+        self._waiting: Deque[_Ticket] = deque()
+        self._active: Dict[str, float] = {}  # thread_id -> start time
+        # Moving average of turn duration, for wait estimates.
+        self._turn_seconds = initial_turn_seconds
+
+        self._admitted = 0
+        self._timeouts = 0
+        self._max_wait_observed = 0.0
+
+    def admit(self, thread_id: str) -> Iterator[dict]:
+        """
+        Wait for a slot for `thread_id`'s turn.
+
+        A generator: while queued it yields {"position", "eta_seconds",
+        "waited_seconds"} every `poll_seconds` (and whenever the queue moves),
+        and it returns once the turn is admitted. The caller must then call
+        `release`. Raises `AdmissionTimeout` after `max_wait_seconds`. Closing
+        the generator early gives up the place in the queue.
+        """
+        ticket = _Ticket(str(thread_id))
+        admitted = False
+        with self._cond:
+            self._waiting.append(ticket)
+        try:
+            while True:
+                with self._cond:
+                    if self._admissible(ticket):
+                        self._waiting.remove(ticket)
+                        self._active[ticket.thread_id] = time.monotonic()
+                        waited = time.monotonic() - ticket.enqueued
+                        self._admitted += 1
+                        self._max_wait_observed = max(self._max_wait_observed, waited)
+                        admitted = True
+                        return
+
+                    waited = time.monotonic() - ticket.enqueued
+                    if waited >= self.max_wait_seconds:
+                        self._timeouts += 1
+                        raise AdmissionTimeout(
+                            f"The server is busy; no slot became free within "
+                            f"{self.max_wait_seconds:g}s. Please try again."
+                        )
+                    status = self._status(ticket, waited)
+
+                yield status
+                with self._cond:
+                    if not self._admissible(ticket):
+                        remaining = self.max_wait_seconds - (time.monotonic() - ticket.enqueued)
+                        self._cond.wait(timeout=max(0.0, min(self.poll_seconds, remaining)))
+        finally:
+            if not admitted:
+                with self._cond:
+                    if ticket in self._waiting:
+                        self._waiting.remove(ticket)
+                    self._cond.notify_all()
+
+    def release(self, thread_id: str) -> None:
+        with self._cond:
+            started = self._active.pop(str(thread_id), None)
+            if started is not None:
+                elapsed = time.monotonic() - started
+                self._turn_seconds = 0.8 * self._turn_seconds + 0.2 * elapsed
+            self._cond.notify_all()
+
+    @contextmanager
+    def turn(self, thread_id: str):
+        """Admit and release around a block, without progress reports."""
+        for _ in self.admit(thread_id):
+            pass
+        try:
+            yield
+        finally:
+            self.release(thread_id)
+
+    def metrics(self) -> dict:
+        with self._cond:
+            return {
+                "active_turns": len(self._active),
+                "queued_turns": len(self._waiting),
+                "max_concurrent_turns": self.max_concurrent_turns,
+                "admitted": self._admitted,
+                "timeouts": self._timeouts,
+                "max_wait_seconds_observed": round(self._max_wait_observed, 2),
+                "mean_turn_seconds": round(self._turn_seconds, 2),
+            }
+
+    # -------------------
+    # Internals (called with the condition held)
+    # -------------------
+    def _admissible(self, ticket: _Ticket) -> bool:
+        if ticket.thread_id in self._active:
+            return False
+        if len(self._active) >= self.max_concurrent_turns:
+            return False
+        # First come, first served among tickets whose thread is free.
+        for other in self._waiting:
+            if other is ticket:
+                return True
+            if other.thread_id not in self._active:
+                return False
+        return False
+
+    def _status(self, ticket: _Ticket, waited: float) -> dict:
+        ahead = 0
+        for other in self._waiting:
+            if other is ticket:
+                break
+            ahead += 1
+        if ticket.thread_id in self._active:
+            # Waiting on this thread's own running turn.
+            elapsed = time.monotonic() - self._active[ticket.thread_id]
+            eta = max(1.0, self._turn_seconds - elapsed)
+        else:
+            eta = (ahead // self.max_concurrent_turns + 1) * self._turn_seconds
+        return {
+            "position": ahead + 1,
+            "eta_seconds": round(eta, 1),
+            "waited_seconds": round(waited, 1),
+        }
+
+
+# -------------------
+# Provider calls
+# -------------------
+_DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def _parse_duration(value: str) -> Optional[float]:
+    """OpenAI reset headers: "1s", "6m0s", "250ms", "1h2m3.5s"."""
+    parts = _DURATION_RE.findall(value.strip())
+    if not parts:
+        return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+def retry_delay_from_headers(headers: Any) -> Optional[float]:
+    """Seconds to wait before retrying, from a 429 response's headers."""
+    if not headers:
+        return None
+    delays: List[float] = []
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            delays.append(float(retry_after_ms) / 1000)
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            delays.append(float(retry_after))
+        except ValueError:
+            try:
+                delays.append(parsedate_to_datetime(retry_after).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+    for name in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens"):
+        remaining = headers.get(name.replace("reset", "remaining"))
+        value = headers.get(name)
+        # Only the limit that is actually exhausted matters.
+        if value and remaining in (None, "0"):
+            delay = _parse_duration(value)
+            if delay is not None:
+                delays.append(delay)
+    delays = [delay for delay in delays if delay >= 0]
+    return max(delays) if delays else None
+
+
+def _is_rate_limit(error: BaseException) -> bool:
+    return (
+        getattr(error, "status_code", None) == 429
+        or getattr(getattr(error, "response", None), "status_code", None) == 429
+        or type(error).__name__ == "RateLimitError"
+    )
+
+
+class CallAbandoned(RuntimeError):
+    """A gated call was not started (or retried) because its caller gave up on it."""
+
+
+class CallAbandon:
+    """
+    Set in `CALL_ABANDON` by code that may stop waiting for the gated calls
+    made under it; `abandon()` gives back their slots.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._releases: List[Callable[[bool], bool]] = []
+        self.abandoned = False
+
+    def add(self, release: Callable[[bool], bool]) -> bool:
+        with self._lock:
+            if not self.abandoned:
+                self._releases.append(release)
+            return not self.abandoned
+
+    def discard(self, release: Callable[[bool], bool]) -> None:
+        with self._lock:
+            if release in self._releases:
+                self._releases.remove(release)
+
+    def abandon(self) -> None:
+        with self._lock:
+            self.abandoned = True
+            releases, self._releases = self._releases, []
+        for release in releases:
+            release(True)
+
+
+CALL_ABANDON: ContextVar[Optional[CallAbandon]] = ContextVar("provider_call_abandon", default=None)
+
+
+def _is_transient(error: BaseException) -> bool:
+    """Failures the OpenAI SDK itself would retry: timeouts, lost connections, 408/409/5xx."""
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status in (408, 409) or status >= 500
+    return type(error).__name__ in ("APIConnectionError", "APITimeoutError")
+
+
+class ProviderGate:
+    """
+    Bounds concurrent provider calls and applies a shared 429 backoff.
+
+    One rate-limited response pauses new calls from every thread until the
+    reset time from its headers (or an exponential backoff with jitter when
+    there are none), instead of each caller retrying on its own. Other
+    transient errors back off only the failing call, outside its slot.
+    """
+
+    def __init__(
+        self, max_concurrent_calls: int = 16, max_retries: int = 3, max_backoff: float = 60.0
+    ):
+        self.max_concurrent_calls = max_concurrent_calls
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self._slots = threading.BoundedSemaphore(max_concurrent_calls)
+        self._lock = threading.Lock()
+        self._paused_until = 0.0
+        self._in_flight = 0
+        self._calls = 0
+        self._rate_limited = 0
+        self._transient_errors = 0
+        self._retries = 0
+        self._paused_seconds = 0.0
+        self._abandoned = 0
+        self._abandoned_running = 0
+
+    def call(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        abandon = CALL_ABANDON.get()
+        attempt = 0
+        while True:
+            self._wait_for_pause()
+            backoff = 0.0
+            release = self._acquire()
+            if abandon is not None and not abandon.add(release):
+                release(False)
+                raise CallAbandoned()
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if _is_rate_limit(e):
+                    # Pause everyone, even when this caller has run out of retries.
+                    headers = getattr(getattr(e, "response", None), "headers", None)
+                    self._pause(retry_delay_from_headers(headers), attempt)
+                elif _is_transient(e):
+                    backoff = self._backoff(attempt)
+                    with self._lock:
+                        self._transient_errors += 1
+                else:
+                    raise
+                if attempt >= self.max_retries:
+                    raise
+            finally:
+                if abandon is not None:
+                    abandon.discard(release)
+                if not release(False):  # given back when it was abandoned
+                    with self._lock:
+                        self._abandoned_running -= 1
+            time.sleep(backoff)
+            if abandon is not None and abandon.abandoned:
+                raise CallAbandoned()
+            attempt += 1
+            with self._lock:
+                self._retries += 1
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "max_concurrent_calls": self.max_concurrent_calls,
+                "in_flight": self._in_flight,
+                "calls": self._calls,
+                "rate_limited": self._rate_limited,
+                "transient_errors": self._transient_errors,
+                "retries": self._retries,
+                "abandoned": self._abandoned,
+                "abandoned_running": self._abandoned_running,
+                "paused_seconds_total": round(self._paused_seconds, 2),
+                "paused_for_seconds": round(max(0.0, self._paused_until - time.monotonic()), 2),
+            }
+
+    def _acquire(self) -> Callable[[bool], bool]:
+        """Take a slot; returns its release(abandoned), which frees it once (True if it did)."""
+        self._slots.acquire()
+        with self._lock:
+            self._in_flight += 1
+            self._calls += 1
+        released = False
+
+        def release(abandoned: bool) -> bool:
+            nonlocal released
+            with self._lock:
+                if released:
+                    return False
+                released = True
+                self._in_flight -= 1
+                if abandoned:
+                    self._abandoned += 1
+                    self._abandoned_running += 1
+            self._slots.release()
+            return True
+
+        return release
+
+    def _backoff(self, attempt: int) -> float:
+        """Exponential backoff with jitter."""
+        return min(self.max_backoff, 2 ** attempt) * (0.5 + random.random() / 2)
+
+    def _pause(self, delay: Optional[float], attempt: int) -> None:
+        if delay is None:
+            delay = self._backoff(attempt)
+        delay = min(delay, self.max_backoff)
+        with self._lock:
+            self._rate_limited += 1
+            until = time.monotonic() + delay
+            if until > self._paused_until:
+                self._paused_seconds += until - max(self._paused_until, time.monotonic())
+                self._paused_until = until
+
+    def _wait_for_pause(self) -> None:
+        while True:
+            with self._lock:
+                remaining = self._paused_until - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+
+class GatedEmbeddings(Embeddings):
+    """Sends an embeddings model's requests through a `ProviderGate`."""
+
+    def __init__(self, inner: Embeddings, gate: ProviderGate):
+        self.inner = inner
+        self.gate = gate
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.gate.call(self.inner.embed_documents, texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.gate.call(self.inner.embed_query, text)
+
+
+# Process-wide instances shared by every graph and the chat clients.
+TURN_ADMISSION = AdmissionController(
+    max_concurrent_turns=int(os.getenv("CHAT_MAX_CONCURRENT_TURNS", "8")),
+    max_wait_seconds=float(os.getenv("CHAT_ADMISSION_MAX_WAIT_SECONDS", "60")),
+)
+PROVIDER_GATE = ProviderGate(
+    max_concurrent_calls=int(os.getenv("LLM_MAX_CONCURRENT_CALLS", "16")),
+    max_retries=int(os.getenv("LLM_RATE_LIMIT_RETRIES", "3")),
+)
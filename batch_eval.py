@@ -0,0 +1,316 @@
+"""
+Run a set of questions through a chat graph and record the answers, tool
+calls, token usage and timing of every turn:
+
+    python batch_eval.py cases.jsonl --graph rag -o results.jsonl
+    python batch_eval.py cases.jsonl --graph tools -o results.jsonl --concurrency 16
+    python batch_eval.py cases.jsonl --graph rag -o results.jsonl --retry-errors
+
+Each line of the cases file is one case, run as a fresh thread:
+
+    {"id": "refunds", "pdf": "docs/policy.pdf", "questions": ["What is the refund window?", "And for sale items?"]}
+    {"id": "followup", "setup": [{"role": "user", "content": "I hold 10 AAPL"},
+                                 {"role": "assistant", "content": "Noted."}],
+     "questions": ["What are they worth?"], "graph": "tools", "metadata": {"expected": "..."}}
+
+"setup" messages are written to the thread before the first question, "pdf"
+(relative to the cases file) is ingested for it, and "graph" overrides
+--graph. A case's questions run in order; up to --concurrency cases run at
+once, each on its own `eval-<id>-<random>` thread_id.
+
+Every finished case is appended to the output as one JSON line:
+{"case_id", "thread_id", "graph", "status": "ok" | "error", "error",
+"elapsed_ms", "pdf", "turns": [{"question", "answer", "tool_calls": [{"name",
+"args", "output"}], "model_calls", "usage", "first_token_ms", "elapsed_ms"}],
+"usage", "metadata"}. "usage" sums the models' reported input/output/total
+tokens (null if the model reports none). Rerunning with the same output
+skips the cases already recorded (--retry-errors reruns failed ones), so an
+interrupted run simply continues.
+
+The graph runs in this process with the backend's own checkpointer and
+settings; --work-dir runs it against the databases and indexes in another
+directory instead of the app's.
+"""
+from __future__ import annotations
+
+import argparse
+import importlib
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage, ToolMessage
+
+from chat_service_client import GRAPH_MODULES
+from turn_budget import with_turn_deadline
+
+MAX_TOOL_OUTPUT = 2000  # characters of each tool result kept in the output
+_SETUP_TYPES = {"user": HumanMessage, "human": HumanMessage, "assistant": AIMessage, "ai": AIMessage}
+
+
+# -------------------
+# Cases and results
+# -------------------
+def read_cases(path: str) -> Iterator[dict]:
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            case = json.loads(line)
+            case["id"] = str(case.get("id") or f"line-{number}")
+            if case.get("pdf"):
+                case["pdf"] = os.path.join(base, case["pdf"])
+            yield case
+
+
+def recorded_cases(path: str) -> Dict[str, str]:
+    """case_id -> status of the results already in `path`. A line cut off by
+    an interruption is removed so appending continues a valid file."""
+    statuses: Dict[str, str] = {}
+    if not os.path.exists(path):
+        return statuses
+    complete = 0
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if not line.endswith(b"\n"):
+                break
+            statuses[record["case_id"]] = record["status"]
+            complete += len(line)
+    if complete != os.path.getsize(path):
+        with open(path, "r+b") as f:
+            f.truncate(complete)
+    return statuses
+
+
+class ResultWriter:
+    """Appends one line per case, flushed at once so a crash loses nothing."""
+
+    def __init__(self, path: str):
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def write(self, record: dict) -> None:
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+# -------------------
+# Running a case
+# -------------------
+def _backend(graph: str):
+    if graph not in GRAPH_MODULES:
+        raise ValueError(f"Unknown graph '{graph}'")
+    return importlib.import_module(GRAPH_MODULES[graph])
+
+
+def _usage(messages: List[Any]) -> Optional[Dict[str, int]]:
+    reported = [m.usage_metadata for m in messages if isinstance(m, AIMessage) and m.usage_metadata]
+    if not reported:
+        return None
+    keys = ("input_tokens", "output_tokens", "total_tokens")
+    return {key: sum(usage.get(key, 0) for usage in reported) for key in keys}
+
+
+def _tool_calls(messages: List[Any]) -> List[dict]:
+    outputs = {m.tool_call_id: m.content for m in messages if isinstance(m, ToolMessage)}
+    calls = []
+    for message in messages:
+        for call in getattr(message, "tool_calls", None) or []:
+            output = outputs.get(call.get("id"))
+            if isinstance(output, str) and len(output) > MAX_TOOL_OUTPUT:
+                output = output[:MAX_TOOL_OUTPUT] + f"… [{len(output)} chars]"
+            calls.append({"name": call["name"], "args": call["args"], "output": output})
+    return calls
+
+
+def run_turn(chatbot, config: dict, question: str) -> dict:
+    """One question on the thread of `config`, and what the graph did for it."""
+    checkpointer = chatbot.checkpointer
+    sent = HumanMessage(content=question, id=str(uuid.uuid4()))
+    start, first_token = time.perf_counter(), None
+    for chunk, _ in chatbot.stream(
+        {"messages": [sent]},
+        config=with_turn_deadline(config),  # as in the app, see turn_budget.py
+        stream_mode="messages",
+        durability=getattr(checkpointer, "graph_durability", None),
+    ):
+        if first_token is None and isinstance(chunk, AIMessageChunk) and chunk.content:
+            first_token = time.perf_counter() - start
+    elapsed = time.perf_counter() - start
+
+    messages = chatbot.get_state(config).values.get("messages", [])
+    # Everything after the question we sent is this turn's work.
+    position = next((i for i, m in enumerate(messages) if m.id == sent.id), len(messages) - 1)
+    produced = messages[position + 1 :]
+    answers = [m for m in produced if isinstance(m, AIMessage)]
+    return {
+        "question": question,
+        "answer": answers[-1].content if answers else None,
+        "tool_calls": _tool_calls(produced),
+        "model_calls": len(answers),
+        "usage": _usage(produced),
+        "first_token_ms": round(1000 * first_token, 1) if first_token is not None else None,
+        "elapsed_ms": round(1000 * elapsed, 1),
+    }
+
+
+def run_case(case: dict, default_graph: str) -> dict:
+    graph = case.get("graph") or default_graph
+    thread_id = f"eval-{case['id']}-{uuid.uuid4().hex[:8]}"
+    record: Dict[str, Any] = {
+        "case_id": case["id"],
+        "thread_id": thread_id,
+        "graph": graph,
+        "status": "ok",
+        "error": None,
+        "elapsed_ms": None,
+        "pdf": None,
+        "turns": [],
+        "usage": None,
+        "metadata": case.get("metadata"),
+    }
+    start = time.perf_counter()
+    try:
+        backend = _backend(graph)
+        config = {
+            "configurable": {"thread_id": thread_id},
+            "metadata": {"thread_id": thread_id},
+            "run_name": "eval_turn",
+        }
+        if case.get("pdf"):
+            if not hasattr(backend, "ingest_pdf"):
+                raise ValueError(f"Graph '{graph}' does not support documents")
+            with open(case["pdf"], "rb") as f:
+                file_bytes = f.read()
+            record["pdf"] = backend.ingest_pdf(file_bytes, thread_id=thread_id, filename=os.path.basename(case["pdf"]))
+        if case.get("setup"):
+            setup = [_SETUP_TYPES[m["role"]](content=m["content"]) for m in case["setup"]]
+            backend.chatbot.update_state(
+                {"configurable": config["configurable"]}, {"messages": setup}, as_node="chat_node"
+            )
+        for question in case.get("questions") or []:
+            record["turns"].append(run_turn(backend.chatbot, config, question))
+        flush = getattr(backend.chatbot.checkpointer, "flush", None)
+        if flush is not None:
+            flush()
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["elapsed_ms"] = round(1000 * (time.perf_counter() - start), 1)
+    turn_usage = [turn["usage"] for turn in record["turns"] if turn["usage"]]
+    if turn_usage:
+        record["usage"] = {key: sum(usage[key] for usage in turn_usage) for key in turn_usage[0]}
+    return record
+
+
+# -------------------
+# Batch
+# -------------------
+def run_batch(
+    cases: Iterator[dict],
+    default_graph: str,
+    writer: ResultWriter,
+    concurrency: int,
+    skip: Set[str],
+) -> List[dict]:
+    """Run every case not in `skip`, `concurrency` at a time, writing each as it
+    finishes; the summaries of the records written."""
+    done: List[dict] = []
+    in_flight: Set[Future] = set()
+
+    def collect(futures) -> None:
+        for future in futures:
+            record = future.result()
+            writer.write(record)
+            done.append(_summary(record))
+            print(
+                f"{record['case_id']}: {record['status']} {len(record['turns'])} turns "
+                f"{record['elapsed_ms'] / 1000:.1f}s" + (f" ({record['error']})" if record["error"] else ""),
+                file=sys.stderr,
+            )
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="eval-case") as pool:
+        for case in cases:
+            if case["id"] in skip:
+                continue
+            in_flight.add(pool.submit(run_case, case, default_graph))
+            # Bounded read-ahead: the cases file may be large.
+            if len(in_flight) >= 2 * concurrency:
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(finished)
+        collect(wait(in_flight).done)
+    return done
+
+
+def _summary(record: dict) -> dict:
+    return {
+        "status": record["status"],
+        "turn_ms": [turn["elapsed_ms"] for turn in record["turns"]],
+        "tool_calls": sum(len(turn["tool_calls"]) for turn in record["turns"]),
+        "tokens": (record["usage"] or {}).get("total_tokens", 0),
+    }
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("cases", help="JSONL file of cases")
+    parser.add_argument("--graph", choices=sorted(GRAPH_MODULES), default="tools", help="default graph of a case")
+    parser.add_argument("-o", "--output", required=True, help="JSONL results, appended to")
+    parser.add_argument("--concurrency", type=int, default=4, help="cases run at once")
+    parser.add_argument("--retry-errors", action="store_true", help="rerun cases recorded as failed")
+    parser.add_argument("--work-dir", help="directory of the databases and indexes to use (default: current)")
+    args = parser.parse_args()
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+
+    cases_path, output = os.path.abspath(args.cases), os.path.abspath(args.output)
+    recorded = recorded_cases(output)
+    skip = {case_id for case_id, status in recorded.items() if status == "ok" or not args.retry_errors}
+    if args.work_dir:
+        os.makedirs(args.work_dir, exist_ok=True)
+        os.chdir(args.work_dir)  # the backends open chatbot.db etc. relative to it
+    if skip:
+        print(f"skipping {len(skip)} cases already in {args.output}", file=sys.stderr)
+
+    writer = ResultWriter(output)
+    start = time.perf_counter()
+    try:
+        done = run_batch(read_cases(cases_path), args.graph, writer, args.concurrency, skip)
+    finally:
+        writer.close()
+    elapsed = time.perf_counter() - start
+
+    turn_ms = [ms for summary in done for ms in summary["turn_ms"]]
+    failed = sum(summary["status"] != "ok" for summary in done)
+    print(
+        f"{len(done)} cases ({failed} failed), {len(turn_ms)} turns in {elapsed:.1f}s; "
+        f"turn p50 {_percentile(turn_ms, 0.5):.0f} ms, p95 {_percentile(turn_ms, 0.95):.0f} ms; "
+        f"{sum(s['tool_calls'] for s in done)} tool calls, {sum(s['tokens'] for s in done)} tokens",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Measure per-turn checkpoint write time under each CHECKPOINT_DURABILITY mode.
+
+Runs tool-using turns (model -> tool -> model) from several threads at once
+against a fresh SQLite checkpoint file per mode, and reports the time each
+turn waited on checkpoint writes (including the end-of-turn flush), turn
+latency, and how many statements and threads each commit grouped:
+
+    python benchmark_checkpoints.py --threads 8 --turns 20
+    python benchmark_checkpoints.py --db-dir /mnt/data --tool-ms 50
+    python benchmark_checkpoints.py --message-store
+    python benchmark_checkpoints.py --shards 4
+
+No model or network is used: the "model" alternates between a tool call and
+a canned answer. Put --db-dir on the disk the service uses; fsync cost
+varies widely between disks.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from typing import Annotated, TypedDict
+
+from langchain_core.messages import AIMessage, BaseMessage, ToolMessage
+from langchain_core.tools import tool
+from langgraph.graph import START, StateGraph
+from langgraph.graph.message import add_messages
+from langgraph.prebuilt import ToolNode, tools_condition
+
+from admission_control import AdmissionController
+from checkpoint_shards import ShardedSaver, existing_shards
+from checkpointing import DURABILITY_MODES, DeferredSqliteSaver, MessageStoreSaver
+from turn_runner import TurnRunner
+
+
+class ChatState(TypedDict):
+    messages: Annotated[list[BaseMessage], add_messages]
+
+
+def build_graph(saver, tool_ms):
+    @tool
+    def lookup(query: str) -> str:
+        """Look something up."""
+        time.sleep(tool_ms / 1000)
+        return f"Result for {query}: " + "lorem ipsum " * 40
+
+    def chat_node(state: ChatState):
+        last = state["messages"][-1]
+        if isinstance(last, ToolMessage):
+            return {"messages": [AIMessage(content="Here is the answer. " * 20)]}
+        call = {"name": "lookup", "args": {"query": str(last.content)}, "id": f"call-{time.time_ns()}"}
+        return {"messages": [AIMessage(content="", tool_calls=[call])]}
+
+    graph = StateGraph(ChatState)
+    graph.add_node("chat_node", chat_node)
+    graph.add_node("tools", ToolNode([lookup]))
+    graph.add_edge(START, "chat_node")
+    graph.add_conditional_edges("chat_node", tools_condition)
+    graph.add_edge("tools", "chat_node")
+    return graph.compile(checkpointer=saver)
+
+
+def run_mode(mode, db_dir, threads, turns, tool_ms, flush_ms, saver_class, shards=1):
+    path = os.path.join(db_dir, f"checkpoints-{mode}.db")
+    if shards > 1:
+        saver = ShardedSaver.open(path, shards, saver_class=saver_class, durability=mode, flush_ms=flush_ms)
+        files = list(existing_shards(path).values())
+    else:
+        saver = saver_class(
+            sqlite3.connect(path, check_same_thread=False), durability=mode, flush_ms=flush_ms
+        )
+        files = [path]
+    runner = TurnRunner(build_graph(saver, tool_ms), AdmissionController(max_concurrent_turns=threads))
+    checkpoint_ms, latency_ms = [], []
+    lock = threading.Lock()
+
+    def worker(index):
+        for turn_index in range(turns):
+            start = time.perf_counter()
+            turn = runner.start(f"{mode}-{index}", f"question {turn_index}")
+            for event in turn.events():
+                if event["event"] == "error":
+                    raise turn.error
+            with lock:
+                latency_ms.append((time.perf_counter() - start) * 1000)
+                checkpoint_ms.append(turn.checkpoint_ms)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for worker_thread in workers:
+        worker_thread.start()
+    for worker_thread in workers:
+        worker_thread.join()
+    saver.close()
+    checkpoint_ms.sort()
+    return {
+        "checkpoint_mean": statistics.mean(checkpoint_ms),
+        "checkpoint_p95": checkpoint_ms[int(len(checkpoint_ms) * 0.95) - 1],
+        "latency_p50": statistics.median(latency_ms),
+        "db_kb": sum(
+            os.path.getsize(candidate)
+            for file_path in files
+            for candidate in (file_path, f"{file_path}-wal")
+            if os.path.exists(candidate)
+        ) / 1024,
+        **saver.metrics(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=8, help="concurrent conversations")
+    parser.add_argument("--turns", type=int, default=20, help="turns per conversation")
+    parser.add_argument("--tool-ms", type=float, default=20.0)
+    parser.add_argument("--flush-ms", type=float, default=50.0)
+    parser.add_argument("--db-dir", help="directory for the checkpoint files (default: a temp dir)")
+    parser.add_argument("--modes", default=",".join(DURABILITY_MODES))
+    parser.add_argument(
+        "--message-store", action="store_true", help="store each message once (MessageStoreSaver)"
+    )
+    parser.add_argument("--shards", type=int, default=1, help="spread threads over this many files")
+    args = parser.parse_args()
+
+    print(f"{args.threads} threads x {args.turns} turns, tool {args.tool_ms:g} ms, {args.shards} shard(s)\n")
+    print(
+        f"{'mode':<8}{'ckpt ms/turn':>14}{'ckpt p95':>10}{'turn p50 ms':>13}"
+        f"{'commits':>9}{'stmts/commit':>14}{'threads/commit':>16}{'db KB':>9}"
+    )
+    saver_class = MessageStoreSaver if args.message_store else DeferredSqliteSaver
+    with tempfile.TemporaryDirectory(dir=args.db_dir) as db_dir:
+        for mode in args.modes.split(","):
+            result = run_mode(
+                mode, db_dir, args.threads, args.turns, args.tool_ms, args.flush_ms, saver_class, args.shards
+            )
+            print(
+                f"{mode:<8}{result['checkpoint_mean']:>14.2f}{result['checkpoint_p95']:>10.2f}"
+                f"{result['latency_p50']:>13.1f}{result['commits']:>9}"
+                f"{result['statements_per_commit']:>14.2f}{result['threads_per_commit']:>16.2f}"
+                f"{result['db_kb']:>9.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Compare the resident memory of the in-memory and SQLite chunk docstores.
+
+Loads the chunks of a PDF (or synthetic pages) into each docstore and reports
+the Python heap they hold (tracemalloc), per chunk and per page, plus the
+latency of fetching top-k hits:
+
+    python benchmark_docstore.py --pdf handbook.pdf
+    python benchmark_docstore.py --pages 5000 --k 4
+
+No embeddings are computed; the FAISS vectors are the same for both stores.
+SQLite's own page cache (about 2 MB by default) is outside the Python heap
+and not included.
+"""
+from __future__ import annotations
+
+import argparse
+import gc
+import random
+import statistics
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.document_loaders import PyPDFLoader
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from rag_docstore import SqliteDocstore
+
+
+def load_pages(pdf_path, num_pages):
+    if pdf_path:
+        return PyPDFLoader(pdf_path).load()
+    sentence = "The committee reviewed clause {n} of the agreement and the attached schedule. "
+    return [
+        Document(
+            page_content="\n".join(
+                " ".join(sentence.format(n=page * 100 + line * 10 + j) for j in range(4))
+                for line in range(10)
+            ),
+            metadata={
+                "producer": "benchmark",
+                "creator": "benchmark",
+                "creationdate": "2024-01-01T00:00:00+00:00",
+                "source": "/tmp/synthetic.pdf",
+                "total_pages": num_pages,
+                "page": page,
+                "page_label": str(page + 1),
+            },
+        )
+        for page in range(num_pages)
+    ]
+
+
+def build(docstore_factory, chunks):
+    """Fill a docstore the way FAISS.add_embeddings does; return it and its heap bytes."""
+    gc.collect()
+    tracemalloc.start()
+    docstore = docstore_factory()
+    ids = [str(uuid.uuid4()) for _ in chunks]
+    for start in range(0, len(chunks), 256):
+        docstore.add(
+            {
+                # Copy the text so the store owns it, as it does once ingestion
+                # drops the splitter output.
+                doc_id: Document(
+                    id=doc_id,
+                    page_content=chunk.page_content.encode("utf-8").decode("utf-8"),
+                    metadata=dict(chunk.metadata),
+                )
+                for doc_id, chunk in zip(ids[start : start + 256], chunks[start : start + 256])
+            }
+        )
+    index_to_docstore_id = dict(enumerate(ids))
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return docstore, index_to_docstore_id, current
+
+
+def fetch_latency_ms(docstore, index_to_docstore_id, k, rounds):
+    rows = list(index_to_docstore_id)
+    latencies = []
+    for _ in range(rounds):
+        doc_ids = [index_to_docstore_id[row] for row in random.sample(rows, k)]
+        start = time.perf_counter()
+        if hasattr(docstore, "mget"):
+            docstore.mget(doc_ids)
+        else:
+            [docstore.search(doc_id) for doc_id in doc_ids]
+        latencies.append((time.perf_counter() - start) * 1000)
+    return statistics.median(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdf", help="PDF to chunk; synthetic pages are used otherwise")
+    parser.add_argument("--pages", type=int, default=2000)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=500)
+    args = parser.parse_args()
+
+    pages = load_pages(args.pdf, args.pages)
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=1000, chunk_overlap=200, separators=["\n\n", "\n", " ", ""], add_start_index=True
+    )
+    chunks = splitter.split_documents(pages)
+    text_bytes = sum(len(chunk.page_content.encode("utf-8")) for chunk in chunks)
+    print(f"{len(pages)} pages, {len(chunks)} chunks, {text_bytes / 2**20:.1f} MB of chunk text\n")
+
+    print(f"{'docstore':<12}{'heap MB':>10}{'bytes/chunk':>14}{'bytes/page':>13}{'top-k ms':>11}")
+    with tempfile.TemporaryDirectory() as directory:
+        for name, factory in (
+            ("memory", InMemoryDocstore),
+            ("sqlite", lambda: SqliteDocstore(directory)),
+        ):
+            docstore, index_to_docstore_id, heap = build(factory, chunks)
+            latency = fetch_latency_ms(docstore, index_to_docstore_id, args.k, args.rounds)
+            print(
+                f"{name:<12}{heap / 2**20:>10.1f}{heap / len(chunks):>14.0f}"
+                f"{heap / len(pages):>13.0f}{latency:>11.3f}"
+            )
+            del docstore, index_to_docstore_id
+
+
+if __name__ == "__main__":
+    main()
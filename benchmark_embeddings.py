@@ -0,0 +1,97 @@
+"""
+Compare embedding providers for ingestion throughput and query latency.
+
+For each provider/runtime this embeds the chunks of a PDF (or synthetic
+paragraphs) and reports chunks/sec, then embeds single queries one at a time
+and reports p50/p95 latency:
+
+    python benchmark_embeddings.py --pdf handbook.pdf
+    python benchmark_embeddings.py --providers local:torch local:onnx-int8 --threads 4
+    python benchmark_embeddings.py --providers openai local:torch --chunks 500
+
+"openai" needs OPENAI_API_KEY; "local:<runtime>" uses RAG_EMBEDDING_MODEL or
+sentence-transformers/all-MiniLM-L6-v2.
+"""
+from __future__ import annotations
+
+import argparse
+import statistics
+import time
+
+from dotenv import load_dotenv
+from langchain_community.document_loaders import PyPDFLoader
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from rag_embeddings import make_embeddings
+
+load_dotenv()
+
+_QUERIES = [
+    "What is the notice period for termination?",
+    "Summarize the safety requirements",
+    "Which part number replaces the old valve?",
+    "How many vacation days do employees get?",
+    "Who approves travel expenses?",
+]
+
+
+def load_chunks(pdf_path, num_chunks):
+    if pdf_path:
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=1000, chunk_overlap=200, separators=["\n\n", "\n", " ", ""]
+        )
+        chunks = splitter.split_documents(PyPDFLoader(pdf_path).load())
+        return [chunk.page_content for chunk in chunks][:num_chunks]
+    sentence = "The committee reviewed clause {n} of the agreement and the attached schedule. "
+    return [" ".join(sentence.format(n=i * 10 + j) for j in range(12)) for i in range(num_chunks)]
+
+
+def run_provider(label, embeddings, chunks, query_rounds):
+    # Warm-up: model load, first request, connection setup.
+    embeddings.embed_documents(chunks[:2])
+
+    start = time.perf_counter()
+    embeddings.embed_documents(chunks)
+    ingest_seconds = time.perf_counter() - start
+
+    latencies = []
+    for _ in range(query_rounds):
+        for query in _QUERIES:
+            start = time.perf_counter()
+            embeddings.embed_query(query)
+            latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    p95 = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+
+    print(
+        f"{label:<22}{len(chunks) / ingest_seconds:>14.1f}"
+        f"{statistics.median(latencies):>12.1f}{p95:>12.1f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--providers", nargs="+", default=["openai", "local:torch"])
+    parser.add_argument("--pdf", help="PDF to chunk; synthetic text is used otherwise")
+    parser.add_argument("--chunks", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--query-rounds", type=int, default=4)
+    args = parser.parse_args()
+
+    chunks = load_chunks(args.pdf, args.chunks)
+    print(f"{len(chunks)} chunks, {args.query_rounds * len(_QUERIES)} queries\n")
+    print(f"{'provider':<22}{'chunks/sec':>14}{'p50 ms':>12}{'p95 ms':>12}")
+    for spec in args.providers:
+        provider, _, runtime = spec.partition(":")
+        embeddings = make_embeddings(
+            provider=provider,
+            batch_size=args.batch_size,
+            num_threads=args.threads,
+            runtime=runtime or None,
+        )
+        run_provider(spec, embeddings, chunks, args.query_rounds)
+
+
+if __name__ == "__main__":
+    main()
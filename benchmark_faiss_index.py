@@ -0,0 +1,96 @@
+"""
+Compare the FAISS index types used by `rag_index` against exact flat search.
+
+Reports recall@k (overlap with the flat index's top-k), index memory, build
+time (training + adding) and per-query latency for each index type:
+
+    python benchmark_faiss_index.py --vectors 50000 --dim 1536 --k 4
+    python benchmark_faiss_index.py --nprobe 4 16 64 --ef-search 32 128
+
+Vectors are synthetic clustered unit vectors, which behave much like text
+embeddings for this purpose, so no API calls are made.
+"""
+from __future__ import annotations
+
+import argparse
+import math
+import time
+
+import faiss
+import numpy as np
+
+from rag_index import EF_SEARCH, NPROBE, apply_search_params, build_faiss_index, ivf_nlist, pq_subquantizers
+
+
+def make_vectors(num: int, centers: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """`num` unit vectors scattered around `centers`, the same for corpus and queries."""
+    labels = rng.integers(0, len(centers), size=num)
+    vectors = centers[labels] + 0.5 * rng.standard_normal((num, centers.shape[1])).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+def run_case(name, factory, corpus, queries, truth, k, nprobe, ef_search):
+    start = time.perf_counter()
+    index = build_faiss_index(factory, corpus)
+    index.add(corpus)
+    build_seconds = time.perf_counter() - start
+    apply_search_params(index, nprobe=nprobe, ef_search=ef_search)
+
+    start = time.perf_counter()
+    _, found = index.search(queries, k)
+    latency_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    memory_mb = faiss.serialize_index(index).nbytes / (1024 * 1024)
+    print(
+        f"{name:<28}{recall_at_k(found, truth):>10.3f}{memory_mb:>12.1f}"
+        f"{build_seconds:>12.2f}{latency_ms:>14.3f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[NPROBE])
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[EF_SEARCH])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    clusters = max(8, int(math.sqrt(args.vectors)))
+    # Queries come from the corpus's topics, as questions about a document do.
+    centers = rng.standard_normal((clusters, args.dim)).astype(np.float32)
+    corpus = make_vectors(args.vectors, centers, rng)
+    queries = make_vectors(args.queries, centers, rng)
+
+    flat = faiss.IndexFlatL2(args.dim)
+    flat.add(corpus)
+    _, truth = flat.search(queries, args.k)
+
+    nlist = ivf_nlist(args.vectors)
+    subquantizers = pq_subquantizers(args.dim)
+
+    print(f"{args.vectors} vectors x {args.dim} dims, {args.queries} queries, k={args.k}\n")
+    print(f"{'index':<28}{'recall@k':>10}{'memory MB':>12}{'build s':>12}{'ms/query':>14}")
+    run_case("Flat", "Flat", corpus, queries, truth, args.k, 1, 0)
+    for ef_search in args.ef_search:
+        run_case(f"HNSW32 ef={ef_search}", "HNSW32", corpus, queries, truth, args.k, 1, ef_search)
+    for nprobe in args.nprobe:
+        for label, factory in (
+            ("Flat", f"IVF{nlist},Flat"),
+            ("SQfp16", f"IVF{nlist},SQfp16"),
+            (f"PQ{subquantizers}", f"IVF{nlist},PQ{subquantizers}np"),
+        ):
+            run_case(f"IVF{nlist},{label} np={nprobe}", factory, corpus, queries, truth, args.k, nprobe, 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+HTTP service hosting the chat graphs, so model clients, checkpointer
+connections and PDF indexes live in one tier instead of in every Streamlit
+process.
+
+    uvicorn chat_service:app --port 8000
+    CHAT_SERVICE_URL=http://localhost:8000 streamlit run streamlit_frontend_rag.py
+
+Endpoints (graph is one of `GRAPH_MODULES`, e.g. "rag" or "tools"):
+
+    POST   /graphs/{graph}/threads/{thread_id}/turns        {"message": ...} -> SSE
+    POST   /graphs/{graph}/threads/{thread_id}/turns/cancel
+    GET    /graphs/{graph}/threads/{thread_id}/turns/current
+    GET    /graphs/{graph}/threads/{thread_id}/turns/current/events       -> SSE replay
+    GET    /graphs/{graph}/threads/{thread_id}/messages
+    GET    /graphs/{graph}/threads
+    POST   /graphs/{graph}/threads/{thread_id}/documents    PDF bytes, ?filename=
+    GET    /graphs/{graph}/threads/{thread_id}/documents
+    DELETE /graphs/{graph}/threads/{thread_id}/documents/{filename}
+
+A turn streams `queued`, `tool`, `token` and `done` (or `cancelled`) events (see
+chat_service_client), or an `error` event if the graph fails mid-turn. When the
+client disconnects, the turn is cancelled or left to finish per
+CHAT_ON_DISCONNECT. CHAT_SERVICE_GRAPHS limits which graphs are served; backend
+modules are imported on first use. To run several workers, set
+RAG_SERVING_MODE=1 so they share the PDF indexes.
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+from typing import Dict, Optional
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import iterate_in_threadpool, run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+from admission_control import PROVIDER_GATE, TURN_ADMISSION
+from chat_service_client import GRAPH_MODULES, LocalChatClient
+from tool_outputs import metrics as tool_output_metrics
+from turn_budget import metrics as turn_budget_metrics
+from turn_runner import ON_DISCONNECT, Turn
+
+_ENABLED_GRAPHS = set(os.getenv("CHAT_SERVICE_GRAPHS", ",".join(GRAPH_MODULES)).split(","))
+_CLIENTS: Dict[str, LocalChatClient] = {}
+_CLIENTS_LOCK = threading.Lock()
+
+app = FastAPI(title="LangGraph chat service")
+
+
+class TurnRequest(BaseModel):
+    message: str
+    profile: Optional[bool] = None  # None: CHAT_PROFILE_TURNS
+
+
+def _client(graph: str) -> LocalChatClient:
+    if graph not in GRAPH_MODULES or graph not in _ENABLED_GRAPHS:
+        raise HTTPException(status_code=404, detail=f"Unknown graph '{graph}'")
+    with _CLIENTS_LOCK:
+        if graph not in _CLIENTS:
+            _CLIENTS[graph] = LocalChatClient(graph)
+        return _CLIENTS[graph]
+
+
+def _document_client(graph: str) -> LocalChatClient:
+    client = _client(graph)
+    if not hasattr(client.backend, "ingest_pdf"):
+        raise HTTPException(status_code=404, detail=f"Graph '{graph}' does not support documents")
+    return client
+
+
+def _sse(event: dict) -> str:
+    payload = {key: value for key, value in event.items() if key != "event"}
+    return f"event: {event['event']}\ndata: {json.dumps(payload)}\n\n"
+
+
+@app.get("/healthz")
+def healthz() -> dict:
+    return {
+        "status": "ok",
+        "graphs": sorted(_ENABLED_GRAPHS & set(GRAPH_MODULES)),
+        "admission": TURN_ADMISSION.metrics(),
+        "provider_gate": PROVIDER_GATE.metrics(),
+        "tool_outputs": tool_output_metrics(),
+        "turn_budget": turn_budget_metrics(),
+        "runners": {graph: client.runner.metrics() for graph, client in list(_CLIENTS.items())},
+    }
+
+
+def _event_stream(turn: Optional[Turn], cancel_on_disconnect: bool) -> StreamingResponse:
+    # An async generator, so its `finally` runs when the client disconnects
+    # (Starlette does not close a sync iterator it is reading in a thread).
+    async def events():
+        ended = turn is None
+        try:
+            if turn is not None:
+                async for event in iterate_in_threadpool(turn.events()):
+                    yield _sse(event)
+            ended = True
+        finally:
+            if not ended and cancel_on_disconnect and ON_DISCONNECT != "detach":
+                turn.cancel()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.post("/graphs/{graph}/threads/{thread_id}/turns")
+def start_turn(graph: str, thread_id: str, turn: TurnRequest) -> StreamingResponse:
+    return _event_stream(_client(graph).start_turn(thread_id, turn.message, profile=turn.profile), True)
+
+
+@app.post("/graphs/{graph}/threads/{thread_id}/turns/cancel")
+def cancel_turn(graph: str, thread_id: str) -> dict:
+    return {"cancelled": _client(graph).cancel_turn(thread_id)}
+
+
+@app.get("/graphs/{graph}/threads/{thread_id}/turns/current")
+def turn_status(graph: str, thread_id: str) -> dict:
+    return _client(graph).turn_status(thread_id)
+
+
+@app.get("/graphs/{graph}/threads/{thread_id}/turns/current/events")
+def resume_turn(graph: str, thread_id: str) -> StreamingResponse:
+    # A watcher leaving does not stop the turn.
+    return _event_stream(_client(graph).runner.current(thread_id), False)
+
+
+@app.get("/graphs/{graph}/threads/{thread_id}/messages")
+def get_history(graph: str, thread_id: str) -> dict:
+    return {"thread_id": thread_id, "messages": _client(graph).history(thread_id)}
+
+
+@app.get("/graphs/{graph}/threads/{thread_id}/tool_outputs/{tool_call_id}")
+def get_tool_output(graph: str, thread_id: str, tool_call_id: str) -> dict:
+    return {"tool_call_id": tool_call_id, "output": _client(graph).tool_output(thread_id, tool_call_id)}
+
+
+@app.get("/graphs/{graph}/threads")
+def list_threads(graph: str) -> dict:
+    return {"threads": _client(graph).list_threads()}
+
+
+@app.post("/graphs/{graph}/threads/{thread_id}/documents")
+async def ingest_pdf(
+    graph: str, thread_id: str, request: Request, filename: Optional[str] = None
+) -> dict:
+    client = _document_client(graph)
+    file_bytes = await request.body()
+    try:
+        return await run_in_threadpool(client.ingest_pdf, thread_id, file_bytes, filename)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/graphs/{graph}/threads/{thread_id}/documents")
+def list_documents(graph: str, thread_id: str) -> dict:
+    return _document_client(graph).documents(thread_id)
+
+
+@app.delete("/graphs/{graph}/threads/{thread_id}/documents/{filename}")
+def remove_document(graph: str, thread_id: str, filename: str) -> dict:
+    return {"removed": _document_client(graph).remove_document(thread_id, filename)}
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(
+        app,
+        host=os.getenv("CHAT_SERVICE_HOST", "127.0.0.1"),
+        port=int(os.getenv("CHAT_SERVICE_PORT", "8000")),
+    )
@@ -0,0 +1,278 @@
+"""
+Clients for the chat graphs, shared by the Streamlit frontends and the service.
+
+`LocalChatClient` runs a backend module's graph in this process;
+`ChatServiceClient` calls the same operations on `chat_service.py` over HTTP.
+`make_client(graph)` returns the HTTP client when CHAT_SERVICE_URL is set and
+the in-process one otherwise, so the frontends work either way.
+
+`stream_turn` yields events:
+    {"event": "queued", "position", "eta_seconds", "waited_seconds"}
+                                         waiting for a free slot (see admission_control)
+    {"event": "tool", "name": ...}       a tool ran
+    {"event": "token", "content": ...}   a piece of the assistant's answer
+    {"event": "done", "content": ...}    the full answer ("profile": report path if profiled)
+    {"event": "cancelled", "content": ...}
+                                         the turn was stopped; content is the partial answer
+
+Turns run in the background (see turn_runner): `cancel_turn` stops one, and
+with CHAT_ON_DISCONNECT=detach a turn whose reader went away keeps running,
+so `resume_turn` can replay it after a reconnect. `profile=True` samples the
+turn with profiling.py (None: CHAT_PROFILE_TURNS decides).
+"""
+from __future__ import annotations
+
+import importlib
+import json
+import os
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional
+from urllib.parse import quote
+
+import requests
+from langchain_core.messages import HumanMessage, ToolMessage
+
+from admission_control import TURN_ADMISSION
+from tool_outputs import archived_output
+from turn_runner import ON_DISCONNECT, Turn, TurnRunner
+
+# Graph name -> backend module exposing `chatbot` and `checkpointer`.
+GRAPH_MODULES = {
+    "basic": "langgraph_backend",
+    "database": "langgraph_database_backend",
+    "tools": "langgraph_tool_backend",
+    "rag": "langgraph_rag_backend",
+}
+
+
+# One runner per graph and process, so a rerun Streamlit script (which builds
+# a new client) still finds the turns started before it.
+_RUNNERS: Dict[str, TurnRunner] = {}
+_RUNNERS_LOCK = threading.Lock()
+
+
+class ChatServiceError(RuntimeError):
+    pass
+
+
+def queue_message(event: dict) -> str:
+    """UI text for a "queued" event."""
+    return (
+        f"⏳ Waiting for a free slot (position {event['position']}, "
+        f"about {event['eta_seconds']:.0f}s)…"
+    )
+
+
+def make_client(graph: str):
+    base_url = os.getenv("CHAT_SERVICE_URL")
+    if base_url:
+        return ChatServiceClient(base_url, graph)
+    return LocalChatClient(graph)
+
+
+class LocalChatClient:
+    """Runs the graph of `GRAPH_MODULES[graph]` in the calling process."""
+
+    def __init__(self, graph: str):
+        if graph not in GRAPH_MODULES:
+            raise ValueError(f"Unknown graph '{graph}'")
+        self.graph = graph
+        self.backend = importlib.import_module(GRAPH_MODULES[graph])
+
+    @property
+    def runner(self) -> TurnRunner:
+        with _RUNNERS_LOCK:
+            if self.graph not in _RUNNERS:
+                _RUNNERS[self.graph] = TurnRunner(self.backend.chatbot, TURN_ADMISSION)
+            return _RUNNERS[self.graph]
+
+    def start_turn(self, thread_id: str, message: str, profile: Optional[bool] = None) -> Turn:
+        """Start a turn in the background; read it with `Turn.events()`."""
+        return self.runner.start(str(thread_id), message, profile=profile)
+
+    def stream_turn(self, thread_id: str, message: str, profile: Optional[bool] = None) -> Iterator[dict]:
+        """
+        Run one turn. Only one turn per thread runs at a time and the number of
+        concurrent turns is capped; a queued turn reports its position first.
+        If the caller stops reading early, the turn is cancelled or keeps
+        running according to CHAT_ON_DISCONNECT.
+        """
+        turn = self.start_turn(thread_id, message, profile=profile)
+        finished = False
+        try:
+            yield from _turn_events(turn)
+            finished = True
+        finally:
+            if not finished and ON_DISCONNECT != "detach":
+                turn.cancel()
+
+    def resume_turn(self, thread_id: str) -> Iterator[dict]:
+        """Replay the thread's running or recently finished turn from its start."""
+        turn = self.runner.current(str(thread_id))
+        if turn is not None:
+            yield from _turn_events(turn)
+
+    def turn_status(self, thread_id: str) -> dict:
+        """{"status": "none" | "queued" | "running" | "done" | "cancelled" | "failed", ...}"""
+        turn = self.runner.current(str(thread_id))
+        return turn.summary() if turn is not None else {"thread_id": str(thread_id), "status": "none"}
+
+    def cancel_turn(self, thread_id: str) -> bool:
+        return self.runner.cancel(str(thread_id))
+
+    def history(self, thread_id: str) -> List[dict]:
+        """
+        The thread's messages as {"role": "user" | "assistant" | "tool", "content"};
+        tool messages also carry "tool_call_id" for `tool_output`.
+        """
+        state = self.backend.chatbot.get_state(config={"configurable": {"thread_id": thread_id}})
+        history = []
+        for msg in state.values.get("messages", []):
+            if isinstance(msg, HumanMessage):
+                role = "user"
+            elif isinstance(msg, ToolMessage):
+                role = "tool"
+            else:
+                role = "assistant"
+            entry = {"role": role, "content": msg.content}
+            if role == "tool":
+                entry["tool_call_id"] = msg.tool_call_id
+            history.append(entry)
+        return history
+
+    def tool_output(self, thread_id: str, tool_call_id: str) -> Optional[str]:
+        """A tool call's full result; the model only saw a compacted one (see tool_outputs)."""
+        return archived_output(str(thread_id), tool_call_id)
+
+    def list_threads(self) -> List[str]:
+        checkpointer = self.backend.checkpointer
+        if hasattr(checkpointer, "thread_ids"):
+            return [str(thread_id) for thread_id in checkpointer.thread_ids()]
+        # Savers without it (the basic graph's InMemorySaver): scan every checkpoint.
+        threads = {
+            str(checkpoint.config["configurable"]["thread_id"]) for checkpoint in checkpointer.list(None)
+        }
+        return list(threads)
+
+    # -------------------
+    # Documents (rag graph only)
+    # -------------------
+    def _rag_backend(self):
+        if not hasattr(self.backend, "ingest_pdf"):
+            raise ValueError(f"Graph '{self.graph}' does not support documents")
+        return self.backend
+
+    def ingest_pdf(self, thread_id: str, file_bytes: bytes, filename: Optional[str] = None) -> dict:
+        return self._rag_backend().ingest_pdf(file_bytes, thread_id=thread_id, filename=filename)
+
+    def documents(self, thread_id: str) -> dict:
+        return self._rag_backend().thread_document_metadata(thread_id)
+
+    def remove_document(self, thread_id: str, filename: str) -> bool:
+        return self._rag_backend().remove_document(thread_id, filename)
+
+
+class ChatServiceClient:
+    """`LocalChatClient`'s interface over HTTP, against `chat_service.py`."""
+
+    def __init__(self, base_url: str, graph: str, timeout: float = 30.0):
+        self.base_url = base_url.rstrip("/")
+        self.graph = graph
+        self.timeout = timeout
+        self._session = requests.Session()
+
+    def _url(self, *parts: str) -> str:
+        """/graphs/<graph>/threads[/<part>...], each part URL-quoted."""
+        return "/".join(
+            [f"{self.base_url}/graphs/{self.graph}/threads", *(quote(str(p), safe="") for p in parts)]
+        )
+
+    def _json(self, method: str, url: str, **kwargs) -> dict:
+        response = self._session.request(method, url, timeout=self.timeout, **kwargs)
+        if response.status_code >= 400:
+            raise ChatServiceError(_error_detail(response))
+        return response.json()
+
+    def stream_turn(self, thread_id: str, message: str, profile: Optional[bool] = None) -> Iterator[dict]:
+        # No read timeout: a turn may wait on tools for a long time between tokens.
+        with self._session.post(
+            self._url(thread_id, "turns"),
+            json={"message": message, "profile": profile},
+            stream=True,
+            timeout=(self.timeout, None),
+        ) as response:
+            yield from self._turn_stream(response)
+
+    def _turn_stream(self, response: requests.Response) -> Iterator[dict]:
+        if response.status_code >= 400:
+            raise ChatServiceError(_error_detail(response))
+        for event in _parse_sse(response.iter_lines(decode_unicode=True)):
+            if event["event"] == "error":
+                raise ChatServiceError(event.get("detail", "turn failed"))
+            yield event
+
+    def resume_turn(self, thread_id: str) -> Iterator[dict]:
+        with self._session.get(
+            self._url(thread_id, "turns", "current", "events"),
+            stream=True,
+            timeout=(self.timeout, None),
+        ) as response:
+            yield from self._turn_stream(response)
+
+    def turn_status(self, thread_id: str) -> dict:
+        return self._json("GET", self._url(thread_id, "turns", "current"))
+
+    def cancel_turn(self, thread_id: str) -> bool:
+        return self._json("POST", self._url(thread_id, "turns", "cancel"))["cancelled"]
+
+    def history(self, thread_id: str) -> List[dict]:
+        return self._json("GET", self._url(thread_id, "messages"))["messages"]
+
+    def list_threads(self) -> List[str]:
+        return self._json("GET", self._url())["threads"]
+
+    def tool_output(self, thread_id: str, tool_call_id: str) -> Optional[str]:
+        return self._json("GET", self._url(thread_id, "tool_outputs", tool_call_id))["output"]
+
+    def ingest_pdf(self, thread_id: str, file_bytes: bytes, filename: Optional[str] = None) -> dict:
+        return self._json(
+            "POST",
+            self._url(thread_id, "documents"),
+            params={"filename": filename} if filename else None,
+            data=file_bytes,
+            headers={"Content-Type": "application/pdf"},
+        )
+
+    def documents(self, thread_id: str) -> dict:
+        return self._json("GET", self._url(thread_id, "documents"))
+
+    def remove_document(self, thread_id: str, filename: str) -> bool:
+        return self._json("DELETE", self._url(thread_id, "documents", filename))["removed"]
+
+
+def _turn_events(turn: Turn) -> Iterator[dict]:
+    for event in turn.events():
+        if event["event"] == "error" and turn.error is not None:
+            raise turn.error
+        yield event
+
+
+def _error_detail(response: requests.Response) -> str:
+    try:
+        return str(response.json().get("detail", response.text))
+    except ValueError:
+        return response.text or f"HTTP {response.status_code}"
+
+
+def _parse_sse(lines: Iterable[str]) -> Iterator[dict]:
+    """Decode `event:`/`data:` server-sent events carrying JSON payloads."""
+    event_type, data = "message", []
+    for line in lines:
+        if not line:
+            if data:
+                yield {"event": event_type, **json.loads("\n".join(data))}
+            event_type, data = "message", []
+        elif line.startswith("event:"):
+            event_type = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
@@ -0,0 +1,288 @@
+"""
+Checkpoints spread over several SQLite files by thread.
+
+SQLite commits one writer at a time per file, so with every thread in
+`chatbot.db` the checkpoint writes of concurrent turns queue behind each
+other. With CHECKPOINT_SHARDS=N (see `checkpointing.make_checkpointer`) the
+graphs use `ShardedSaver` instead, which places each thread on one of N
+files, `chatbot.shard0.db` ... `chatbot.shard{N-1}.db`, each with its own
+connection, lock and background writer.
+
+Threads are placed by consistent hashing of thread_id, so changing N moves
+only about 1/N of them. shard_checkpoints.py splits an existing single-file
+database into shards and moves threads when N changes; run it while the app
+is stopped.
+"""
+from __future__ import annotations
+
+import bisect
+import glob
+import hashlib
+import os
+import re
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
+
+from langgraph.checkpoint.base import BaseCheckpointSaver
+
+from checkpointing import _MESSAGES_SCHEMA, DeferredSqliteSaver
+
+VIRTUAL_NODES = 64  # ring points per shard; more points, more even spread
+
+
+def shard_name(index: int) -> str:
+    return f"shard{index}"
+
+
+def shard_path(path: str, name: str) -> str:
+    """chatbot.db, shard3 -> chatbot.shard3.db"""
+    stem, ext = os.path.splitext(path)
+    return f"{stem}.{name}{ext or '.db'}"
+
+
+def existing_shards(path: str) -> Dict[str, str]:
+    """The shard files of `path` on disk: name -> file path."""
+    stem, ext = os.path.splitext(path)
+    pattern = re.compile(re.escape(f"{stem}.") + r"(shard\d+)" + re.escape(ext or ".db") + "$")
+    found = {}
+    for candidate in glob.glob(f"{glob.escape(stem)}.shard*{ext or '.db'}"):
+        match = pattern.match(candidate)
+        if match:
+            found[match.group(1)] = candidate
+    return dict(sorted(found.items(), key=lambda item: int(item[0][len("shard"):])))
+
+
+def _point(key: str) -> int:
+    # Stable across processes, unlike hash().
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent-hash ring mapping thread ids to shard names."""
+
+    def __init__(self, names: Sequence[str], virtual_nodes: int = VIRTUAL_NODES):
+        if not names:
+            raise ValueError("a hash ring needs at least one shard")
+        points = sorted((_point(f"{name}#{i}"), name) for name in names for i in range(virtual_nodes))
+        self.names = list(names)
+        self._points = [point for point, _ in points]
+        self._owners = [name for _, name in points]
+
+    def owner(self, thread_id: str) -> str:
+        index = bisect.bisect(self._points, _point(str(thread_id))) % len(self._points)
+        return self._owners[index]
+
+
+class ShardedSaver(BaseCheckpointSaver):
+    """
+    Routes each thread's checkpoints to one of several savers.
+
+    Per-thread calls go to the thread's shard; `list` without a thread and
+    `thread_ids` query every shard in parallel and merge the results.
+    """
+
+    def __init__(self, savers: Dict[str, DeferredSqliteSaver], virtual_nodes: int = VIRTUAL_NODES):
+        first = next(iter(savers.values()))
+        super().__init__(serde=first.serde)
+        self.savers = savers
+        self.ring = HashRing(list(savers), virtual_nodes)
+        self._pool = ThreadPoolExecutor(max_workers=len(savers), thread_name_prefix="checkpoint-shard")
+
+    @classmethod
+    def open(
+        cls,
+        path: str,
+        shards: int,
+        saver_class: type = DeferredSqliteSaver,
+        **kwargs: Any,
+    ) -> "ShardedSaver":
+        """Open (creating as needed) the `shards` files of database `path`."""
+        savers = {
+            shard_name(index): saver_class(
+                sqlite3.connect(shard_path(path, shard_name(index)), check_same_thread=False), **kwargs
+            )
+            for index in range(shards)
+        }
+        return cls(savers)
+
+    def saver_for(self, thread_id: str) -> DeferredSqliteSaver:
+        return self.savers[self.ring.owner(str(thread_id))]
+
+    def _routed(self, config) -> DeferredSqliteSaver:
+        return self.saver_for(config["configurable"]["thread_id"])
+
+    # -------------------
+    # Per-thread calls
+    # -------------------
+    def get_tuple(self, config):
+        return self._routed(config).get_tuple(config)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        return self._routed(config).put(config, checkpoint, metadata, new_versions)
+
+    def put_writes(self, config, writes, task_id: str, task_path: str = "") -> None:
+        self._routed(config).put_writes(config, writes, task_id, task_path)
+
+    def delete_thread(self, thread_id: str) -> None:
+        self.saver_for(thread_id).delete_thread(thread_id)
+
+    def get_delta_channel_history(self, *, config, channels):
+        return self._routed(config).get_delta_channel_history(config=config, channels=channels)
+
+    def get_next_version(self, current, channel):
+        return next(iter(self.savers.values())).get_next_version(current, channel)
+
+    # -------------------
+    # Fan-out
+    # -------------------
+    def list(self, config, *, filter=None, before=None, limit=None) -> Iterator[Any]:
+        if config is not None and "thread_id" in config.get("configurable", {}):
+            yield from self._routed(config).list(config, filter=filter, before=before, limit=limit)
+            return
+
+        def read(saver):
+            return list(saver.list(config, filter=filter, before=before, limit=limit))
+
+        found = [saved for shard in self._pool.map(read, self.savers.values()) for saved in shard]
+        # Newest first across shards, as a single file returns them.
+        found.sort(key=lambda saved: saved.config["configurable"]["checkpoint_id"], reverse=True)
+        yield from found[:limit] if limit is not None else found
+
+    def thread_ids(self) -> List[str]:
+        shards = self._pool.map(lambda saver: saver.thread_ids(), self.savers.values())
+        return [thread_id for thread_ids in shards for thread_id in thread_ids]
+
+    # -------------------
+    # DeferredSqliteSaver interface
+    # -------------------
+    @property
+    def durability(self) -> str:
+        return next(iter(self.savers.values())).durability
+
+    @property
+    def graph_durability(self) -> str:
+        return next(iter(self.savers.values())).graph_durability
+
+    def flush(self) -> None:
+        for _ in self._pool.map(lambda saver: saver.flush(), self.savers.values()):
+            pass
+
+    def close(self) -> None:
+        for saver in self.savers.values():
+            saver.close()
+        self._pool.shutdown(wait=False)
+
+    def write_seconds(self, thread_id: str) -> float:
+        return self.saver_for(thread_id).write_seconds(thread_id)
+
+    def metrics(self) -> dict:
+        shards = {name: saver.metrics() for name, saver in self.savers.items()}
+        commits = sum(m["commits"] for m in shards.values())
+
+        def per_commit(key: str) -> float:
+            if not commits:
+                return 0.0
+            return round(sum(m[key] * m["commits"] for m in shards.values()) / commits, 2)
+
+        cache: Dict[str, int] = {}
+        for m in shards.values():
+            for key, value in m["latest_cache"].items():
+                cache[key] = cache.get(key, 0) + value
+        return {
+            "durability": self.durability,
+            "pending_statements": sum(m["pending_statements"] for m in shards.values()),
+            "commits": commits,
+            "statements_per_commit": per_commit("statements_per_commit"),
+            "threads_per_commit": per_commit("threads_per_commit"),
+            "commit_ms_mean": per_commit("commit_ms_mean"),
+            "latest_cache": cache,
+            "shards": {name: m["commits"] for name, m in shards.items()},
+        }
+
+
+# -------------------
+# Moving threads between files (shard_checkpoints.py)
+# -------------------
+def database_threads(path: str) -> List[str]:
+    with closing(sqlite3.connect(path)) as conn:
+        if not _has_table(conn, "main", "checkpoints"):
+            return []
+        return [row[0] for row in conn.execute("SELECT DISTINCT thread_id FROM checkpoints")]
+
+
+def copy_threads(source: str, target: str, thread_ids: Sequence[str], delete: bool) -> int:
+    """
+    Copy the rows of `thread_ids` (checkpoints, writes and stored messages)
+    from `source` to `target` as they are, without deserializing, and with
+    `delete` remove them from `source` in the same transaction. Rerunning
+    after an interruption is safe. Returns the number of checkpoints copied.
+    """
+    if not thread_ids:
+        return 0
+    # Create the target's tables with the savers' own schema.
+    with closing(sqlite3.connect(target, check_same_thread=False)) as conn:
+        DeferredSqliteSaver(conn, durability="sync").setup()
+    with closing(sqlite3.connect(target)) as conn:
+        conn.execute("ATTACH DATABASE ? AS src", (source,))
+        tables = ["checkpoints", "writes"]
+        if _has_table(conn, "src", "messages"):
+            conn.executescript(_MESSAGES_SCHEMA)
+            tables.append("messages")
+        conn.execute("CREATE TEMP TABLE moving (thread_id TEXT PRIMARY KEY)")
+        conn.executemany("INSERT OR IGNORE INTO temp.moving VALUES (?)", [(str(t),) for t in thread_ids])
+        copied = conn.execute(
+            "SELECT COUNT(*) FROM src.checkpoints WHERE thread_id IN (SELECT thread_id FROM temp.moving)"
+        ).fetchone()[0]
+        with conn:
+            for table in tables:
+                columns = ", ".join(_shared_columns(conn, table))
+                conn.execute(
+                    f"INSERT OR REPLACE INTO main.{table} ({columns}) SELECT {columns} FROM src.{table} "
+                    "WHERE thread_id IN (SELECT thread_id FROM temp.moving)"
+                )
+                if delete:
+                    conn.execute(
+                        f"DELETE FROM src.{table} WHERE thread_id IN (SELECT thread_id FROM temp.moving)"
+                    )
+        conn.execute("DETACH DATABASE src")
+    return copied
+
+
+def _has_table(conn: sqlite3.Connection, schema: str, table: str) -> bool:
+    row = conn.execute(
+        f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = ?", (table,)
+    ).fetchone()
+    return row is not None
+
+
+def _shared_columns(conn: sqlite3.Connection, table: str) -> List[str]:
+    # Older files may lack columns added since (e.g. writes.task_path).
+    source = {row[1] for row in conn.execute(f"PRAGMA src.table_info({table})")}
+    return [row[1] for row in conn.execute(f"PRAGMA main.table_info({table})") if row[1] in source]
+
+
+def plan_moves(path: str, shards: int, virtual_nodes: int = VIRTUAL_NODES) -> Dict[Tuple[str, str], List[str]]:
+    """For a rebalance to `shards` shards: (from shard, to shard) -> thread ids."""
+    ring = HashRing([shard_name(index) for index in range(shards)], virtual_nodes)
+    moves: Dict[Tuple[str, str], List[str]] = {}
+    for name, file_path in existing_shards(path).items():
+        for thread_id in database_threads(file_path):
+            owner = ring.owner(thread_id)
+            if owner != name:
+                moves.setdefault((name, owner), []).append(thread_id)
+    return moves
+
+
+def split_plan(path: str, shards: int, virtual_nodes: int = VIRTUAL_NODES) -> Dict[str, List[str]]:
+    """For splitting single-file database `path`: shard -> thread ids."""
+    ring = HashRing([shard_name(index) for index in range(shards)], virtual_nodes)
+    plan: Dict[str, List[str]] = {}
+    for thread_id in database_threads(path):
+        plan.setdefault(ring.owner(thread_id), []).append(thread_id)
+    return plan
+
+
+def shard_counts(path: str) -> Dict[str, int]:
+    return {name: len(database_threads(file_path)) for name, file_path in existing_shards(path).items()}
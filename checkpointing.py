@@ -0,0 +1,818 @@
+"""
+SQLite checkpointer with a configurable durability mode.
+
+`SqliteSaver` commits every checkpoint and every task's writes as its own
+transaction, so a tool-using turn waits for a commit (and its fsync) between
+the tool result and the next model call. CHECKPOINT_DURABILITY chooses how
+the graphs persist instead:
+
+    sync   (default) every step is committed before the next one runs.
+           A crash loses nothing that was streamed to the user.
+    async  steps are serialized into a buffer and a background writer commits
+           whatever all threads buffered every CHECKPOINT_FLUSH_MS, in one
+           transaction. A turn is flushed before its `done` event, so a
+           finished turn is always on disk; a crash can lose the intermediate
+           steps of turns still running (they restart from their last
+           committed step, which may be before the user's message).
+    exit   LangGraph only checkpoints a turn when it ends (`durability="exit"`),
+           through the same buffer, flushed before `done`. A crash mid-turn
+           loses the whole turn, including the user's message.
+
+Reads (`get_tuple`, `list`, ...) flush the buffer first, so every reader in
+this process sees its own writes. Other processes see buffered steps only
+after the flush.
+
+The latest checkpoint of the CHECKPOINT_LATEST_CACHE most recently used
+threads (default 256, 0 disables) is kept deserialized in memory and updated
+as this process writes, so `get_state` and the start of a turn skip SQLite.
+A hit costs one `PRAGMA data_version` read; when another connection has
+committed since, the entry is checked against the table (latest checkpoint
+id and write count) before it is used.
+
+With CHECKPOINT_MESSAGE_STORE=1 the graphs use `MessageStoreSaver`, which
+stores each message once rather than in every checkpoint (migrate existing
+databases with migrate_checkpoints.py). With CHECKPOINT_SHARDS=N (N > 1) the
+threads are spread over N files (see checkpoint_shards.py).
+"""
+from __future__ import annotations
+
+import atexit
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import closing, contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+    writes_sort_key,
+)
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+DURABILITY = os.getenv("CHECKPOINT_DURABILITY", "sync").strip().lower()
+FLUSH_MS = float(os.getenv("CHECKPOINT_FLUSH_MS", "50"))
+
+DURABILITY_MODES = ("sync", "async", "exit")
+MESSAGE_STORE = os.getenv("CHECKPOINT_MESSAGE_STORE", "0").strip().lower() in ("1", "true", "yes")
+LATEST_CACHE = int(os.getenv("CHECKPOINT_LATEST_CACHE", "256"))
+SHARDS = int(os.getenv("CHECKPOINT_SHARDS", "1"))
+
+_INSERT_CHECKPOINT = (
+    "INSERT OR REPLACE INTO checkpoints (thread_id, checkpoint_ns, checkpoint_id, "
+    "parent_checkpoint_id, type, checkpoint, metadata) VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+_INSERT_WRITES = (
+    "INSERT OR {conflict} INTO writes (thread_id, checkpoint_ns, checkpoint_id, task_id, "
+    "task_path, idx, channel, type, value) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+_MESSAGES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    thread_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    type TEXT,
+    value BLOB,
+    PRIMARY KEY (thread_id, seq)
+);
+CREATE UNIQUE INDEX IF NOT EXISTS messages_by_hash ON messages (thread_id, hash);
+"""
+# A plain INSERT: a sequence number another process took first must fail the
+# write, not be skipped (see MessageStoreSaver).
+_INSERT_MESSAGE = "INSERT INTO messages (thread_id, seq, hash, type, value) VALUES (?, ?, ?, ?, ?)"
+# A buffered MessageStoreSaver checkpoint, stored when the buffer is flushed.
+_STORE_CHECKPOINT = "-- message store checkpoint"
+_SEQ_ATTEMPTS = 5
+_MESSAGE_REFS = "__message_refs__"
+_LATEST_CHECKPOINT = (
+    "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+    "ORDER BY checkpoint_id DESC LIMIT 1"
+)
+_COUNT_WRITES = (
+    "SELECT COUNT(*) FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?"
+)
+
+
+class _LatestCheckpoint:
+    """A thread's latest checkpoint as `get_tuple` returns it, plus its writes."""
+
+    __slots__ = ("config", "checkpoint", "metadata", "parent_config", "writes", "data_version")
+
+    def __init__(self, config, checkpoint, metadata, parent_config, data_version: int):
+        self.config = config
+        self.checkpoint = checkpoint
+        self.metadata = metadata
+        self.parent_config = parent_config
+        # (task_id, idx) -> (task_path, channel, value), as in the writes table
+        self.writes: Dict[Tuple[str, int], Tuple[str, str, Any]] = {}
+        # PRAGMA data_version when the entry was last known to match the table.
+        self.data_version = data_version
+
+    @property
+    def checkpoint_id(self) -> str:
+        return self.config["configurable"]["checkpoint_id"]
+
+    def to_tuple(self, config=None) -> CheckpointTuple:
+        # Fresh containers, as a read from SQLite would give; the messages
+        # themselves are shared and, like the graph's, never mutated.
+        checkpoint = {
+            **self.checkpoint,
+            "channel_values": {
+                name: list(value) if isinstance(value, list) else value
+                for name, value in self.checkpoint["channel_values"].items()
+            },
+            "channel_versions": dict(self.checkpoint["channel_versions"]),
+            "versions_seen": {name: dict(seen) for name, seen in self.checkpoint["versions_seen"].items()},
+        }
+        writes = sorted(self.writes.items(), key=lambda item: writes_sort_key(item[1][0], *item[0]))
+        return CheckpointTuple(
+            config or self.config,
+            checkpoint,
+            dict(self.metadata),
+            self.parent_config,
+            [(task_id, channel, value) for (task_id, _), (_, channel, value) in writes],
+        )
+
+
+class DeferredSqliteSaver(SqliteSaver):
+    """`SqliteSaver` that can buffer writes and group-commit them (see module docstring)."""
+
+    def __init__(
+        self,
+        conn: sqlite3.Connection,
+        durability: str = DURABILITY,
+        flush_ms: float = FLUSH_MS,
+        latest_cache: int = LATEST_CACHE,
+        **kwargs: Any,
+    ):
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"durability must be one of {DURABILITY_MODES}, not '{durability}'")
+        super().__init__(conn, **kwargs)
+        self.durability = durability
+        self.flush_ms = flush_ms
+
+        self._pending: List[Tuple[str, List[tuple]]] = []
+        self._pending_lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # one flush at a time, in order
+        self._wake = threading.Event()
+        self._closed = False
+        self._error: Optional[BaseException] = None
+
+        self._stats_lock = threading.Lock()
+        self._write_seconds: Dict[str, float] = {}  # thread_id -> time callers spent writing
+        self._commits = 0
+        self._statements = 0
+        self._threads_per_commit = 0
+        self._commit_seconds = 0.0
+
+        self.latest_cache = latest_cache
+        self._latest: "OrderedDict[Tuple[str, str], _LatestCheckpoint]" = OrderedDict()
+        self._latest_lock = threading.Lock()
+        self._data_version = -1  # last PRAGMA data_version read
+        self._cache_stats = {"hits": 0, "misses": 0, "revalidated": 0, "invalidated": 0}
+
+        if self.deferred:
+            threading.Thread(
+                target=_writer_loop, args=(weakref.ref(self),), name="checkpoint-writer", daemon=True
+            ).start()
+            atexit.register(_flush_at_exit, weakref.ref(self))
+
+    @property
+    def deferred(self) -> bool:
+        return self.durability != "sync"
+
+    @property
+    def graph_durability(self) -> str:
+        """The `durability` to run graphs with: LangGraph's "exit", else "sync"
+        (a buffered put is already cheap, so there is nothing to overlap)."""
+        return "exit" if self.durability == "exit" else "sync"
+
+    # -------------------
+    # Writes
+    # -------------------
+    def put(self, config, checkpoint, metadata, new_versions):
+        start = time.perf_counter()
+        try:
+            self._write(self._checkpoint_statements(config, checkpoint, metadata))
+        except Exception:
+            self._forget_latest(_thread_key(config))
+            raise
+        finally:
+            self._record_write(config, start)
+        configurable = config["configurable"]
+        saved_config = {
+            "configurable": {
+                "thread_id": configurable["thread_id"],
+                "checkpoint_ns": configurable["checkpoint_ns"],
+                "checkpoint_id": checkpoint["id"],
+            }
+        }
+        if self.latest_cache > 0:
+            self._cache_checkpoint(config, saved_config, checkpoint, metadata)
+        return saved_config
+
+    def put_writes(self, config, writes: Sequence[Tuple[str, Any]], task_id: str, task_path: str = "") -> None:
+        start = time.perf_counter()
+        try:
+            configurable = config["configurable"]
+            conflict = "REPLACE" if all(w[0] in WRITES_IDX_MAP for w in writes) else "IGNORE"
+            rows = [
+                (
+                    str(configurable["thread_id"]),
+                    str(configurable["checkpoint_ns"]),
+                    str(configurable["checkpoint_id"]),
+                    task_id,
+                    task_path,
+                    WRITES_IDX_MAP.get(channel, idx),
+                    channel,
+                    *self.serde.dumps_typed(value),
+                )
+                for idx, (channel, value) in enumerate(writes)
+            ]
+            self._write([(_INSERT_WRITES.format(conflict=conflict), rows)])
+        except Exception:
+            self._forget_latest(_thread_key(config))
+            raise
+        finally:
+            self._record_write(config, start)
+        if self.latest_cache > 0:
+            self._cache_writes(config, writes, task_id, task_path, replace=conflict == "REPLACE")
+
+    # -------------------
+    # Reads
+    # -------------------
+    def get_tuple(self, config):
+        if self.latest_cache <= 0:
+            return self._load_tuple(config)
+        key = _thread_key(config)
+        checkpoint_id = get_checkpoint_id(config)
+        cached = self._cached_latest(key, checkpoint_id)
+        if cached is not None:
+            return cached.to_tuple(config if checkpoint_id else None)
+        # Read the version first: a commit by another process during the load
+        # then triggers a check on the next hit.
+        data_version = self._read_data_version()
+        saved = self._load_tuple(config)
+        # Pending writes are rare at rest (an interrupted step) and come back
+        # without their `idx`, so only a clean checkpoint is cached from a read.
+        if saved is not None and checkpoint_id is None and not saved.pending_writes:
+            self._store_latest(key, saved, data_version)
+        return saved
+
+    def thread_ids(self) -> List[str]:
+        """Every thread with a checkpoint, without loading any checkpoint."""
+        with self.cursor(transaction=False) as cur:
+            return [row[0] for row in cur.execute("SELECT DISTINCT thread_id FROM checkpoints")]
+
+    def delete_thread(self, thread_id: str) -> None:
+        super().delete_thread(thread_id)
+        with self._latest_lock:
+            for key in [key for key in self._latest if key[0] == str(thread_id)]:
+                del self._latest[key]
+
+    @contextmanager
+    def cursor(self, transaction: bool = True) -> Iterator[sqlite3.Cursor]:
+        # Every read and `delete_thread` go through here: persist the buffer first.
+        self.flush()
+        with super().cursor(transaction) as cur:
+            yield cur
+
+    def flush(self) -> None:
+        """Commit everything buffered so far, from every thread, in one transaction."""
+        if not self.deferred:
+            return
+        with self._flush_lock:
+            with self._pending_lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                self._raise_pending_error()
+                return
+            start = time.perf_counter()
+            try:
+                self._commit_batch(batch)
+            except Exception as e:
+                # Keep the rows for the next attempt and report to the next caller.
+                with self._pending_lock:
+                    self._pending[:0] = batch
+                self._error = e
+                raise
+            self._error = None
+            self._count_commit(
+                len(batch), len({rows[0][0] for _, rows in batch}), time.perf_counter() - start
+            )
+
+    def close(self) -> None:
+        """Flush and stop the background writer."""
+        self._closed = True
+        self._wake.set()
+        self.flush()
+
+    # -------------------
+    # Measurements
+    # -------------------
+    def write_seconds(self, thread_id: str) -> float:
+        """Total time `put`/`put_writes` have blocked the given thread's turns."""
+        with self._stats_lock:
+            return self._write_seconds.get(str(thread_id), 0.0)
+
+    def metrics(self) -> dict:
+        with self._pending_lock:
+            pending = len(self._pending)
+        with self._stats_lock:
+            commits = self._commits
+            return {
+                "durability": self.durability,
+                "pending_statements": pending,
+                "commits": commits,
+                "statements_per_commit": round(self._statements / commits, 2) if commits else 0.0,
+                "threads_per_commit": round(self._threads_per_commit / commits, 2) if commits else 0.0,
+                "commit_ms_mean": round(1000 * self._commit_seconds / commits, 3) if commits else 0.0,
+                "latest_cache": {"threads": len(self._latest), **self._cache_stats},
+            }
+
+    # -------------------
+    # Internals
+    # -------------------
+    def _checkpoint_statements(self, config, checkpoint, metadata) -> List[Tuple[str, List[tuple]]]:
+        """The (sql, rows) statements that store one checkpoint."""
+        configurable = config["configurable"]
+        type_, serialized_checkpoint = self.serde.dumps_typed(checkpoint)
+        serialized_metadata = json.dumps(
+            get_checkpoint_metadata(config, metadata), ensure_ascii=False
+        ).encode("utf-8", "ignore")
+        row = (
+            str(configurable["thread_id"]),
+            configurable["checkpoint_ns"],
+            checkpoint["id"],
+            configurable.get("checkpoint_id"),
+            type_,
+            serialized_checkpoint,
+            serialized_metadata,
+        )
+        return [(_INSERT_CHECKPOINT, [row])]
+
+    def _commit_batch(self, batch: List[Tuple[str, List[tuple]]]) -> None:
+        """Run buffered statements in one transaction; rolled back if any fails."""
+        with self.lock:
+            self.setup()
+            cur = self.conn.cursor()
+            try:
+                for sql, rows in batch:
+                    cur.executemany(sql, rows)
+                self.conn.commit()
+            except BaseException:
+                self.conn.rollback()
+                raise
+            finally:
+                cur.close()
+
+    def _write(self, statements: List[Tuple[str, List[tuple]]]) -> None:
+        """Commit the statements together now (sync), or buffer them for the writer."""
+        statements = [(sql, rows) for sql, rows in statements if rows]
+        if not statements:
+            return
+        if self.deferred:
+            with self._pending_lock:
+                self._pending.extend(statements)
+            self._wake.set()
+            return
+        start = time.perf_counter()
+        with self.cursor() as cur:
+            try:
+                for sql, rows in statements:
+                    cur.executemany(sql, rows)
+            except BaseException:
+                self.conn.rollback()  # nothing of a failed put is committed
+                raise
+        self._count_commit(len(statements), 1, time.perf_counter() - start)
+
+    def _record_write(self, config, start: float) -> None:
+        thread_id = str(config["configurable"]["thread_id"])
+        elapsed = time.perf_counter() - start
+        with self._stats_lock:
+            self._write_seconds[thread_id] = self._write_seconds.get(thread_id, 0.0) + elapsed
+
+    def _count_commit(self, statements: int, threads: int, seconds: float) -> None:
+        with self._stats_lock:
+            self._commits += 1
+            self._statements += statements
+            self._threads_per_commit += threads
+            self._commit_seconds += seconds
+
+    def _raise_pending_error(self) -> None:
+        if self._error is not None:
+            raise self._error
+
+    def _load_tuple(self, config) -> Optional[CheckpointTuple]:
+        """Read a checkpoint from SQLite, bypassing the latest-checkpoint cache."""
+        return super().get_tuple(config)
+
+    def _read_data_version(self) -> int:
+        # Changes whenever another connection commits to the file, never for
+        # this connection's own commits, so reading it needs no flush.
+        with self.lock:
+            self._data_version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+            return self._data_version
+
+    def _cached_latest(self, key: Tuple[str, str], checkpoint_id: Optional[str]):
+        """The cached latest checkpoint for `key`, if it is still current."""
+        with self._latest_lock:
+            entry = self._latest.get(key)
+        if entry is None or (checkpoint_id is not None and checkpoint_id != entry.checkpoint_id):
+            self._count_cache("misses")
+            return None
+        data_version = self._read_data_version()
+        if data_version != entry.data_version:
+            # Another connection committed something: check that it was not
+            # a newer checkpoint or more writes for this thread.
+            with self.cursor(transaction=False) as cur:
+                latest = cur.execute(_LATEST_CHECKPOINT, key).fetchone()
+                writes = cur.execute(_COUNT_WRITES, (*key, entry.checkpoint_id)).fetchone()[0]
+            if latest is None or latest[0] != entry.checkpoint_id or writes != len(entry.writes):
+                self._forget_latest(key)
+                self._count_cache("invalidated")
+                self._count_cache("misses")
+                return None
+            entry.data_version = data_version
+            self._count_cache("revalidated")
+        with self._latest_lock:
+            if key in self._latest:
+                self._latest.move_to_end(key)
+        self._count_cache("hits")
+        return entry
+
+    def _store_latest(self, key: Tuple[str, str], saved: CheckpointTuple, data_version: int) -> None:
+        entry = _LatestCheckpoint(
+            saved.config, saved.checkpoint, saved.metadata, saved.parent_config, data_version
+        )
+        entry.checkpoint = entry.to_tuple().checkpoint  # keep a copy the caller cannot change
+        with self._latest_lock:
+            current = self._latest.get(key)
+            # A `put` from another thread while this one was loading wins.
+            if current is not None and current.checkpoint_id >= entry.checkpoint_id:
+                return
+            self._remember_latest(key, entry)
+
+    def _cache_checkpoint(self, config, saved_config, checkpoint, metadata) -> None:
+        key = _thread_key(config)
+        parent_id = config["configurable"].get("checkpoint_id")
+        with self._latest_lock:
+            previous = self._latest.get(key)
+        entry = _LatestCheckpoint(
+            saved_config,
+            checkpoint,
+            # As stored: JSON, with the config's metadata merged in.
+            json.loads(json.dumps(get_checkpoint_metadata(config, metadata), ensure_ascii=False)),
+            {"configurable": {**saved_config["configurable"], "checkpoint_id": parent_id}}
+            if parent_id
+            else None,
+            # Commits by other connections since the entry was last current
+            # (or since this process last looked) still trigger a check.
+            previous.data_version if previous is not None else self._data_version,
+        )
+        entry.checkpoint = entry.to_tuple().checkpoint
+        with self._latest_lock:
+            self._remember_latest(key, entry)
+
+    def _cache_writes(self, config, writes, task_id: str, task_path: str, replace: bool) -> None:
+        key = _thread_key(config)
+        with self._latest_lock:
+            entry = self._latest.get(key)
+            if entry is None or entry.checkpoint_id != config["configurable"]["checkpoint_id"]:
+                return
+            for idx, (channel, value) in enumerate(writes):
+                write_key = (task_id, WRITES_IDX_MAP.get(channel, idx))
+                if replace or write_key not in entry.writes:
+                    entry.writes[write_key] = (task_path, channel, value)
+
+    def _remember_latest(self, key: Tuple[str, str], entry: _LatestCheckpoint) -> None:
+        # Called with `_latest_lock` held.
+        self._latest[key] = entry
+        self._latest.move_to_end(key)
+        while len(self._latest) > self.latest_cache:
+            self._latest.popitem(last=False)
+
+    def _forget_latest(self, key: Tuple[str, str]) -> None:
+        with self._latest_lock:
+            self._latest.pop(key, None)
+
+    def _count_cache(self, name: str) -> None:
+        with self._stats_lock:
+            self._cache_stats[name] += 1
+
+
+class _ThreadMessages:
+    """A thread's stored messages: content hash -> sequence number."""
+
+    __slots__ = ("seq_by_hash", "next_seq", "last")
+
+    def __init__(self, seq_by_hash: Dict[str, int]):
+        self.seq_by_hash = seq_by_hash
+        self.next_seq = max(seq_by_hash.values(), default=-1) + 1
+        # The previous checkpoint's (message, seq) pairs: the graph passes the
+        # same message objects from step to step, so they need no re-hashing.
+        self.last: List[Tuple[Any, int]] = []
+
+
+class MessageStoreSaver(DeferredSqliteSaver):
+    """
+    Stores each message of a thread once instead of once per checkpoint.
+
+    `SqliteSaver` serializes the whole `messages` list into every checkpoint,
+    so a thread of N messages holds about N²/2 copies. Here messages go to a
+    `messages` table under a per-thread sequence number (deduplicated by
+    content hash), and the checkpoint keeps only runs of sequence numbers:
+    an append-only conversation is a single [start, length] run, so storage
+    grows linearly. `get_tuple`/`list` rebuild the list on read.
+
+    Checkpoints written by `SqliteSaver` stay readable; `migrate` rewrites
+    them. A database written by this saver needs it (not `SqliteSaver`) to
+    read.
+
+    Sequence numbers come from a per-process cache of each thread's stored
+    messages. When another process has written the same thread, the insert
+    of a number it already took fails; the thread's numbers are then reloaded
+    and the write is tried again. Buffered checkpoints (CHECKPOINT_DURABILITY
+    async/exit) get their numbers when the buffer is flushed, so the retry
+    covers them too.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, cached_threads: int = 256, **kwargs: Any):
+        super().__init__(conn, **kwargs)
+        self.cached_threads = cached_threads
+        self._threads: "OrderedDict[str, _ThreadMessages]" = OrderedDict()
+        self._threads_lock = threading.Lock()
+
+    def setup(self) -> None:
+        if self.is_setup:
+            return
+        super().setup()
+        self.conn.executescript(_MESSAGES_SCHEMA)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        thread_id = str(config["configurable"]["thread_id"])
+        for attempt in range(1, _SEQ_ATTEMPTS + 1):
+            try:
+                return super().put(config, checkpoint, metadata, new_versions)
+            except Exception as e:
+                # The sequence numbers handed out were not stored; reload them.
+                self._forget_threads([thread_id])
+                if not isinstance(e, sqlite3.IntegrityError) or attempt == _SEQ_ATTEMPTS:
+                    raise
+
+    # -------------------
+    # Reads
+    # -------------------
+    def _load_tuple(self, config):
+        saved = super()._load_tuple(config)
+        if saved is None:
+            return None
+        with self.cursor(transaction=False) as cur:
+            return self._resolve(saved, cur)
+
+    def list(self, config, *, filter=None, before=None, limit=None):
+        # SqliteSaver.list holds `self.lock` while it yields, so read the
+        # messages with a plain cursor rather than `self.cursor()`.
+        for saved in super().list(config, filter=filter, before=before, limit=limit):
+            with closing(self.conn.cursor()) as cur:
+                yield self._resolve(saved, cur)
+
+    def delete_thread(self, thread_id: str) -> None:
+        super().delete_thread(thread_id)
+        with self.cursor() as cur:
+            cur.execute("DELETE FROM messages WHERE thread_id = ?", (str(thread_id),))
+        with self._threads_lock:
+            self._threads.pop(str(thread_id), None)
+
+    # -------------------
+    # Migration
+    # -------------------
+    def migrate(self, batch_size: int = 100) -> dict:
+        """
+        Move the messages of checkpoints written by `SqliteSaver` into the
+        message table, `batch_size` checkpoints per transaction. Safe to rerun;
+        run it while no turn is writing. VACUUM afterwards to return the space.
+        """
+        with self.cursor(transaction=False) as cur:
+            keys = cur.execute(
+                "SELECT thread_id, checkpoint_ns, checkpoint_id FROM checkpoints "
+                "ORDER BY thread_id, checkpoint_id"
+            ).fetchall()
+        stats = {"checkpoints": len(keys), "migrated": 0, "bytes_before": 0, "bytes_after": 0}
+        for start in range(0, len(keys), batch_size):
+            with self.cursor(transaction=False) as cur:
+                rows = [
+                    (key, *cur.execute(
+                        "SELECT type, checkpoint FROM checkpoints "
+                        "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                        key,
+                    ).fetchone())
+                    for key in keys[start : start + batch_size]
+                ]
+            message_rows: List[tuple] = []
+            updates: List[tuple] = []
+            for key, type_, blob in rows:
+                checkpoint = self.serde.loads_typed((type_, blob))
+                messages = (checkpoint.get("channel_values") or {}).get("messages")
+                if not isinstance(messages, list):
+                    continue
+                refs, new_rows = self._store_messages(str(key[0]), messages)
+                checkpoint["channel_values"]["messages"] = {_MESSAGE_REFS: refs}
+                new_type, new_blob = self.serde.dumps_typed(checkpoint)
+                message_rows.extend(new_rows)
+                updates.append((new_type, new_blob, *key))
+                stats["migrated"] += 1
+                stats["bytes_before"] += len(blob)
+                stats["bytes_after"] += len(new_blob) + sum(len(row[4]) for row in new_rows)
+            if updates:
+                with self.cursor() as cur:
+                    cur.executemany(_INSERT_MESSAGE, message_rows)
+                    cur.executemany(
+                        "UPDATE checkpoints SET type = ?, checkpoint = ? "
+                        "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                        updates,
+                    )
+        return stats
+
+    # -------------------
+    # Internals
+    # -------------------
+    def _checkpoint_statements(self, config, checkpoint, metadata):
+        messages = (checkpoint.get("channel_values") or {}).get("messages")
+        if not isinstance(messages, list):
+            return super()._checkpoint_statements(config, checkpoint, metadata)
+        thread_id = str(config["configurable"]["thread_id"])
+        if self.deferred:
+            # Numbered at flush time, against what is committed then. Copies,
+            # as the rows would be, in case the graph reuses its containers.
+            checkpoint = {
+                **checkpoint,
+                "channel_values": {**checkpoint["channel_values"], "messages": list(messages)},
+            }
+            return [(_STORE_CHECKPOINT, [(thread_id, config, checkpoint, dict(metadata))])]
+        return self._message_statements(config, checkpoint, metadata)
+
+    def _commit_batch(self, batch):
+        threads = {rows[0][0] for sql, rows in batch if sql == _STORE_CHECKPOINT}
+        for attempt in range(1, _SEQ_ATTEMPTS + 1):
+            statements = []
+            for sql, rows in batch:
+                if sql != _STORE_CHECKPOINT:
+                    statements.append((sql, rows))
+                    continue
+                for _, config, checkpoint, metadata in rows:
+                    statements.extend(self._message_statements(config, checkpoint, metadata))
+            try:
+                return super()._commit_batch(statements)
+            except Exception as e:
+                # Rolled back: the numbers handed out are free again.
+                self._forget_threads(threads)
+                if not isinstance(e, sqlite3.IntegrityError) or attempt == _SEQ_ATTEMPTS:
+                    raise
+
+    def _forget_threads(self, thread_ids) -> None:
+        with self._threads_lock:
+            for thread_id in thread_ids:
+                self._threads.pop(thread_id, None)
+
+    def _message_statements(self, config, checkpoint, metadata):
+        """The statements storing a checkpoint's new messages and the checkpoint with refs."""
+        messages = checkpoint["channel_values"]["messages"]
+        refs, rows = self._store_messages(str(config["configurable"]["thread_id"]), messages)
+        checkpoint = {
+            **checkpoint,
+            "channel_values": {**checkpoint["channel_values"], "messages": {_MESSAGE_REFS: refs}},
+        }
+        # Messages first, in the same transaction (or flush) as the checkpoint.
+        return [(_INSERT_MESSAGE, rows), *super()._checkpoint_statements(config, checkpoint, metadata)]
+
+    def _store_messages(self, thread_id: str, messages: List[Any]) -> Tuple[List[List[int]], List[tuple]]:
+        """The runs referencing `messages`, and the rows for those not stored yet."""
+        with self._threads_lock:
+            state = self._thread_state(thread_id)
+            seqs: List[int] = []
+            rows: List[tuple] = []
+            for position, message in enumerate(messages):
+                if position < len(state.last) and state.last[position][0] is message:
+                    seqs.append(state.last[position][1])
+                    continue
+                type_, value = self.serde.dumps_typed(message)
+                digest = hashlib.sha256(type_.encode() + b"\0" + value).hexdigest()[:32]
+                seq = state.seq_by_hash.get(digest)
+                if seq is None:
+                    seq = state.next_seq
+                    state.next_seq += 1
+                    state.seq_by_hash[digest] = seq
+                    rows.append((thread_id, seq, digest, type_, value))
+                seqs.append(seq)
+            state.last = list(zip(messages, seqs))
+        return _runs(seqs), rows
+
+    def _thread_state(self, thread_id: str) -> _ThreadMessages:
+        # Called with `_threads_lock` held.
+        state = self._threads.get(thread_id)
+        if state is not None:
+            self._threads.move_to_end(thread_id)
+            return state
+        # Only committed rows count (not `self.cursor()`, which would flush:
+        # this also runs during a flush).
+        with self.lock:
+            self.setup()
+            rows = self.conn.execute("SELECT hash, seq FROM messages WHERE thread_id = ?", (thread_id,))
+            state = _ThreadMessages(dict(rows.fetchall()))
+        self._threads[thread_id] = state
+        while len(self._threads) > self.cached_threads:
+            self._threads.popitem(last=False)
+        return state
+
+    def _resolve(self, saved, cur: sqlite3.Cursor):
+        """Replace the message refs of a loaded checkpoint with the messages."""
+        values = saved.checkpoint.get("channel_values") or {}
+        refs = values.get("messages")
+        if not (isinstance(refs, dict) and _MESSAGE_REFS in refs):
+            return saved
+        thread_id = str(saved.config["configurable"]["thread_id"])
+        messages: List[Any] = []
+        for start, length in refs[_MESSAGE_REFS]:
+            rows = cur.execute(
+                "SELECT type, value FROM messages WHERE thread_id = ? AND seq >= ? AND seq < ? "
+                "ORDER BY seq",
+                (thread_id, start, start + length),
+            ).fetchall()
+            if len(rows) != length:
+                raise RuntimeError(
+                    f"Checkpoint {saved.config['configurable'].get('checkpoint_id')} of thread "
+                    f"{thread_id} references messages that are not stored"
+                )
+            messages.extend(self.serde.loads_typed(row) for row in rows)
+        values["messages"] = messages
+        return saved
+
+
+def make_checkpointer(conn: sqlite3.Connection):
+    """
+    The checkpointer for the SQLite-backed graphs, per CHECKPOINT_MESSAGE_STORE
+    and CHECKPOINT_SHARDS. Sharded files are named after `conn`'s database,
+    which is then not used for checkpoints.
+    """
+    saver_class = MessageStoreSaver if MESSAGE_STORE else DeferredSqliteSaver
+    if SHARDS > 1:
+        from checkpoint_shards import ShardedSaver
+
+        path = next(row[2] for row in conn.execute("PRAGMA database_list") if row[1] == "main")
+        if not path:
+            raise ValueError("CHECKPOINT_SHARDS needs a file-backed SQLite connection")
+        return ShardedSaver.open(path, SHARDS, saver_class=saver_class)
+    return saver_class(conn)
+
+
+def _thread_key(config) -> Tuple[str, str]:
+    configurable = config["configurable"]
+    return str(configurable["thread_id"]), configurable.get("checkpoint_ns", "")
+
+
+def _runs(seqs: List[int]) -> List[List[int]]:
+    """[3, 4, 5, 9] -> [[3, 3], [9, 1]]"""
+    runs: List[List[int]] = []
+    for seq in seqs:
+        if runs and runs[-1][0] + runs[-1][1] == seq:
+            runs[-1][1] += 1
+        else:
+            runs.append([seq, 1])
+    return runs
+
+
+def _writer_loop(saver_ref: "weakref.ref[DeferredSqliteSaver]") -> None:
+    """Group-commit loop; holds the saver weakly so it can be collected."""
+    while True:
+        saver = saver_ref()
+        if saver is None or saver._closed:
+            return
+        wake, interval = saver._wake, saver.flush_ms / 1000
+        del saver
+        wake.wait()
+        # Let the other threads' steps for this window accumulate.
+        time.sleep(interval)
+        wake.clear()
+        saver = saver_ref()
+        if saver is None:
+            return
+        try:
+            saver.flush()
+        except Exception:
+            pass  # kept in the buffer; the next reader or turn-end flush raises it
+        del saver
+
+
+def _flush_at_exit(saver_ref: "weakref.ref[DeferredSqliteSaver]") -> None:
+    saver = saver_ref()
+    if saver is not None:
+        saver.close()
@@ -0,0 +1,309 @@
+"""
+Export every conversation of one or more checkpoint databases, one record per
+thread with its final message list:
+
+    python export_conversations.py chatbot.db chatbot_tools.db -o conversations.jsonl
+    python export_conversations.py chatbot.db -o conversations.parquet --workers 8
+    python export_conversations.py chatbot.db -o new.jsonl --state export_state.json
+
+Records are {"database", "thread_id", "checkpoint_id", "updated_at",
+"message_count", "messages": [{"role", "content", "name", "id",
+"tool_calls", "tool_call_id"}]}. Parquet output (one row per thread, messages
+as a list of structs, content and tool_calls as JSON text when not plain
+strings) needs pyarrow, which the app itself does not.
+
+Threads are read straight from the checkpoint tables, read-only, by a pool
+of `--workers` processes, and written as they arrive, so memory stays flat
+however large the database. A sharded database (checkpoint_shards.py) is
+read from its shard files.
+
+With --state, only threads with a checkpoint newer than the last run's are
+exported, and the file is updated on success. A thread that changed is
+exported again in full: keep the record with the highest checkpoint_id.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+from checkpoint_shards import existing_shards
+from checkpointing import DeferredSqliteSaver, MessageStoreSaver
+
+_ROLES = {"human": "user", "ai": "assistant", "tool": "tool", "system": "system"}
+_READERS: Dict[str, DeferredSqliteSaver] = {}  # per process: database file -> reader
+
+
+# -------------------
+# Reading
+# -------------------
+def _reader(path: str) -> DeferredSqliteSaver:
+    reader = _READERS.get(path)
+    if reader is None:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        # MessageStoreSaver reads both plain and message-store checkpoints;
+        # without a messages table the database has no message store.
+        saver_class = MessageStoreSaver if _has_table(conn, "messages") else DeferredSqliteSaver
+        reader = saver_class(conn, durability="sync", latest_cache=0)
+        # The base setup only reads on a read-only connection and copes with
+        # databases from before `task_path`; the messages DDL would write.
+        SqliteSaver.setup(reader)
+        _READERS[path] = reader
+    return reader
+
+
+def latest_checkpoints(path: str, since: Optional[str]) -> Iterator[Tuple[str, str]]:
+    """(thread_id, latest checkpoint_id) of each thread updated after `since`."""
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        if not _has_table(conn, "checkpoints"):
+            return  # a shard file nothing has been written to yet
+        yield from conn.execute(
+            "SELECT thread_id, MAX(checkpoint_id) FROM checkpoints WHERE checkpoint_ns = '' "
+            "GROUP BY thread_id HAVING MAX(checkpoint_id) > ?",
+            (since or "",),
+        )
+    finally:
+        conn.close()
+
+
+def _has_table(conn: sqlite3.Connection, name: str) -> bool:
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone()
+    return row is not None
+
+
+def export_threads(database: str, path: str, threads: List[Tuple[str, str]]) -> List[dict]:
+    """The records of a batch of threads; runs in a worker process."""
+    reader = _reader(path)
+    records = []
+    for thread_id, checkpoint_id in threads:
+        saved = reader.get_tuple(
+            {"configurable": {"thread_id": thread_id, "checkpoint_ns": "", "checkpoint_id": checkpoint_id}}
+        )
+        if saved is None:
+            continue
+        messages = saved.checkpoint["channel_values"].get("messages") or []
+        records.append(
+            {
+                "database": database,
+                "thread_id": str(thread_id),
+                "checkpoint_id": checkpoint_id,
+                "updated_at": saved.checkpoint.get("ts"),
+                "message_count": len(messages),
+                "messages": [message_record(message) for message in messages],
+            }
+        )
+    return records
+
+
+def message_record(message: Any) -> dict:
+    return {
+        "role": _ROLES.get(message.type, message.type),
+        "content": message.content,
+        "name": getattr(message, "name", None),
+        "id": message.id,
+        "tool_calls": [
+            {"name": call["name"], "args": call["args"], "id": call.get("id")}
+            for call in getattr(message, "tool_calls", None) or []
+        ]
+        or None,
+        "tool_call_id": getattr(message, "tool_call_id", None),
+    }
+
+
+# -------------------
+# Writing
+# -------------------
+class JsonlWriter:
+    def __init__(self, path: str):
+        self._file = sys.stdout if path == "-" else open(path, "w", encoding="utf-8")
+
+    def write(self, records: List[dict]) -> None:
+        for record in records:
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def close(self) -> None:
+        if self._file is not sys.stdout:
+            self._file.close()
+
+
+class ParquetWriter:
+    """Buffers `row_group_size` threads, then writes them as one row group."""
+
+    def __init__(self, path: str, row_group_size: int = 1000):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        message = pa.struct(
+            [
+                ("role", pa.string()),
+                ("content", pa.string()),
+                ("name", pa.string()),
+                ("id", pa.string()),
+                ("tool_calls", pa.string()),
+                ("tool_call_id", pa.string()),
+            ]
+        )
+        self._schema = pa.schema(
+            [
+                ("database", pa.string()),
+                ("thread_id", pa.string()),
+                ("checkpoint_id", pa.string()),
+                ("updated_at", pa.string()),
+                ("message_count", pa.int32()),
+                ("messages", pa.list_(message)),
+            ]
+        )
+        self._pa = pa
+        self._writer = pq.ParquetWriter(path, self._schema, compression="zstd")
+        self._rows: List[dict] = []
+        self.row_group_size = row_group_size
+
+    def write(self, records: List[dict]) -> None:
+        for record in records:
+            self._rows.append(
+                {
+                    **record,
+                    "messages": [
+                        {
+                            **message,
+                            "content": _text(message["content"]),
+                            "tool_calls": _text(message["tool_calls"]),
+                        }
+                        for message in record["messages"]
+                    ],
+                }
+            )
+        if len(self._rows) >= self.row_group_size:
+            self._flush()
+
+    def close(self) -> None:
+        self._flush()
+        self._writer.close()
+
+    def _flush(self) -> None:
+        if self._rows:
+            self._writer.write_table(self._pa.Table.from_pylist(self._rows, schema=self._schema))
+            self._rows = []
+
+
+def _text(value: Any) -> Optional[str]:
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value, ensure_ascii=False)
+
+
+# -------------------
+# Export
+# -------------------
+def database_files(database: str) -> List[str]:
+    """The files holding `database`: its shards if it has been split."""
+    shards = existing_shards(database)
+    if shards:
+        return list(shards.values())
+    if not os.path.exists(database):
+        raise SystemExit(f"{database} does not exist")
+    return [database]
+
+
+def export(
+    databases: List[str],
+    writer,
+    workers: int,
+    batch_size: int,
+    state: Dict[str, str],
+) -> Dict[str, int]:
+    """Write every thread newer than `state` and advance `state`; thread counts per file."""
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    in_flight: Deque[Future] = deque()
+    counts: Dict[str, int] = {}
+
+    def drain(limit: int) -> None:
+        while len(in_flight) > limit:
+            writer.write(in_flight.popleft().result())
+
+    try:
+        for database in databases:
+            for path in database_files(database):
+                key = os.path.abspath(path)
+                batch: List[Tuple[str, str]] = []
+                newest = state.get(key)
+                counts[path] = 0
+                for thread_id, checkpoint_id in latest_checkpoints(path, state.get(key)):
+                    batch.append((thread_id, checkpoint_id))
+                    newest = max(newest or "", checkpoint_id)
+                    counts[path] += 1
+                    if len(batch) >= batch_size:
+                        in_flight.append(_submit(pool, database, path, batch))
+                        batch = []
+                        # Bounded read-ahead keeps memory flat.
+                        drain(2 * max(workers, 1))
+                if batch:
+                    in_flight.append(_submit(pool, database, path, batch))
+                if newest:
+                    state[key] = newest
+        drain(0)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    return counts
+
+
+def _submit(pool: Optional[ProcessPoolExecutor], database: str, path: str, batch) -> Future:
+    if pool is not None:
+        return pool.submit(export_threads, database, path, batch)
+    future: Future = Future()
+    future.set_result(export_threads(database, path, batch))
+    return future
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("databases", nargs="+")
+    parser.add_argument("-o", "--output", required=True, help="output file (.jsonl or .parquet); - for stdout")
+    parser.add_argument("--format", choices=("jsonl", "parquet"), help="default: from the output's extension")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="reader processes")
+    parser.add_argument("--batch-size", type=int, default=100, help="threads per reader task")
+    parser.add_argument("--state", help="watermark file for incremental exports")
+    args = parser.parse_args()
+
+    output_format = args.format or ("parquet" if args.output.endswith(".parquet") else "jsonl")
+    if output_format == "parquet":
+        try:
+            writer = ParquetWriter(args.output)
+        except ImportError:
+            parser.error("Parquet output needs pyarrow: pip install pyarrow")
+    else:
+        writer = JsonlWriter(args.output)
+
+    state: Dict[str, str] = {}
+    if args.state and os.path.exists(args.state):
+        with open(args.state, encoding="utf-8") as f:
+            state = json.load(f)
+
+    start = time.perf_counter()
+    try:
+        counts = export(args.databases, writer, args.workers, args.batch_size, state)
+    finally:
+        writer.close()
+    if args.state:
+        # Only after the output is complete, so a failed run is simply repeated.
+        temporary = f"{args.state}.tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=2)
+        os.replace(temporary, args.state)
+    for path, count in counts.items():
+        print(f"{path}: {count} threads", file=sys.stderr)
+    print(f"exported {sum(counts.values())} threads in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,10 +6,12 @@ from langgraph.checkpoint.memory import InMemorySaver
 from langgraph.graph.message import add_messages
 from dotenv import load_dotenv
 
+from admission_control import PROVIDER_GATE
+
 load_dotenv()
 
 #model defining 
-model=ChatOpenAI(model="gpt-4o-mini")
+model=ChatOpenAI(model="gpt-4o-mini", max_retries=0)
 
 #state defining
 class ChatState(TypedDict):
@@ -18,7 +20,7 @@ class ChatState(TypedDict):
 #python function for node creation
 def chat_node(state:ChatState):
     messages=state["messages"]
-    response=model.invoke(messages)
+    response=PROVIDER_GATE.call(model.invoke,messages)
     return {"messages": [response]}
 
 #initalisation checkpointer
@@ -1,4 +1,3 @@
-from langgraph.checkpoint.sqlite import SqliteSaver
 from langgraph.graph import StateGraph,START,END
 from typing import TypedDict,Annotated
 from langchain_core.messages import BaseMessage
@@ -7,10 +6,13 @@ from langgraph.graph.message import add_messages
 from dotenv import load_dotenv
 import sqlite3
 
+from admission_control import PROVIDER_GATE
+from checkpointing import make_checkpointer
+
 load_dotenv()
 
 #model defining 
-model=ChatOpenAI(model="gpt-4o-mini")
+model=ChatOpenAI(model="gpt-4o-mini", max_retries=0)
 
 #state defining
 class ChatState(TypedDict):
@@ -19,13 +21,13 @@ class ChatState(TypedDict):
 #python function for node creation
 def chat_node(state:ChatState):
     messages=state["messages"]
-    response=model.invoke(messages)
+    response=PROVIDER_GATE.call(model.invoke,messages)
     return {"messages": [response]}
 
 #initalisation checkpointer
 #first you need to create the database and give check same thread is flase because it is default runs on same thread
 conn = sqlite3.connect("chatbot.db", check_same_thread=False)
-checkpointer = SqliteSaver(conn)
+checkpointer = make_checkpointer(conn)
 
 #creating nodes
 graph=StateGraph(ChatState)
@@ -37,7 +39,4 @@ graph.add_edge("chat_node",END)
 chatbot=graph.compile(checkpointer=checkpointer)
 
 def retrive_all_threads():
-    all_threads=set()
-    for checkpoint in checkpointer.list(None):
-        all_threads.add(checkpoint.config["configurable"]["thread_id"])
-    return list(all_threads)
\ No newline at end of file
+    return checkpointer.thread_ids()
\ No newline at end of file
@@ -1,55 +1,150 @@
 from __future__ import annotations
 
+import hashlib
 import os
 import sqlite3
 import tempfile
-from typing import Annotated, Any, Dict, Optional, TypedDict
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Annotated, Dict, List, Optional, Tuple, TypedDict
 
 from dotenv import load_dotenv
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.document_loaders import PyPDFLoader
 from langchain_community.tools import DuckDuckGoSearchRun
-from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
 from langchain_core.messages import BaseMessage, SystemMessage
 from langchain_core.tools import tool
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langgraph.checkpoint.sqlite import SqliteSaver
-from langgraph.graph import START, StateGraph
+from langchain_openai import ChatOpenAI
+from langgraph.graph import END, START, StateGraph
 from langgraph.graph.message import add_messages
-from langgraph.prebuilt import ToolNode, tools_condition
+from langgraph.prebuilt import ToolNode
 import requests
 
+from admission_control import PROVIDER_GATE, GatedEmbeddings
+from checkpointing import make_checkpointer
+from profiling import memory_snapshot
+from rag_embeddings import BatchingEmbeddings, CachedQueryEmbeddings, make_embeddings
+from rag_index import RagIndex, retrieve_across
+from rag_packing import pack_context
+from rag_summary import build_overview, extract_outline
+from rag_registry import RetrieverRegistry
+from rag_serving import SharedIndexStore
+from tool_outputs import compact_tool_output
+from turn_budget import final_answer, model_step, route_after_model, tool_deadline
+
 load_dotenv()
 
 # -------------------
 # 1. LLM + embeddings
 # -------------------
-llm = ChatOpenAI(model="gpt-4o-mini")
-embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
+# PROVIDER_GATE does the retrying, so it sees every 429 (see admission_control).
+llm = ChatOpenAI(model="gpt-4o-mini", max_retries=0)
+# RAG_EMBEDDING_PROVIDER picks OpenAI or a local CPU model (see make_embeddings).
+# Provider requests share PROVIDER_GATE's concurrency cap and 429 backoff.
+# Concurrent embedding calls (queries and ingestion) arriving within
+# RAG_EMBEDDING_BATCH_WAIT_MS of each other share one provider request of at
+# most RAG_EMBEDDING_BATCH_MAX_SIZE texts; 0 sends every call on its own.
+# Repeated queries reuse their cached vector instead of a new embedding request.
+_provider_embeddings = GatedEmbeddings(make_embeddings(max_retries=0), PROVIDER_GATE)
+_EMBEDDING_BATCH_WAIT_MS = float(os.getenv("RAG_EMBEDDING_BATCH_WAIT_MS", "5"))
+if _EMBEDDING_BATCH_WAIT_MS > 0:
+    _provider_embeddings = BatchingEmbeddings(
+        _provider_embeddings,
+        max_batch_size=int(os.getenv("RAG_EMBEDDING_BATCH_MAX_SIZE", "256")),
+        max_wait_ms=_EMBEDDING_BATCH_WAIT_MS,
+        max_concurrent_batches=int(os.getenv("RAG_EMBEDDING_BATCH_CONCURRENCY", "4")),
+    )
+embeddings = CachedQueryEmbeddings(
+    _provider_embeddings,
+    max_entries=int(os.getenv("RAG_QUERY_EMBEDDING_CACHE_SIZE", "1024")),
+)
 
 # -------------------
-# 2. PDF retriever store (per thread)
+# 2. PDF retriever store (shared per document, referenced by threads)
 # -------------------
-_THREAD_RETRIEVERS: Dict[str, Any] = {}
+# One index per distinct PDF, keyed by the SHA-256 of its bytes, shared read-only
+# by every thread that uploaded it and released when the last one drops it.
+# Indexes stay in memory up to RAG_INDEX_MEMORY_BUDGET_MB; least recently used
+# ones are spilled to RAG_INDEX_SPILL_DIR and reloaded on the next lookup.
+# Loads are covered by CHAT_PROFILE_MEMORY snapshots (see profiling.py).
+_DOCUMENT_INDEXES = RetrieverRegistry(
+    loader=memory_snapshot("retriever_reload")(lambda path: RagIndex.load_local(path, embeddings)),
+    budget_bytes=int(float(os.getenv("RAG_INDEX_MEMORY_BUDGET_MB", "512")) * 1024 * 1024),
+    spill_dir=os.getenv("RAG_INDEX_SPILL_DIR", "rag_index_spill"),
+    sizer=lambda rag_index: rag_index.estimate_bytes(),
+)
+# content_hash -> number of (thread, filename) entries referencing it
+_DOCUMENT_REFS: Dict[str, int] = {}
+# content_hash -> {"documents", "chunks"}, so re-uploads skip parsing
+_DOCUMENT_STATS: Dict[str, dict] = {}
+# thread_id -> {"files": {filename: {"filename", "documents", "chunks", "content_hash"}}}
 _THREAD_METADATA: Dict[str, dict] = {}
+_LOCKS: Dict[str, threading.Lock] = {}
+# Per retrieval path ("lexical", "hybrid", "dense"): query count and total time.
+_RETRIEVAL_STATS: Dict[str, Dict[str, float]] = {}
+_RETRIEVAL_STATS_LOCK = threading.Lock()  # tool calls of a turn run in parallel
+
+# rag_tool fetches RAG_PACK_CANDIDATES chunks and packs the best of them into at
+# most RAG_CONTEXT_TOKEN_BUDGET tokens; RAG_PACK_COMPRESS=1 also drops the
+# sentences least related to the query.
+_PACK_CANDIDATES = int(os.getenv("RAG_PACK_CANDIDATES", "8"))
+_CONTEXT_TOKEN_BUDGET = int(os.getenv("RAG_CONTEXT_TOKEN_BUDGET", "1500"))
+_PACK_COMPRESS = os.getenv("RAG_PACK_COMPRESS", "0") == "1"
+
+# RAG_SERVING_MODE=1 is for several server processes behind a load balancer:
+# finished indexes are published to RAG_SHARED_INDEX_DIR, opened memory-mapped
+# and read-only by every process, and the thread -> document manifest lives in
+# a SQLite file there, so any process can answer any thread. The in-memory
+# registry, reference counts and thread metadata above are then unused.
+_SERVING_MODE = os.getenv("RAG_SERVING_MODE", "0") == "1"
+_SHARED_INDEXES = (
+    SharedIndexStore(os.getenv("RAG_SHARED_INDEX_DIR", "rag_shared_indexes"), embeddings)
+    if _SERVING_MODE
+    else None
+)
+
+# RAG_PRECOMPUTE_SUMMARY=1 summarizes every newly indexed PDF in the background
+# (map-reduce over chunk batches); the PDF's bookmarks are always captured.
+_PRECOMPUTE_SUMMARY = os.getenv("RAG_PRECOMPUTE_SUMMARY", "0") == "1"
+_OVERVIEW_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix="rag-overview")
+
+
+def _lock_for(key: str) -> threading.Lock:
+    return _LOCKS.setdefault(key, threading.Lock())
+
+
+def _record_retrieval(path: str, seconds: float) -> None:
+    with _RETRIEVAL_STATS_LOCK:
+        stats = _RETRIEVAL_STATS.setdefault(path, {"queries": 0, "seconds": 0.0})
+        stats["queries"] += 1
+        stats["seconds"] += seconds
+
+
+def _thread_files(thread_id: Optional[str]) -> Dict[str, dict]:
+    if not thread_id:
+        return {}
+    if _SERVING_MODE:
+        return _SHARED_INDEXES.thread_files(str(thread_id))
+    return _THREAD_METADATA.get(str(thread_id), {}).get("files", {})
 
 
-def _get_retriever(thread_id: Optional[str]):
-    """Fetch the retriever for a thread if available."""
-    if thread_id and thread_id in _THREAD_RETRIEVERS:
-        return _THREAD_RETRIEVERS[thread_id]
-    return None
+def _document_index(content_hash: str) -> Optional[RagIndex]:
+    if _SERVING_MODE:
+        return _SHARED_INDEXES.open(content_hash)
+    return _DOCUMENT_INDEXES.get(content_hash)
 
 
-def ingest_pdf(file_bytes: bytes, thread_id: str, filename: Optional[str] = None) -> dict:
-    """
-    Build a FAISS retriever for the uploaded PDF and store it for the thread.
+def _document_overview(content_hash: str) -> dict:
+    if _SERVING_MODE:
+        return _SHARED_INDEXES.read_overview(content_hash)
+    rag_index = _DOCUMENT_INDEXES.get(content_hash)
+    return rag_index.overview if rag_index is not None else {}
 
-    Returns a summary dict that can be surfaced in the UI.
-    """
-    if not file_bytes:
-        raise ValueError("No bytes received for ingestion.")
 
+def _build_document_index(file_bytes: bytes, content_hash: str) -> None:
+    """Parse, chunk and embed a PDF not yet indexed by any thread."""
     with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as temp_file:
         temp_file.write(file_bytes)
         temp_path = temp_file.name
@@ -59,27 +154,32 @@ def ingest_pdf(file_bytes: bytes, thread_id: str, filename: Optional[str] = None
         docs = loader.load()
 
         splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000, chunk_overlap=200, separators=["\n\n", "\n", " ", ""]
+            chunk_size=1000,
+            chunk_overlap=200,
+            separators=["\n\n", "\n", " ", ""],
+            add_start_index=True,
         )
         chunks = splitter.split_documents(docs)
-
-        vector_store = FAISS.from_documents(chunks, embeddings)
-        retriever = vector_store.as_retriever(
-            search_type="similarity", search_kwargs={"k": 4}
-        )
-
-        _THREAD_RETRIEVERS[str(thread_id)] = retriever
-        _THREAD_METADATA[str(thread_id)] = {
-            "filename": filename or os.path.basename(temp_path),
-            "documents": len(docs),
-            "chunks": len(chunks),
+        if not chunks:
+            raise ValueError("No text could be extracted from the PDF.")
+
+        # Chunks are keyed by content hash; each thread's own filename is
+        # applied to results at query time.
+        rag_index = RagIndex.from_documents(chunks, embeddings, content_hash)
+        outline = extract_outline(file_bytes)
+        rag_index.overview = {
+            "status": "pending" if _PRECOMPUTE_SUMMARY else "outline_only",
+            "outline": outline,
         }
+        stats = {"documents": len(docs), "chunks": len(chunks)}
+        if _SERVING_MODE:
+            _SHARED_INDEXES.publish(content_hash, rag_index, stats)
+        else:
+            _DOCUMENT_INDEXES.put(content_hash, rag_index)
+            _DOCUMENT_STATS[content_hash] = stats
 
-        return {
-            "filename": filename or os.path.basename(temp_path),
-            "documents": len(docs),
-            "chunks": len(chunks),
-        }
+        if _PRECOMPUTE_SUMMARY:
+            _OVERVIEW_EXECUTOR.submit(_precompute_overview, content_hash, chunks, outline)
     finally:
         # The FAISS store keeps copies of the text, so the temp file is safe to remove.
         try:
@@ -88,6 +188,138 @@ def ingest_pdf(file_bytes: bytes, thread_id: str, filename: Optional[str] = None
             pass
 
 
+def _precompute_overview(content_hash: str, chunks: List[Document], outline: List[dict]) -> None:
+    """Background job: store a map-reduce summary on the document's index."""
+    try:
+        # Through the provider gate, so a large upload's burst of batched calls
+        # stays within the concurrency cap and honours a shared 429 pause.
+        overview = {"status": "ready", **build_overview(chunks, llm, outline, gate_call=PROVIDER_GATE.call)}
+    except Exception as e:
+        overview = {"status": "failed", "error": str(e), "outline": outline}
+
+    if _SERVING_MODE:
+        _SHARED_INDEXES.write_overview(content_hash, overview)
+        return
+
+    with _lock_for(f"doc:{content_hash}"):
+        rag_index = _DOCUMENT_INDEXES.get(content_hash)
+        if rag_index is not None:
+            rag_index.overview = overview
+            _DOCUMENT_INDEXES.put(content_hash, rag_index)
+
+
+def _release_document(content_hash: str) -> None:
+    with _lock_for(f"doc:{content_hash}"):
+        _DOCUMENT_REFS[content_hash] -= 1
+        if _DOCUMENT_REFS[content_hash] <= 0:
+            del _DOCUMENT_REFS[content_hash]
+            _DOCUMENT_STATS.pop(content_hash, None)
+            _DOCUMENT_INDEXES.discard(content_hash)
+
+
+@memory_snapshot("ingest_pdf")
+def ingest_pdf(file_bytes: bytes, thread_id: str, filename: Optional[str] = None) -> dict:
+    """
+    Make the uploaded PDF searchable for the thread.
+
+    A PDF already indexed for any thread is shared instead of being embedded
+    again. Earlier uploads stay searchable; uploading a file with the same name
+    again replaces it. Returns a summary dict that can be surfaced in the UI.
+    """
+    if not file_bytes:
+        raise ValueError("No bytes received for ingestion.")
+
+    content_hash = hashlib.sha256(file_bytes).hexdigest()
+    if _SERVING_MODE:
+        return _ingest_shared(file_bytes, thread_id, filename, content_hash)
+
+    with _lock_for(f"doc:{content_hash}"):
+        if content_hash not in _DOCUMENT_INDEXES:
+            _build_document_index(file_bytes, content_hash)
+        _DOCUMENT_REFS[content_hash] = _DOCUMENT_REFS.get(content_hash, 0) + 1
+
+    filename = filename or f"{content_hash[:12]}.pdf"
+    summary = {"filename": filename, **_DOCUMENT_STATS[content_hash]}
+    key = str(thread_id)
+    with _lock_for(f"thread:{key}"):
+        files = _THREAD_METADATA.setdefault(key, {"files": {}})["files"]
+        previous = files.get(filename)
+        files[filename] = {**summary, "content_hash": content_hash}
+    if previous is not None:
+        _release_document(previous["content_hash"])
+
+    return summary
+
+
+def _ingest_shared(
+    file_bytes: bytes, thread_id: str, filename: Optional[str], content_hash: str
+) -> dict:
+    """`ingest_pdf` in serving mode: publish the index once, record the upload."""
+    with _lock_for(f"doc:{content_hash}"):
+        stats = _SHARED_INDEXES.document_stats(content_hash)
+        if stats is None or not _SHARED_INDEXES.is_published(content_hash):
+            _build_document_index(file_bytes, content_hash)
+            stats = _SHARED_INDEXES.document_stats(content_hash)
+
+    filename = filename or f"{content_hash[:12]}.pdf"
+    _SHARED_INDEXES.attach(str(thread_id), filename, content_hash)
+    return {"filename": filename, **stats}
+
+
+def remove_document(thread_id: str, filename: str) -> bool:
+    """Detach one file from the thread; its index is freed once no thread uses it."""
+    key = str(thread_id)
+    if _SERVING_MODE:
+        return _SHARED_INDEXES.detach(key, filename)
+    with _lock_for(f"thread:{key}"):
+        entry = _thread_files(key).pop(filename, None)
+    if entry is None:
+        return False
+    _release_document(entry["content_hash"])
+    return True
+
+
+def _search_thread(
+    thread_id: Optional[str], queries: List[str], filename: Optional[str], k: int = 4
+) -> Tuple[Optional[List[Tuple[List[Document], str]]], Optional[dict]]:
+    """
+    Run `queries` against the thread's documents, or only `filename`.
+
+    Returns (results, None) or (None, error fields for the tool response).
+    """
+    if not thread_id:
+        return None, {"error": "thread_id is required to identify which PDF to search"}
+
+    files = _thread_files(thread_id)
+    if not files:
+        return None, {
+            "error": "No document indexed for this chat. Upload a PDF first.",
+            "thread_id": thread_id,
+        }
+    if filename:
+        if filename not in files:
+            return None, {
+                "error": f"No document named '{filename}' is indexed for this chat.",
+                "thread_id": thread_id,
+                "available_files": sorted(files),
+            }
+        files = {filename: files[filename]}
+
+    # The same PDF uploaded under several names is searched once and cited
+    # by all of this thread's names for it.
+    names_by_hash: Dict[str, List[str]] = {}
+    for name, entry in files.items():
+        names_by_hash.setdefault(entry["content_hash"], []).append(name)
+    indexes = []
+    for content_hash, names in names_by_hash.items():
+        rag_index = _document_index(content_hash)
+        if rag_index is not None:
+            indexes.append((", ".join(names), rag_index))
+
+    results = retrieve_across(indexes, queries, k=k)
+    return results, None
+
+
 # -------------------
 # 3. Tools
 # -------------------
@@ -134,52 +366,141 @@ def get_stock_price(symbol: str) -> dict:
         "https://www.alphavantage.co/query"
         f"?function=GLOBAL_QUOTE&symbol={symbol}&apikey=C9PE94QUEW9VWGFM"
     )
-    r = requests.get(url)
+    r = requests.get(url, timeout=10)
     return r.json()
 
 
 @tool
-def rag_tool(query: str, thread_id: Optional[str] = None) -> dict:
+def rag_tool(
+    query: str, thread_id: Optional[str] = None, filename: Optional[str] = None
+) -> dict:
     """
-    Retrieve relevant information from the uploaded PDF for this chat thread.
-    Include thread_id to retrieve from the correct document.
+    Retrieve relevant information from the uploaded PDFs for this chat thread.
+    Include thread_id to retrieve from the correct documents.
+    Pass filename to search only one of the uploaded PDFs.
     """
-    if not thread_id:
+    try:
+        start = time.perf_counter()
+        results, error = _search_thread(thread_id, [query], filename, k=_PACK_CANDIDATES)
+        elapsed = time.perf_counter() - start
+        if error is not None:
+            return {**error, "query": query}
+        result, path = results[0]
+        _record_retrieval(path, elapsed)
+
+        passages, packing = pack_context(
+            query,
+            result,
+            k=4,
+            token_budget=_CONTEXT_TOKEN_BUDGET,
+            compress=_PACK_COMPRESS,
+        )
+
         return {
-            "error": "thread_id is required to identify which PDF to search",
             "query": query,
+            "context": [passage["content"] for passage in passages],
+            "metadata": [
+                {"source_file": passage["source_file"], "page": passage["page"]}
+                for passage in passages
+            ],
+            "source_files": sorted({passage["source_file"] for passage in passages}),
+            "num_results": len(passages),
+            "retrieval_path": path,
+            "retrieval_ms": round(elapsed * 1000, 2),
+            "packing": packing,
         }
-    
-    retriever = _get_retriever(thread_id)
-    if retriever is None:
+    except Exception as e:
         return {
-            "error": "No document indexed for this chat. Upload a PDF first.",
+            "error": f"Error retrieving documents: {str(e)}",
             "query": query,
             "thread_id": thread_id,
         }
 
+
+@tool
+def rag_multi_tool(
+    queries: List[str], thread_id: Optional[str] = None, filename: Optional[str] = None
+) -> dict:
+    """
+    Retrieve information from the uploaded PDFs for several queries at once.
+    Prefer this over calling rag_tool repeatedly with paraphrases or
+    sub-questions. Include thread_id to retrieve from the correct documents.
+    Each chunk is returned once in `chunks`; every query lists the indexes of
+    its results in that list.
+    """
     try:
-        # Use the retriever API to fetch relevant documents for the query
-        result = retriever.get_relevant_documents(query)
-        context = [doc.page_content for doc in result]
-        metadata = [doc.metadata for doc in result]
+        start = time.perf_counter()
+        results, error = _search_thread(thread_id, queries, filename)
+        elapsed = time.perf_counter() - start
+        if error is not None:
+            return {**error, "queries": queries}
+
+        chunks = []
+        chunk_positions: Dict[str, int] = {}
+        per_query = []
+        for query, (docs, path) in zip(queries, results):
+            _record_retrieval(path, elapsed / len(queries))
+            positions = []
+            for doc in docs:
+                if doc.id not in chunk_positions:
+                    chunk_positions[doc.id] = len(chunks)
+                    chunks.append({"content": doc.page_content, "metadata": doc.metadata})
+                positions.append(chunk_positions[doc.id])
+            per_query.append({"query": query, "results": positions, "retrieval_path": path})
 
         return {
-            "query": query,
-            "context": context,
-            "metadata": metadata,
-            "source_file": _THREAD_METADATA.get(str(thread_id), {}).get("filename"),
-            "num_results": len(result),
+            "queries": per_query,
+            "chunks": chunks,
+            "num_results": len(chunks),
+            "retrieval_ms": round(elapsed * 1000, 2),
         }
     except Exception as e:
         return {
             "error": f"Error retrieving documents: {str(e)}",
-            "query": query,
+            "queries": queries,
             "thread_id": thread_id,
         }
 
 
-tools = [search_tool, get_stock_price, calculator, rag_tool]
+@tool
+def document_overview_tool(thread_id: Optional[str] = None, filename: Optional[str] = None) -> dict:
+    """
+    Return the precomputed outline and summary of the uploaded PDFs for this
+    chat thread. Use it for requests like "summarize this PDF" or "what are
+    the sections?" instead of calling rag_tool with generic queries.
+    Include thread_id; pass filename to get only one of the uploaded PDFs.
+    """
+    files = _thread_files(thread_id)
+    if not files:
+        return {
+            "error": "No document indexed for this chat. Upload a PDF first.",
+            "thread_id": thread_id,
+        }
+    if filename:
+        if filename not in files:
+            return {
+                "error": f"No document named '{filename}' is indexed for this chat.",
+                "available_files": sorted(files),
+            }
+        files = {filename: files[filename]}
+
+    documents = []
+    for name, entry in files.items():
+        overview = _document_overview(entry["content_hash"])
+        documents.append(
+            {
+                "filename": name,
+                "pages": entry["documents"],
+                "status": overview.get("status", "outline_only"),
+                "outline": overview.get("outline", []),
+                "summary": overview.get("summary"),
+                "sections": overview.get("sections", []),
+            }
+        )
+    return {"documents": documents}
+
+
+tools = [search_tool, get_stock_price, calculator, rag_tool, rag_multi_tool, document_overview_tool]
 llm_with_tools = llm.bind_tools(tools)
 
 # -------------------
@@ -192,34 +513,49 @@ class ChatState(TypedDict):
 # -------------------
 # 5. Nodes
 # -------------------
-def chat_node(state: ChatState, config=None):
-    """LLM node that may answer or request a tool call."""
+def _system_message(config) -> SystemMessage:
     thread_id = None
     if config and isinstance(config, dict):
         thread_id = config.get("configurable", {}).get("thread_id")
 
-    system_message = SystemMessage(
+    return SystemMessage(
         content=(
             "You are a helpful assistant. When users ask questions about the uploaded PDF, "
             "use the `rag_tool` to retrieve relevant information. "
             f"When calling rag_tool, always pass thread_id='{thread_id}'. "
+            "To search only one of several uploaded PDFs, also pass its filename. "
+            "When you need several phrasings or sub-questions answered from the PDFs, "
+            "call rag_multi_tool once with all of them instead of rag_tool repeatedly. "
+            "For summaries or the structure of a PDF, call document_overview_tool first; "
+            "if its summary is not ready, fall back to rag_tool. "
             "You can also use the web search, stock price, and calculator tools. "
             "If no document is available, ask the user to upload a PDF."
         )
     )
 
-    messages = [system_message, *state["messages"]]
-    response = llm_with_tools.invoke(messages, config=config)
-    return {"messages": [response]}
 
+def chat_node(state: ChatState, config=None):
+    """LLM node that may answer or request a tool call."""
+    messages = [_system_message(config), *state["messages"]]
+    # Bounded by the turn's deadline (see turn_budget.py)
+    return model_step(config, PROVIDER_GATE.call, llm_with_tools.invoke, messages)
+
+
+def final_answer_node(state: ChatState, config=None):
+    """Answers from what was gathered once the turn's tool or time budget is spent."""
+    return final_answer(state, config, llm, PROVIDER_GATE.call, _system_message(config))
 
-tool_node = ToolNode(tools)
+
+# Results are projected and size-limited before they enter the thread (see tool_outputs.py);
+# each call is bounded by the turn's deadline.
+tool_node = ToolNode(tools, wrap_tool_call=tool_deadline(compact_tool_output))
 
 # -------------------
 # 6. Checkpointer
 # -------------------
 conn = sqlite3.connect(database="chatbot.db", check_same_thread=False)
-checkpointer = SqliteSaver(conn=conn)
+# CHECKPOINT_* settings (durability, message store, latest-state cache, shards): see checkpointing.py
+checkpointer = make_checkpointer(conn)
 
 # -------------------
 # 7. Graph
@@ -227,10 +563,13 @@ checkpointer = SqliteSaver(conn=conn)
 graph = StateGraph(ChatState)
 graph.add_node("chat_node", chat_node)
 graph.add_node("tools", tool_node)
+graph.add_node("final_answer", final_answer_node)
 
 graph.add_edge(START, "chat_node")
-graph.add_conditional_edges("chat_node", tools_condition)
+# tools_condition plus CHAT_MAX_TOOL_ROUNDS and the turn deadline
+graph.add_conditional_edges("chat_node", route_after_model, ["tools", "final_answer", END])
 graph.add_edge("tools", "chat_node")
+graph.add_edge("final_answer", END)
 
 chatbot = graph.compile(checkpointer=checkpointer)
 
@@ -238,15 +577,76 @@ chatbot = graph.compile(checkpointer=checkpointer)
 # 8. Helpers
 # -------------------
 def retrieve_all_threads():
-    all_threads = set()
-    for checkpoint in checkpointer.list(None):
-        all_threads.add(checkpoint.config["configurable"]["thread_id"])
-    return list(all_threads)
+    # One query per shard; no checkpoint is loaded.
+    return checkpointer.thread_ids()
 
 
 def thread_has_document(thread_id: str) -> bool:
-    return str(thread_id) in _THREAD_RETRIEVERS
+    return bool(_thread_files(thread_id))
 
 
 def thread_document_metadata(thread_id: str) -> dict:
-    return _THREAD_METADATA.get(str(thread_id), {})
\ No newline at end of file
+    """
+    Every file indexed for the thread plus page/chunk totals.
+
+    `filename` is the most recently uploaded file, kept for callers that only
+    show one document.
+    """
+    files = [
+        {key: value for key, value in entry.items() if key != "content_hash"}
+        for entry in _thread_files(thread_id).values()
+    ]
+    if not files:
+        return {}
+    return {
+        "filename": files[-1]["filename"],
+        "documents": sum(f["documents"] for f in files),
+        "chunks": sum(f["chunks"] for f in files),
+        "files": files,
+    }
+
+
+def retrieval_path_metrics() -> dict:
+    """Query count and mean latency per rag_tool retrieval path."""
+    with _RETRIEVAL_STATS_LOCK:
+        stats_by_path = {path: dict(stats) for path, stats in _RETRIEVAL_STATS.items()}
+    return {
+        path: {
+            "queries": int(stats["queries"]),
+            "mean_ms": round(1000 * stats["seconds"] / stats["queries"], 2),
+        }
+        for path, stats in stats_by_path.items()
+    }
+
+
+def query_embedding_cache_metrics() -> dict:
+    return embeddings.metrics()
+
+
+def provider_gate_metrics() -> dict:
+    """In-flight LLM/embedding calls, 429s seen and time spent paused."""
+    return PROVIDER_GATE.metrics()
+
+
+def embedding_batcher_metrics() -> dict:
+    """Provider calls, coalesced requests and batch-size histograms; {} when batching is off."""
+    if isinstance(_provider_embeddings, BatchingEmbeddings):
+        return _provider_embeddings.metrics()
+    return {}
+
+
+def retriever_registry_metrics() -> dict:
+    """Resident bytes, hits, evictions and reload latency of the index registry."""
+    return _DOCUMENT_INDEXES.metrics()
+
+
+def shared_index_metrics() -> dict:
+    """How many distinct PDF indexes exist and how many thread uploads share them."""
+    if _SERVING_MODE:
+        return _SHARED_INDEXES.metrics()
+    references = sum(_DOCUMENT_REFS.values())
+    return {
+        "documents": len(_DOCUMENT_REFS),
+        "references": references,
+        "copies_avoided": references - len(_DOCUMENT_REFS),
+    }
@@ -2,9 +2,8 @@ from langgraph.graph import StateGraph,START,END
 from typing import TypedDict,Annotated
 from langchain_core.messages import BaseMessage,HumanMessage
 from langchain_openai import ChatOpenAI
-from langgraph.checkpoint.sqlite import SqliteSaver
 from langgraph.graph.message import add_messages
-from langgraph.prebuilt import ToolNode,tools_condition
+from langgraph.prebuilt import ToolNode
 from langchain_community.tools import DuckDuckGoSearchRun
 from langchain_core.tools import tool
 from dotenv import load_dotenv
@@ -12,13 +11,19 @@ import sqlite3
 import os
 import requests
 
+from admission_control import PROVIDER_GATE
+from checkpointing import make_checkpointer
+from tool_outputs import compact_tool_output
+from turn_budget import final_answer, model_step, route_after_model, tool_deadline
+
 
 load_dotenv()
 
 
 
 #----------LLM-------------------------
-llm = ChatOpenAI(model="gpt-4o-mini")
+# PROVIDER_GATE does the retrying, so it sees every 429 (see admission_control).
+llm = ChatOpenAI(model="gpt-4o-mini", max_retries=0)
 
 
 
@@ -79,19 +84,27 @@ class ChatState(TypedDict):
 # -------------------
 # 4. Nodes
 # -------------------
-def chat_node(state: ChatState):
+def chat_node(state: ChatState, config=None):
     """LLM node that may answer or request a tool call."""
     messages = state["messages"]
-    response = llm_with_tools.invoke(messages)
-    return {"messages": [response]}
+    # Bounded by the turn's deadline (see turn_budget.py)
+    return model_step(config, PROVIDER_GATE.call, llm_with_tools.invoke, messages)
+
+
+def final_answer_node(state: ChatState, config=None):
+    """Answers from what was gathered once the turn's tool or time budget is spent."""
+    return final_answer(state, config, llm, PROVIDER_GATE.call)
 
-tool_node = ToolNode(tools)
+# Results are projected and size-limited before they enter the thread (see tool_outputs.py);
+# each call is bounded by the turn's deadline.
+tool_node = ToolNode(tools, wrap_tool_call=tool_deadline(compact_tool_output))
 
 # -------------------
 # 5. Checkpointer
 # -------------------
 conn = sqlite3.connect(database="chatbot_tools.db", check_same_thread=False)
-checkpointer = SqliteSaver(conn=conn)
+# CHECKPOINT_* settings (durability, message store, latest-state cache, shards): see checkpointing.py
+checkpointer = make_checkpointer(conn)
 
 # -------------------
 # 6. Graph
@@ -99,11 +112,14 @@ checkpointer = SqliteSaver(conn=conn)
 graph = StateGraph(ChatState)
 graph.add_node("chat_node", chat_node)
 graph.add_node("tools", tool_node)
+graph.add_node("final_answer", final_answer_node)
 
 graph.add_edge(START, "chat_node")
 
-graph.add_conditional_edges("chat_node",tools_condition)
+# tools_condition plus CHAT_MAX_TOOL_ROUNDS and the turn deadline
+graph.add_conditional_edges("chat_node", route_after_model, ["tools", "final_answer", END])
 graph.add_edge('tools', 'chat_node')
+graph.add_edge("final_answer", END)
 
 chatbot = graph.compile(checkpointer=checkpointer)
 
@@ -111,7 +127,5 @@ chatbot = graph.compile(checkpointer=checkpointer)
 # 7. Helper
 # -------------------
 def retrieve_all_threads():
-    all_threads = set()
-    for checkpoint in checkpointer.list(None):
-        all_threads.add(checkpoint.config["configurable"]["thread_id"])
-    return list(all_threads)
\ No newline at end of file
+    # One query per shard; no checkpoint is loaded.
+    return checkpointer.thread_ids()
\ No newline at end of file
@@ -0,0 +1,472 @@
+"""
+Load test: many concurrent synthetic chat sessions against the chat graphs,
+entirely offline.
+
+The backends' model, embeddings and network tools are replaced by stand-ins
+with configurable latency; everything else (graphs, checkpointer, turn
+admission, retrieval, the service) is the real code. Sessions are a mix of
+plain chat, tool calls (calculator, stock price, web search) and questions
+about an uploaded PDF, each a thread of `--turns` turns. For every
+concurrency level the report shows throughput, p50/p99 turn latency and time
+to first token, the error rate, time spent waiting for the checkpointer's
+SQLite lock and for a turn slot, and process CPU use (near one core = GIL
+bound):
+
+    python load_test.py --concurrency 1,4,16,64 --turns 5
+    python load_test.py --via http --mix chat=1,tools=1,rag=2 --llm-ms 300
+    python load_test.py --via streamlit --concurrency 1,4
+
+--via picks the entry point: "graph" calls `chatbot.stream` directly,
+"client" (default) goes through `LocalChatClient` like the Streamlit
+frontends, "http" starts chat_service.py on a local port and uses
+`ChatServiceClient`, and "streamlit" runs the frontend scripts headless with
+streamlit.testing (no time to first token there). Databases, indexes and
+spill files go to a temporary directory (or --work-dir), never the app's own.
+CHECKPOINT_*, CHAT_MAX_CONCURRENT_TURNS and the other settings apply as usual.
+"""
+from __future__ import annotations
+
+import argparse
+import importlib
+import json
+import os
+import random
+import re
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, Dict, Iterator, List, Optional
+
+from langchain_core.embeddings.fake import DeterministicFakeEmbedding
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessageChunk, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.tools import StructuredTool
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+SESSION_GRAPHS = {"chat": "tools", "tools": "tools", "rag": "rag"}
+FRONTENDS = {"tools": "streamlit_frontend_tool.py", "rag": "streamlit_frontend_rag.py"}
+
+
+# -------------------
+# Offline stand-ins
+# -------------------
+class FakeChatModel(BaseChatModel):
+    """
+    Streams a canned answer, or calls a tool when the user's message asks for
+    one ("tools: ..." or "rag: ..."), after `first_token_ms`.
+    """
+
+    first_token_ms: float = 200.0
+    token_ms: float = 20.0
+    answer_tokens: int = 30
+
+    @property
+    def _llm_type(self) -> str:
+        return "load-test-fake"
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        message = None
+        for chunk in self._stream(messages, stop=stop, run_manager=run_manager, **kwargs):
+            message = chunk.message if message is None else message + chunk.message
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.first_token_ms / 1000)
+        call = self._tool_call(messages)
+        if call is not None:
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=[call]))
+            if run_manager:
+                run_manager.on_llm_new_token("", chunk=chunk)
+            yield chunk
+            return
+        for index in range(self.answer_tokens):
+            if index:
+                time.sleep(self.token_ms / 1000)
+            token = f"word{index} "
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    def _tool_call(self, messages) -> Optional[dict]:
+        last = messages[-1]
+        if isinstance(last, ToolMessage) or not isinstance(last, HumanMessage):
+            return None
+        kind, _, question = str(last.content).partition(": ")
+        if kind == "tools":
+            name, args = random.choice(
+                [
+                    ("calculator", {"first_num": 6, "second_num": 7, "operation": "mul"}),
+                    ("get_stock_price", {"symbol": "AAPL"}),
+                    ("duckduckgo_search", {"query": question}),
+                ]
+            )
+        elif kind == "rag":
+            # The rag graph's system prompt names the thread.
+            found = re.search(r"thread_id='([^']*)'", str(messages[0].content))
+            name, args = "rag_tool", {"query": question, "thread_id": found.group(1) if found else None}
+        else:
+            return None
+        return {"name": name, "args": json.dumps(args), "id": f"call-{uuid.uuid4().hex[:12]}", "index": 0}
+
+
+class FakeEmbeddings(DeterministicFakeEmbedding):
+    """Hash-seeded vectors, `call_ms` per request."""
+
+    call_ms: float = 30.0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.call_ms / 1000)
+        return super().embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        time.sleep(self.call_ms / 1000)
+        return super().embed_query(text)
+
+
+def _fake_tool(name: str, tool_ms: float) -> StructuredTool:
+    def run(**kwargs: Any) -> dict:
+        time.sleep(tool_ms / 1000)
+        return {"tool": name, "args": kwargs, "result": "lorem ipsum " * 20}
+
+    return StructuredTool.from_function(func=run, name=name, description=f"Offline {name}.")
+
+
+def install_fakes(args) -> Dict[str, Any]:
+    """Import the backends with the stand-ins in place; graph name -> backend module."""
+    import rag_embeddings
+
+    # Read when the rag backend builds its embedding chain at import.
+    rag_embeddings.make_embeddings = lambda *a, **k: FakeEmbeddings(size=384, call_ms=args.embed_ms)
+    from chat_service_client import GRAPH_MODULES
+
+    model = FakeChatModel(first_token_ms=args.llm_ms, token_ms=args.token_ms, answer_tokens=args.tokens)
+    backends = {}
+    for graph in sorted(set(SESSION_GRAPHS.values())):
+        backend = importlib.import_module(GRAPH_MODULES[graph])
+        backend.llm = backend.llm_with_tools = model  # looked up by chat_node on each call
+        for name in ("duckduckgo_search", "get_stock_price"):
+            backend.tool_node._tools_by_name[name] = _fake_tool(name, args.tool_ms)
+        backends[graph] = backend
+    return backends
+
+
+def synthetic_pdf(seed: int, pages: int = 6) -> bytes:
+    """A small text PDF, distinct per seed."""
+    rng = random.Random(seed)
+    words = ["policy", "valve", "notice", "travel", "safety", "budget", "review", "contract", "pump"]
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", b"", b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for page in range(pages):
+        lines = [" ".join(rng.choice(words) for _ in range(12)) for _ in range(40)]
+        stream = "BT /F1 10 Tf 20 800 Td 12 TL " + " ".join(f"({line}) '" for line in lines) + " ET"
+        kids.append(f"{4 + 2 * page} 0 R")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] /Resources << /Font << /F1 3 0 R >> >> "
+            f"/Contents {5 + 2 * page} 0 R >>".encode()
+        )
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream".encode())
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {pages} >>".encode()
+    out, offsets = b"%PDF-1.4\n", []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += b"".join(f"{offset:010d} 00000 n \n".encode() for offset in offsets)
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF".encode()
+    return out
+
+
+# -------------------
+# Measurements
+# -------------------
+class TimedLock:
+    """Wraps a checkpointer's lock and adds up the time spent waiting for it."""
+
+    def __init__(self, lock):
+        self._lock = lock
+        self._stats = threading.Lock()
+        self.wait_seconds = 0.0
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        start = time.perf_counter()
+        acquired = self._lock.acquire(blocking, timeout)
+        waited = time.perf_counter() - start
+        with self._stats:
+            self.wait_seconds += waited
+        return acquired
+
+    def release(self) -> None:
+        self._lock.release()
+
+    def locked(self) -> bool:
+        return self._lock.locked()
+
+    __enter__ = acquire
+
+    def __exit__(self, *exc: Any) -> None:
+        self._lock.release()
+
+
+def time_checkpointer_locks(backends) -> List[TimedLock]:
+    locks = []
+    for backend in backends.values():
+        checkpointer = backend.checkpointer
+        for saver in getattr(checkpointer, "savers", {"": checkpointer}).values():
+            saver.lock = TimedLock(saver.lock)
+            locks.append(saver.lock)
+    return locks
+
+
+class Results:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency: List[float] = []
+        self.first_token: List[float] = []
+        self.queued: List[float] = []
+        self.errors: Dict[str, int] = {}
+
+    def turn(self, latency: float, first_token: Optional[float], queued: float) -> None:
+        with self._lock:
+            self.latency.append(latency)
+            self.queued.append(queued)
+            if first_token is not None:
+                self.first_token.append(first_token)
+
+    def error(self, error: BaseException) -> None:
+        with self._lock:
+            name = type(error).__name__
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+# -------------------
+# Sessions
+# -------------------
+class ClientSession:
+    """A thread driven through LocalChatClient or ChatServiceClient."""
+
+    def __init__(self, client, thread_id: str):
+        self.client = client
+        self.thread_id = thread_id
+
+    def upload(self, pdf: bytes) -> None:
+        self.client.ingest_pdf(self.thread_id, pdf, "load-test.pdf")
+
+    def turn(self, message: str):
+        start, first_token, queued = time.perf_counter(), None, 0.0
+        for event in self.client.stream_turn(self.thread_id, message):
+            if event["event"] == "queued":
+                queued = max(queued, event.get("waited_seconds", 0.0))
+            elif event["event"] == "token" and first_token is None:
+                first_token = time.perf_counter() - start
+        return first_token, queued
+
+
+class GraphSession:
+    """A thread driven by calling the compiled graph directly."""
+
+    def __init__(self, backend, thread_id: str):
+        self.backend = backend
+        self.thread_id = thread_id
+
+    def upload(self, pdf: bytes) -> None:
+        self.backend.ingest_pdf(pdf, thread_id=self.thread_id, filename="load-test.pdf")
+
+    def turn(self, message: str):
+        start, first_token = time.perf_counter(), None
+        for chunk, _ in self.backend.chatbot.stream(
+            {"messages": [HumanMessage(content=message)]},
+            config={"configurable": {"thread_id": self.thread_id}},
+            stream_mode="messages",
+        ):
+            if first_token is None and isinstance(chunk, AIMessageChunk) and chunk.content:
+                first_token = time.perf_counter() - start
+        return first_token, 0.0
+
+
+class StreamlitSession:
+    """A browser session of a frontend script, run headless."""
+
+    def __init__(self, graph: str):
+        from streamlit.testing.v1 import AppTest
+
+        from chat_service_client import LocalChatClient
+
+        self.app = AppTest.from_file(os.path.join(REPO_DIR, FRONTENDS[graph]), default_timeout=600)
+        self.app.run()
+        self.thread_id = str(self.app.session_state["thread_id"])
+        self.client = LocalChatClient(graph)
+
+    def upload(self, pdf: bytes) -> None:
+        # AppTest cannot drive st.file_uploader; ingest for the script's thread.
+        self.client.ingest_pdf(self.thread_id, pdf, "load-test.pdf")
+
+    def turn(self, message: str):
+        self.app.chat_input[0].set_value(message).run()
+        if self.app.exception:
+            raise RuntimeError(self.app.exception[0].message)
+        if self.app.error:
+            raise RuntimeError(self.app.error[0].value)
+        return None, 0.0
+
+
+def open_session(via: str, kind: str, backends, base_url: Optional[str]):
+    graph = SESSION_GRAPHS[kind]
+    thread_id = f"load-{kind}-{uuid.uuid4().hex[:12]}"
+    if via == "graph":
+        return GraphSession(backends[graph], thread_id)
+    if via == "streamlit":
+        return StreamlitSession(graph)
+    from chat_service_client import ChatServiceClient, LocalChatClient
+
+    client = ChatServiceClient(base_url, graph) if via == "http" else LocalChatClient(graph)
+    return ClientSession(client, thread_id)
+
+
+def run_session(index: int, kind: str, args, backends, base_url, results: Results, pdfs: List[bytes]) -> None:
+    try:
+        session = open_session(args.via, kind, backends, base_url)
+        if kind == "rag":
+            session.upload(pdfs[index % len(pdfs)])
+    except Exception as e:
+        results.error(e)
+        return
+    for turn_index in range(args.turns):
+        start = time.perf_counter()
+        try:
+            first_token, queued = session.turn(f"{kind}: question {turn_index} about the {kind} case")
+        except Exception as e:
+            results.error(e)
+        else:
+            results.turn(time.perf_counter() - start, first_token, queued)
+        if args.think_ms:
+            time.sleep(random.uniform(0, 2 * args.think_ms) / 1000)
+
+
+def run_level(concurrency: int, args, backends, base_url, locks: List[TimedLock], pdfs) -> dict:
+    kinds = [kind for kind, weight in args.mix.items() for _ in range(weight)]
+    results = Results()
+    lock_wait_before = sum(lock.wait_seconds for lock in locks)
+    cpu_before, start = time.process_time(), time.perf_counter()
+    sessions = [
+        threading.Thread(
+            target=run_session,
+            args=(index, kinds[index % len(kinds)], args, backends, base_url, results, pdfs),
+            daemon=True,
+        )
+        for index in range(concurrency)
+    ]
+    for session in sessions:
+        session.start()
+    for session in sessions:
+        session.join()
+    elapsed = time.perf_counter() - start
+    turns = len(results.latency)
+    errors = sum(results.errors.values())
+    return {
+        "concurrency": concurrency,
+        "turns": turns,
+        "turns_per_second": turns / elapsed,
+        "p50_ms": 1000 * _percentile(results.latency, 0.5),
+        "p99_ms": 1000 * _percentile(results.latency, 0.99),
+        "first_token_p50_ms": 1000 * _percentile(results.first_token, 0.5),
+        "error_rate": errors / max(1, turns + errors),
+        "errors": results.errors,
+        "lock_wait_ms_per_turn": 1000 * (sum(lock.wait_seconds for lock in locks) - lock_wait_before) / max(1, turns),
+        "queued_ms_per_turn": 1000 * statistics.mean(results.queued) if results.queued else 0.0,
+        "cpu_percent": 100 * (time.process_time() - cpu_before) / elapsed,
+    }
+
+
+def start_service() -> str:
+    """Serve chat_service.py (with the stand-ins) on a free local port."""
+    import uvicorn
+
+    from chat_service import app
+
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, name="load-test-service", daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}"
+
+
+def _parse_mix(value: str) -> Dict[str, int]:
+    mix = {}
+    for part in value.split(","):
+        kind, _, weight = part.partition("=")
+        if kind not in SESSION_GRAPHS:
+            raise argparse.ArgumentTypeError(f"unknown session kind '{kind}' (use {', '.join(SESSION_GRAPHS)})")
+        mix[kind] = int(weight or 1)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default="1,2,4,8,16,32", help="session counts to ramp through")
+    parser.add_argument("--turns", type=int, default=5, help="turns per session")
+    parser.add_argument("--mix", type=_parse_mix, default=_parse_mix("chat=2,tools=1,rag=1"))
+    parser.add_argument("--via", choices=("graph", "client", "http", "streamlit"), default="client")
+    parser.add_argument("--llm-ms", type=float, default=200.0, help="model time to first token")
+    parser.add_argument("--token-ms", type=float, default=20.0, help="time per streamed token")
+    parser.add_argument("--tokens", type=int, default=30, help="tokens per answer")
+    parser.add_argument("--tool-ms", type=float, default=100.0, help="web search / stock price latency")
+    parser.add_argument("--embed-ms", type=float, default=30.0, help="embedding request latency")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="mean pause between a session's turns")
+    parser.add_argument("--pdfs", type=int, default=4, help="distinct PDFs uploaded by rag sessions")
+    parser.add_argument("--work-dir", help="where databases and indexes go (default: a temp dir)")
+    args = parser.parse_args()
+
+    sys.path.insert(0, REPO_DIR)
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="chat-load-test-")
+    os.makedirs(work_dir, exist_ok=True)
+    os.chdir(work_dir)  # the backends open chatbot.db etc. relative to it
+    os.environ.setdefault("OPENAI_API_KEY", "load-test")  # clients are built but never called
+
+    backends = install_fakes(args)
+    locks = time_checkpointer_locks(backends)
+    base_url = start_service() if args.via == "http" else None
+    pdfs = [synthetic_pdf(seed) for seed in range(max(1, args.pdfs))]
+
+    print(
+        f"via {args.via}, mix {args.mix}, {args.turns} turns/session, llm {args.llm_ms:g} ms "
+        f"+ {args.tokens} x {args.token_ms:g} ms, tool {args.tool_ms:g} ms, embed {args.embed_ms:g} ms\n"
+        f"work dir {work_dir}\n"
+    )
+    print(
+        f"{'sessions':>8}{'turns':>7}{'turns/s':>9}{'p50 ms':>9}{'p99 ms':>9}{'ttft p50':>10}"
+        f"{'errors':>8}{'lock ms/turn':>14}{'queued ms':>11}{'cpu %':>7}"
+    )
+    for concurrency in (int(value) for value in args.concurrency.split(",")):
+        result = run_level(concurrency, args, backends, base_url, locks, pdfs)
+        print(
+            f"{result['concurrency']:>8}{result['turns']:>7}{result['turns_per_second']:>9.2f}"
+            f"{result['p50_ms']:>9.0f}{result['p99_ms']:>9.0f}{result['first_token_p50_ms']:>10.0f}"
+            f"{100 * result['error_rate']:>7.1f}%{result['lock_wait_ms_per_turn']:>14.2f}"
+            f"{result['queued_ms_per_turn']:>11.0f}{result['cpu_percent']:>7.0f}"
+        )
+        for name, count in sorted(result["errors"].items()):
+            print(f"{'':>8}  {count} x {name}")
+
+
+if __name__ == "__main__":
+    main()
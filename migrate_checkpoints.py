@@ -0,0 +1,61 @@
+"""
+Move existing checkpoint databases to the message store (see checkpointing.py).
+
+Rewrites every checkpoint that still embeds its message list so it references
+the `messages` table instead, then optionally VACUUMs to return the freed
+pages to the filesystem:
+
+    python migrate_checkpoints.py chatbot.db chatbot_tools.db --vacuum
+
+Stop the app first; start it again with CHECKPOINT_MESSAGE_STORE=1, since
+plain SqliteSaver cannot read migrated checkpoints. Rerunning is harmless.
+Take a copy of the database beforehand if you may want to roll back.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sqlite3
+
+from checkpointing import MessageStoreSaver
+
+
+def file_size(path):
+    return sum(
+        os.path.getsize(candidate)
+        for candidate in (path, f"{path}-wal")
+        if os.path.exists(candidate)
+    )
+
+
+def migrate(path, batch_size, vacuum):
+    before = file_size(path)
+    conn = sqlite3.connect(path, check_same_thread=False)
+    try:
+        stats = MessageStoreSaver(conn, durability="sync").migrate(batch_size=batch_size)
+        if vacuum:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            conn.execute("VACUUM")
+        messages = conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+    finally:
+        conn.close()
+    print(
+        f"{path}: {stats['migrated']} of {stats['checkpoints']} checkpoints migrated, "
+        f"{messages} messages stored; checkpoint data "
+        f"{stats['bytes_before'] / 1024:.0f} KB -> {stats['bytes_after'] / 1024:.0f} KB; "
+        f"file {before / 1024:.0f} KB -> {file_size(path) / 1024:.0f} KB"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("databases", nargs="+")
+    parser.add_argument("--batch-size", type=int, default=100, help="checkpoints per transaction")
+    parser.add_argument("--vacuum", action="store_true", help="compact the file afterwards")
+    args = parser.parse_args()
+    for path in args.databases:
+        migrate(path, args.batch_size, args.vacuum)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,293 @@
+"""
+Opt-in profiling of turns, and memory snapshots around index builds and loads.
+
+    CHAT_PROFILE_TURNS=1     sample every turn (or tick "Profile turns" in a
+                             frontend's sidebar for that session only)
+    CHAT_PROFILE_MEMORY=1    tracemalloc snapshots around `ingest_pdf` and
+                             retriever loads
+    CHAT_PROFILE_DIR         where reports go (default "profiles")
+    CHAT_PROFILE_INTERVAL_MS sampling interval (default 10)
+
+A profiled turn is sampled from a background thread: every interval the
+stacks of all threads are read with `sys._current_frames()`, so the model
+call, tools, checkpoint writes and, with the in-process client, the Streamlit
+script all show up. Samples are wall-clock (waiting on the provider is time
+spent in the HTTP client). Each turn writes
+`<time>-turn-<thread>.speedscope.json` (open it at https://www.speedscope.app,
+one profile per thread) and `.collapsed.txt` for flamegraph.pl. At the
+default interval the sampler costs well under 5% of turn time.
+
+Memory reports (`<time>-<label>.memory.txt`) list the allocations that grew
+most across the operation, by source line, plus its peak. tracemalloc slows
+every allocation while it is on, so enable it while investigating only; it
+is stopped again once no snapshot is in progress. Operations running at the
+same time show up in each other's reports.
+"""
+from __future__ import annotations
+
+import json
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+import warnings
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+PROFILE_TURNS = os.getenv("CHAT_PROFILE_TURNS", "0").strip().lower() in ("1", "true", "yes")
+PROFILE_MEMORY = os.getenv("CHAT_PROFILE_MEMORY", "0").strip().lower() in ("1", "true", "yes")
+PROFILE_DIR = os.getenv("CHAT_PROFILE_DIR", "profiles")
+SAMPLE_INTERVAL_MS = float(os.getenv("CHAT_PROFILE_INTERVAL_MS", "10"))
+MEMORY_TOP = int(os.getenv("CHAT_PROFILE_MEMORY_TOP", "25"))
+MEMORY_FRAMES = int(os.getenv("CHAT_PROFILE_MEMORY_FRAMES", "1"))
+
+Frame = Tuple[str, str, int]  # function, file, first line
+
+
+def _report_path(label: str, suffix: str) -> str:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    safe = re.sub(r"[^\w.-]+", "_", label)[:80]
+    now = time.time()
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(now)) + f".{int(now * 1000) % 1000:03d}"
+    return os.path.join(PROFILE_DIR, f"{stamp}-{safe}{suffix}")
+
+
+# -------------------
+# CPU sampling
+# -------------------
+class Profile:
+    """Stack samples collected while one profiled operation runs."""
+
+    def __init__(self, label: str):
+        self.label = label
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.samples: Dict[str, Counter] = {}  # thread name -> Counter of stacks (root first)
+        self.paths: List[str] = []
+
+    def add(self, thread: str, stack: Tuple[Frame, ...]) -> None:
+        stacks = self.samples.get(thread)
+        if stacks is None:
+            stacks = self.samples[thread] = Counter()
+        stacks[stack] += 1
+
+    def write(self, interval_ms: float) -> str:
+        """Write the speedscope and collapsed-stack files; the speedscope path."""
+        index: Dict[Frame, int] = {}
+        profiles = []
+        collapsed = []
+        for thread, stacks in sorted(self.samples.items()):
+            samples, weights = [], []
+            for stack, count in stacks.most_common():
+                samples.append([index.setdefault(frame, len(index)) for frame in stack])
+                weights.append(count * interval_ms)
+                collapsed.append(
+                    ";".join([thread, *(f"{name} ({os.path.basename(file)}:{line})" for name, file, line in stack)])
+                    + f" {count}"
+                )
+            profiles.append(
+                {
+                    "type": "sampled",
+                    "name": thread,
+                    "unit": "milliseconds",
+                    "startValue": 0,
+                    "endValue": sum(weights),
+                    "samples": samples,
+                    "weights": weights,
+                }
+            )
+        frames = sorted(index, key=index.get)
+        speedscope = {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": f"{self.label} ({self.duration * 1000:.0f} ms)",
+            "exporter": "profiling.py",
+            "shared": {"frames": [{"name": name, "file": file, "line": line} for name, file, line in frames]},
+            "profiles": profiles,
+        }
+        path = _report_path(self.label, ".speedscope.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(speedscope, f)
+        with open(path.replace(".speedscope.json", ".collapsed.txt"), "w", encoding="utf-8") as f:
+            f.write("\n".join(collapsed) + "\n")
+        return path
+
+
+class _Sampler:
+    """One background thread that samples for every active profile."""
+
+    def __init__(self, interval_ms: float):
+        self.interval_ms = interval_ms
+        self._lock = threading.Lock()
+        self._profiles: List[Profile] = []
+        self._thread: Optional[threading.Thread] = None
+        self._names: Dict[int, str] = {}
+        self._frames: Dict[object, Frame] = {}  # code object -> frame key
+        # thread -> (leaf frame, stack) of the last sample: a frame's callers
+        # never change, so a thread still in the same frame (most are idle,
+        # waiting) is not walked again.
+        self._last: Dict[int, Tuple[Any, Tuple[Frame, ...]]] = {}
+
+    def add(self, profile: Profile) -> None:
+        with self._lock:
+            self._profiles.append(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="profiling-sampler", daemon=True)
+                self._thread.start()
+
+    def remove(self, profile: Profile) -> None:
+        with self._lock:
+            self._profiles.remove(profile)
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        interval = self.interval_ms / 1000
+        while True:
+            with self._lock:
+                profiles = list(self._profiles)
+                if not profiles:
+                    self._thread = None
+                    self._last = {}
+                    return
+            frames = sys._current_frames()
+            if any(ident not in self._names for ident in frames):
+                self._names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in frames.items():
+                if ident == me:
+                    continue
+                last = self._last.get(ident)
+                if last is not None and last[0] is frame:
+                    stack = last[1]
+                else:
+                    stack = self._stack(frame)
+                    self._last[ident] = (frame, stack)
+                thread = self._names.get(ident, str(ident))
+                for profile in profiles:
+                    profile.add(thread, stack)
+            if len(self._last) > len(frames):
+                self._last = {ident: last for ident, last in self._last.items() if ident in frames}
+            del frames, frame
+            time.sleep(interval)
+
+    def _stack(self, frame) -> Tuple[Frame, ...]:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            key = self._frames.get(code)
+            if key is None:
+                key = self._frames[code] = (code.co_name, code.co_filename, code.co_firstlineno)
+            stack.append(key)
+            frame = frame.f_back
+        stack.reverse()
+        return tuple(stack)
+
+
+_SAMPLER = _Sampler(SAMPLE_INTERVAL_MS)
+
+
+@contextmanager
+def sampled(label: str, enabled: bool = True) -> Iterator[Optional[Profile]]:
+    """Sample all threads while the block runs and write the reports; yields
+    the Profile (its `paths` are set on exit), or None when disabled."""
+    if not enabled:
+        yield None
+        return
+    profile = Profile(label)
+    _SAMPLER.add(profile)
+    try:
+        yield profile
+    finally:
+        _SAMPLER.remove(profile)
+        profile.duration = time.perf_counter() - profile.started
+        try:
+            path = profile.write(_SAMPLER.interval_ms)
+        except Exception as e:
+            # A report that cannot be written must not fail the profiled operation.
+            warnings.warn(f"profile of {label} not written: {type(e).__name__}: {e}")
+        else:
+            profile.paths = [path, path.replace(".speedscope.json", ".collapsed.txt")]
+
+
+# -------------------
+# Memory snapshots
+# -------------------
+_TRACE_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+)
+# Snapshots in progress; tracing runs only while there are any, unless
+# something else in the process started it.
+_tracing_lock = threading.Lock()
+_snapshots = 0
+_started_tracing = False
+
+
+@contextmanager
+def memory_snapshot(label: str) -> Iterator[None]:
+    """
+    With CHAT_PROFILE_MEMORY=1, report the allocations made across the block.
+    Also usable as a decorator.
+    """
+    if not PROFILE_MEMORY:
+        yield
+        return
+    _start_tracing()
+    try:
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot().filter_traces(_TRACE_FILTERS)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            current, peak = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot().filter_traces(_TRACE_FILTERS)
+            try:
+                _write_memory_report(label, before, after, elapsed, current, peak)
+            except Exception as e:
+                # Keep the operation's own result or exception.
+                warnings.warn(f"memory report of {label} not written: {type(e).__name__}: {e}")
+    finally:
+        _stop_tracing()
+
+
+def _start_tracing() -> None:
+    global _snapshots, _started_tracing
+    with _tracing_lock:
+        if _snapshots == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(MEMORY_FRAMES)
+            _started_tracing = True
+        _snapshots += 1
+
+
+def _stop_tracing() -> None:
+    """Stop tracing when the last snapshot that needed it ends, if a snapshot started it."""
+    global _snapshots, _started_tracing
+    with _tracing_lock:
+        _snapshots -= 1
+        if _snapshots == 0 and _started_tracing:
+            tracemalloc.stop()
+            _started_tracing = False
+
+
+def _write_memory_report(label, before, after, elapsed, current, peak) -> str:
+    diff = after.compare_to(before, "lineno")
+    grown = sum(stat.size_diff for stat in diff)
+    lines = [
+        f"{label}: {elapsed * 1000:.0f} ms, net {grown / 1024 / 1024:+.2f} MiB, "
+        f"peak traced {peak / 1024 / 1024:.2f} MiB (now {current / 1024 / 1024:.2f} MiB)",
+        "",
+        f"Top {MEMORY_TOP} by growth:",
+    ]
+    for stat in sorted(diff, key=lambda stat: stat.size_diff, reverse=True)[:MEMORY_TOP]:
+        frame = stat.traceback[0]
+        lines.append(
+            f"{stat.size_diff / 1024:>+12.1f} KiB {stat.count_diff:>+8} blocks  {frame.filename}:{frame.lineno}"
+        )
+    path = _report_path(label, ".memory.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    return path
@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import atexit
+import json
+import os
+import pathlib
+import shutil
+import sqlite3
+import tempfile
+import threading
+import uuid
+import weakref
+from contextlib import closing
+from typing import Dict, List, Optional, Union
+
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_core.documents import Document
+
+_SCHEMA = "CREATE TABLE IF NOT EXISTS chunks (id TEXT PRIMARY KEY, content TEXT, metadata TEXT)"
+
+_PRIVATE_DIRS: Dict[str, str] = {}
+_PRIVATE_DIRS_LOCK = threading.Lock()
+
+
+def _private_dir(root: str) -> str:
+    """One directory per process under `root`, removed at exit (like the spill dir)."""
+    with _PRIVATE_DIRS_LOCK:
+        if root not in _PRIVATE_DIRS:
+            os.makedirs(root, exist_ok=True)
+            _PRIVATE_DIRS[root] = tempfile.mkdtemp(prefix="docstore_", dir=root)
+            atexit.register(shutil.rmtree, _PRIVATE_DIRS[root], True)
+        return _PRIVATE_DIRS[root]
+
+
+def _close_and_unlink(conn: sqlite3.Connection, path: str) -> None:
+    conn.close()
+    for suffix in ("", "-journal", "-wal", "-shm"):
+        try:
+            os.remove(path + suffix)
+        except FileNotFoundError:
+            pass
+
+
+class SqliteDocstore(Docstore, AddableMixin):
+    """
+    Chunk text and metadata in a SQLite file instead of `Document` objects.
+
+    An `InMemoryDocstore` keeps a `Document` (plus its metadata dict) alive
+    for every chunk, which costs several times the raw text. Here only the
+    page cache stays in memory and `search`/`mget` build `Document`s for the
+    hits being returned. Each store owns a private database file under
+    `directory`, deleted when the store is garbage collected.
+
+    Pickling keeps no rows: `RagIndex.save_local` copies the database next to
+    the FAISS files with `save` and `load` restores it.
+    """
+
+    def __init__(self, directory: str, path: Optional[str] = None):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._open(path)
+
+    def _open(self, path: Optional[str]) -> None:
+        self.path = os.path.join(_private_dir(self.directory), f"{uuid.uuid4().hex}.sqlite")
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        if path is not None:
+            with closing(sqlite3.connect(path)) as source:
+                source.backup(self._conn)
+        self._conn.execute(_SCHEMA)
+        self._conn.commit()
+        # Chunks are re-creatable from the PDF, so skip fsyncs on this scratch file.
+        self._conn.execute("PRAGMA synchronous=OFF")
+        self._finalizer = weakref.finalize(self, _close_and_unlink, self._conn, self.path)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        rows = [
+            (doc_id, doc.page_content, json.dumps(doc.metadata)) for doc_id, doc in texts.items()
+        ]
+        with self._lock:
+            try:
+                with self._conn:
+                    self._conn.executemany("INSERT INTO chunks VALUES (?, ?, ?)", rows)
+            except sqlite3.IntegrityError as e:
+                raise ValueError(f"Tried to add ids that already exist: {e}") from e
+
+    def delete(self, ids: List) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM chunks WHERE id = ?", [(doc_id,) for doc_id in ids])
+
+    def search(self, search: str) -> Union[str, Document]:
+        docs = self.mget([search])
+        return docs[0] if docs[0] is not None else f"ID {search} not found."
+
+    def mget(self, ids: List[str]) -> List[Optional[Document]]:
+        """Fetch several chunks with one query, in the order of `ids`."""
+        found: Dict[str, Document] = {}
+        unique = list(dict.fromkeys(ids))
+        with self._lock:
+            # Stay below SQLite's default limit on bound parameters.
+            for start in range(0, len(unique), 500):
+                batch = unique[start : start + 500]
+                placeholders = ",".join("?" * len(batch))
+                for doc_id, content, metadata in self._conn.execute(
+                    f"SELECT id, content, metadata FROM chunks WHERE id IN ({placeholders})", batch
+                ):
+                    found[doc_id] = Document(
+                        id=doc_id, page_content=content, metadata=json.loads(metadata)
+                    )
+        return [found.get(doc_id) for doc_id in ids]
+
+    def save(self, path: str) -> None:
+        """Write a consistent copy of the database to `path`."""
+        with self._lock, closing(sqlite3.connect(path)) as target:
+            self._conn.backup(target)
+
+    @classmethod
+    def load(cls, path: str, directory: str) -> "SqliteDocstore":
+        """Open a private copy of a database written by `save`."""
+        return cls(directory, path=path)
+
+    @classmethod
+    def open_read_only(cls, path: str) -> "SqliteDocstore":
+        """
+        Open a database written by `save` in place, without copying it.
+
+        The file is shared with other processes and must never change while
+        open; `add` and `delete` fail.
+        """
+        docstore = cls.__new__(cls)
+        docstore.directory = os.path.dirname(path)
+        docstore.path = path
+        docstore._lock = threading.Lock()
+        docstore._conn = sqlite3.connect(
+            f"{pathlib.Path(path).resolve().as_uri()}?mode=ro&immutable=1",
+            uri=True,
+            check_same_thread=False,
+        )
+        docstore._finalizer = weakref.finalize(docstore, docstore._conn.close)
+        return docstore
+
+    def __getstate__(self) -> dict:
+        return {"directory": self.directory}
+
+    def __setstate__(self, state: dict) -> None:
+        # Unpickled empty; `RagIndex.load_local` swaps in the saved copy.
+        self.directory = state["directory"]
+        self._lock = threading.Lock()
+        self._open(None)
@@ -0,0 +1,298 @@
+from __future__ import annotations
+
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+from langchain_openai import OpenAIEmbeddings
+
+# ONNX files shipped by sentence-transformers models (or written by its
+# export helpers) for each local runtime.
+_ONNX_FILES = {
+    "onnx": "onnx/model.onnx",
+    "onnx-int8": "onnx/model_qint8_avx512.onnx",
+}
+
+
+def make_embeddings(
+    provider: Optional[str] = None,
+    model: Optional[str] = None,
+    batch_size: Optional[int] = None,
+    num_threads: Optional[int] = None,
+    runtime: Optional[str] = None,
+    max_retries: Optional[int] = None,
+) -> Embeddings:
+    """
+    Build the embeddings model selected by RAG_EMBEDDING_PROVIDER.
+
+    - "openai" (default): OpenAIEmbeddings, model RAG_EMBEDDING_MODEL or
+      text-embedding-3-small.
+    - "local": a sentence-transformers model on CPU. RAG_EMBEDDING_MODEL may
+      be a hub id or a pre-downloaded directory (loaded with
+      local_files_only, so no network is needed). RAG_LOCAL_EMBEDDING_BATCH_SIZE
+      sets the inference batch, RAG_LOCAL_EMBEDDING_THREADS the CPU threads and
+      RAG_LOCAL_EMBEDDING_RUNTIME one of "torch", "onnx" or "onnx-int8".
+
+    Arguments override the environment, which the benchmark script relies on.
+    `max_retries` is passed to the OpenAI client (default: the SDK's own).
+    """
+    provider = provider or os.getenv("RAG_EMBEDDING_PROVIDER", "openai")
+    if provider == "openai":
+        retries = {"max_retries": max_retries} if max_retries is not None else {}
+        return OpenAIEmbeddings(
+            model=model or os.getenv("RAG_EMBEDDING_MODEL", "text-embedding-3-small"), **retries
+        )
+    if provider == "local":
+        return _local_embeddings(
+            model=model or os.getenv("RAG_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2"),
+            batch_size=batch_size or int(os.getenv("RAG_LOCAL_EMBEDDING_BATCH_SIZE", "64")),
+            num_threads=num_threads or int(os.getenv("RAG_LOCAL_EMBEDDING_THREADS", "0")),
+            runtime=runtime or os.getenv("RAG_LOCAL_EMBEDDING_RUNTIME", "torch"),
+        )
+    raise ValueError(f"Unknown embedding provider '{provider}'")
+
+
+def _local_embeddings(model: str, batch_size: int, num_threads: int, runtime: str) -> Embeddings:
+    if runtime not in ("torch", *_ONNX_FILES):
+        raise ValueError(f"Unknown local embedding runtime '{runtime}'")
+    if num_threads:
+        # Read by onnxruntime and the torch/OpenMP thread pools at start-up.
+        os.environ.setdefault("OMP_NUM_THREADS", str(num_threads))
+
+    import torch
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    if num_threads:
+        torch.set_num_threads(num_threads)
+
+    model_kwargs = {"device": "cpu", "local_files_only": os.path.isdir(model)}
+    if runtime != "torch":
+        model_kwargs["backend"] = "onnx"
+        model_kwargs["model_kwargs"] = {
+            "file_name": os.getenv("RAG_LOCAL_EMBEDDING_ONNX_FILE", _ONNX_FILES[runtime])
+        }
+
+    return HuggingFaceEmbeddings(
+        model_name=model,
+        model_kwargs=model_kwargs,
+        encode_kwargs={"batch_size": batch_size, "normalize_embeddings": True},
+    )
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """
+    Wraps an embeddings model with an LRU cache of query vectors.
+
+    Repeated and re-issued queries skip the embedding request entirely, and
+    `embed_queries` sends every cache miss of a batch in one
+    `embed_documents` call. Document embedding is passed through uncached.
+    """
+
+    def __init__(self, inner: Embeddings, max_entries: int = 1024):
+        self.inner = inner
+        self.max_entries = max_entries
+        self._cache: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._batches = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.inner.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_queries([text])[0]
+
+    def embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """Embed several queries, hitting the API at most once for all misses."""
+        keys = [query.strip() for query in queries]
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    found[key] = self._cache[key]
+            self._hits += sum(1 for key in keys if key in found)
+
+        misses = list(dict.fromkeys(key for key in keys if key not in found))
+        if misses:
+            vectors = self.inner.embed_documents(misses)
+            with self._lock:
+                self._misses += len(misses)
+                self._batches += 1
+                for key, vector in zip(misses, vectors):
+                    found[key] = vector
+                    self._cache[key] = vector
+                    self._cache.move_to_end(key)
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+
+        return [found[key] for key in keys]
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._cache),
+                "max_entries": self.max_entries,
+                "hits": self._hits,
+                "misses": self._misses,
+                "embedding_calls": self._batches,
+            }
+
+
+class _EmbeddingRequest:
+    __slots__ = ("texts", "future", "enqueued")
+
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        self.future: Future = Future()
+        self.enqueued = time.perf_counter()
+
+
+class BatchingEmbeddings(Embeddings):
+    """
+    Coalesces concurrent embedding calls into batched provider requests.
+
+    Callers block on their own request while a dispatcher thread collects
+    everything that arrives within `max_wait_ms` of the first pending request
+    (up to `max_batch_size` texts), sends it as one `embed_documents` call and
+    hands each caller its slice of the vectors. A single call larger than
+    `max_batch_size` (a PDF being ingested) is sent on its own. Up to
+    `max_concurrent_batches` requests are in flight at once; callers queue
+    behind them and are batched together.
+
+    Queries go through `embed_documents` as well, which is equivalent for the
+    supported providers.
+    """
+
+    def __init__(
+        self,
+        inner: Embeddings,
+        max_batch_size: int = 256,
+        max_wait_ms: float = 5.0,
+        max_concurrent_batches: int = 4,
+    ):
+        self.inner = inner
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue: "queue.Queue[_EmbeddingRequest]" = queue.Queue()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrent_batches, thread_name_prefix="embedding-batch"
+        )
+        self._slots = threading.Semaphore(max_concurrent_batches)
+        self._dispatcher: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+        self._batches = 0
+        self._requests = 0
+        self._texts = 0
+        self._wait_seconds = 0.0
+        self._batch_sizes: Dict[str, int] = {}
+        self._requests_per_batch: Dict[str, int] = {}
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        request = _EmbeddingRequest(list(texts))
+        self._ensure_dispatcher()
+        self._queue.put(request)
+        return request.future.result()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def metrics(self) -> dict:
+        """Totals plus histograms of texts and caller requests per provider call."""
+        with self._lock:
+            return {
+                "batches": self._batches,
+                "requests": self._requests,
+                "texts": self._texts,
+                "mean_wait_ms": round(1000 * self._wait_seconds / self._requests, 2)
+                if self._requests
+                else 0.0,
+                "batch_size_histogram": dict(self._batch_sizes),
+                "requests_per_batch_histogram": dict(self._requests_per_batch),
+            }
+
+    # -------------------
+    # Internals
+    # -------------------
+    def _ensure_dispatcher(self) -> None:
+        with self._lock:
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(
+                    target=self._dispatch_loop, name="embedding-dispatcher", daemon=True
+                )
+                self._dispatcher.start()
+
+    def _dispatch_loop(self) -> None:
+        carry: Optional[_EmbeddingRequest] = None
+        while True:
+            # Wait for a free slot first, so requests arriving meanwhile pile up
+            # in the queue and go out together.
+            self._slots.acquire()
+            first = carry or self._queue.get()
+            carry = None
+            batch = [first]
+            size = len(first.texts)
+            deadline = time.perf_counter() + self.max_wait
+            while size < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if size + len(request.texts) > self.max_batch_size:
+                    carry = request
+                    break
+                batch.append(request)
+                size += len(request.texts)
+
+            self._executor.submit(self._send, batch)
+
+    def _send(self, batch: List[_EmbeddingRequest]) -> None:
+        try:
+            started = time.perf_counter()
+            texts = [text for request in batch for text in request.texts]
+            self._record(batch, len(texts), started)
+            try:
+                vectors = self.inner.embed_documents(texts)
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                return
+            offset = 0
+            for request in batch:
+                request.future.set_result(vectors[offset : offset + len(request.texts)])
+                offset += len(request.texts)
+        finally:
+            self._slots.release()
+
+    def _record(self, batch: List[_EmbeddingRequest], num_texts: int, started: float) -> None:
+        with self._lock:
+            self._batches += 1
+            self._requests += len(batch)
+            self._texts += num_texts
+            self._wait_seconds += sum(started - request.enqueued for request in batch)
+            size_bucket = _histogram_bucket(num_texts)
+            self._batch_sizes[size_bucket] = self._batch_sizes.get(size_bucket, 0) + 1
+            requests_bucket = _histogram_bucket(len(batch))
+            self._requests_per_batch[requests_bucket] = (
+                self._requests_per_batch.get(requests_bucket, 0) + 1
+            )
+
+
+def _histogram_bucket(value: int) -> str:
+    """Power-of-two bucket label: "1", "2", "3-4", "5-8", ..."""
+    if value <= 2:
+        return str(value)
+    upper = 1 << (value - 1).bit_length()
+    return f"{upper // 2 + 1}-{upper}"
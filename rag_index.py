@@ -0,0 +1,361 @@
+from __future__ import annotations
+
+import json
+import math
+import os
+import re
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from rag_docstore import SqliteDocstore
+from rag_lexical import BM25Index, is_keyword_query, query_identifiers, reciprocal_rank_fusion
+from rag_registry import estimate_index_bytes
+
+_META_NAME = "rag_index.json"
+_LEXICAL_NAME = "lexical.json"
+_DOCSTORE_NAME = "docstore.sqlite"
+
+# Chunk text lives in SQLite files under DOCSTORE_DIR ("sqlite") or as
+# Document objects in memory ("memory").
+DOCSTORE = os.getenv("RAG_DOCSTORE", "sqlite")
+DOCSTORE_DIR = os.getenv("RAG_DOCSTORE_DIR", "rag_docstore")
+
+# -------------------
+# Index type selection
+# -------------------
+# Flat (exact) search up to FLAT_MAX_CHUNKS, an IVF or HNSW index up to
+# MEDIUM_MAX_CHUNKS and compressed IVF storage (product quantization or float16)
+# beyond that. Counts are per PDF: every document gets its own index.
+FLAT_MAX_CHUNKS = int(os.getenv("RAG_FAISS_FLAT_MAX_CHUNKS", "2000"))
+MEDIUM_MAX_CHUNKS = int(os.getenv("RAG_FAISS_MEDIUM_MAX_CHUNKS", "50000"))
+MEDIUM_INDEX = os.getenv("RAG_FAISS_MEDIUM_INDEX", "ivf")  # "ivf" or "hnsw"
+# "fp16" halves memory at ~0.99 recall@4 in benchmark_faiss_index.py. "pq" is
+# ~15x smaller again but recalls only ~0.3 of the exact top 4 there (no
+# re-ranking stage, which would need the full vectors); only for corpora that
+# cannot fit in memory otherwise.
+LARGE_STORAGE = os.getenv("RAG_FAISS_LARGE_STORAGE", "fp16")  # "fp16" or "pq"
+
+# Search-time accuracy/speed knobs for IVF (lists probed) and HNSW (beam width).
+NPROBE = int(os.getenv("RAG_FAISS_NPROBE", "16"))
+EF_SEARCH = int(os.getenv("RAG_FAISS_EF_SEARCH", "128"))
+
+
+def index_tier(num_vectors: int) -> int:
+    """0 = small, 1 = medium, 2 = large."""
+    if num_vectors <= FLAT_MAX_CHUNKS:
+        return 0
+    if num_vectors <= MEDIUM_MAX_CHUNKS:
+        return 1
+    return 2
+
+
+def choose_index_factory(num_vectors: int, dim: int) -> str:
+    """
+    Pick a `faiss.index_factory` string for a corpus of `num_vectors` chunks.
+
+    The corpus is one PDF, since every document gets its own index: a thread
+    with many mid-sized PDFs searches many exact `Flat` indexes, each small
+    enough to be fast, rather than one approximate index over all of them.
+    """
+    tier = index_tier(num_vectors)
+    if tier == 0:
+        return "Flat"
+
+    nlist = ivf_nlist(num_vectors)
+    if tier == 1:
+        return "HNSW32" if MEDIUM_INDEX == "hnsw" else f"IVF{nlist},Flat"
+    if LARGE_STORAGE == "fp16":
+        return f"IVF{nlist},SQfp16"
+    # "np" skips polysemous training, which is slow and only helps Hamming search.
+    return f"IVF{nlist},PQ{pq_subquantizers(dim)}np"
+
+
+def ivf_nlist(num_vectors: int) -> int:
+    """~4*sqrt(n) inverted lists, keeping at least 39 training points per centroid."""
+    return max(1, min(int(4 * math.sqrt(num_vectors)), num_vectors // 39))
+
+
+def pq_subquantizers(dim: int) -> int:
+    """Most sub-quantizers that divide `dim` while keeping >= 8 dims each."""
+    return next(
+        (m for m in (96, 64, 48, 32, 24, 16, 8, 4) if dim % m == 0 and dim // m >= 8), 1
+    )
+
+
+def build_faiss_index(factory: str, training_vectors: np.ndarray) -> faiss.Index:
+    """Create an empty index of type `factory`, trained on `training_vectors`."""
+    index = faiss.index_factory(training_vectors.shape[1], factory)
+    if not index.is_trained:
+        index.train(training_vectors)
+    apply_search_params(index)
+    return index
+
+
+def apply_search_params(index: faiss.Index, nprobe: int = NPROBE, ef_search: int = EF_SEARCH) -> None:
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = nprobe
+    hnsw_index = faiss.downcast_index(index)
+    if hasattr(hnsw_index, "hnsw"):
+        hnsw_index.hnsw.efSearch = ef_search
+
+
+def new_docstore():
+    if DOCSTORE == "sqlite":
+        return SqliteDocstore(DOCSTORE_DIR)
+    if DOCSTORE == "memory":
+        return InMemoryDocstore()
+    raise ValueError(f"Unknown docstore '{DOCSTORE}'")
+
+
+def mmap_io_flags(factory: str) -> int:
+    """`faiss.read_index` flags that map an index's vectors instead of reading them."""
+    if "IVF" in factory:
+        # Inverted lists are mapped; combining this with MMAP_IFC is rejected.
+        return faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+    # Flat codes, which for HNSW is the vector storage (the graph is still read).
+    return faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY
+
+
+class RagIndex:
+    """
+    The chunks of one PDF, searchable through FAISS.
+
+    An index is built once per distinct document (see the rag backend) and
+    never modified afterwards; threads that use several PDFs search each one's
+    index and merge the results with `retrieve_across`. The FAISS index type
+    therefore follows the chunk count of that one PDF (see
+    `choose_index_factory`). A BM25 index over the same chunk ids lets
+    `retrieve` answer keyword queries without embedding them.
+    """
+
+    def __init__(
+        self,
+        vector_store: FAISS,
+        files: Optional[Dict[str, List[str]]] = None,
+        factory: str = "Flat",
+        lexical: Optional[BM25Index] = None,
+        overview: Optional[dict] = None,
+    ):
+        self.vector_store = vector_store
+        self.files: Dict[str, List[str]] = files or {}
+        self.factory = factory
+        self.lexical = lexical or BM25Index()
+        # Outline/summary precomputed at ingestion (see rag_summary).
+        self.overview: dict = overview or {}
+
+    @classmethod
+    def from_documents(
+        cls, chunks: List[Document], embeddings: Embeddings, filename: str
+    ) -> "RagIndex":
+        ids = _tag_chunks(chunks, filename)
+        vectors = _embed(chunks, embeddings)
+        factory = choose_index_factory(len(chunks), vectors.shape[1])
+
+        vector_store = FAISS(
+            embedding_function=embeddings,
+            index=build_faiss_index(factory, vectors),
+            docstore=new_docstore(),
+            index_to_docstore_id={},
+        )
+        _add_vectors(vector_store, chunks, vectors, ids)
+        rag_index = cls(vector_store, {filename: ids}, factory)
+        rag_index._add_lexical(chunks, ids)
+        return rag_index
+
+    def retrieve(self, query: str, k: int = 4) -> Tuple[List[Document], str]:
+        """
+        Search with the cheapest path that fits the query.
+
+        Returns the documents and the path taken:
+        - "lexical": a keyword query whose identifiers and quoted phrases all
+          appear in the best BM25 hit; answered without an embedding call.
+        - "hybrid": dense and BM25 rankings merged with reciprocal rank fusion.
+        - "dense": nothing matched lexically, plain vector search.
+        """
+        return self.retrieve_many([query], k=k)[0]
+
+    def retrieve_many(self, queries: List[str], k: int = 4) -> List[Tuple[List[Document], str]]:
+        """
+        `retrieve` for several queries at once.
+
+        Queries that need a dense search are embedded together and searched
+        with a single batched FAISS call.
+        """
+        results: List[Optional[Tuple[List[Document], str]]] = [None] * len(queries)
+        lexical_hits = [self.lexical.search(query, k=max(k, 10)) for query in queries]
+
+        dense_positions = []
+        for position, (query, hits) in enumerate(zip(queries, lexical_hits)):
+            if hits and is_keyword_query(query) and self._lexical_match(query, hits[0][0]):
+                results[position] = (self._documents([doc_id for doc_id, _ in hits[:k]]), "lexical")
+            else:
+                dense_positions.append(position)
+
+        if dense_positions:
+            vectors = self._embed_queries([queries[position] for position in dense_positions])
+            dense_results = self._dense_search(vectors, k=2 * k)
+            for position, dense in zip(dense_positions, dense_results):
+                hits = lexical_hits[position]
+                if not hits:
+                    results[position] = (dense[:k], "dense")
+                    continue
+                fused = reciprocal_rank_fusion(
+                    [[doc.id for doc in dense], [doc_id for doc_id, _ in hits]]
+                )
+                by_id = {doc.id: doc for doc in dense}
+                docs = [by_id.get(doc_id) or self._documents([doc_id])[0] for doc_id in fused[:k]]
+                results[position] = (docs, "hybrid")
+
+        return results
+
+    def estimate_bytes(self) -> int:
+        return estimate_index_bytes(self.vector_store) + self.lexical.estimate_bytes()
+
+    def save_local(self, folder_path: str) -> None:
+        self.vector_store.save_local(folder_path)
+        with open(os.path.join(folder_path, _META_NAME), "w", encoding="utf-8") as f:
+            json.dump({"files": self.files, "factory": self.factory, "overview": self.overview}, f)
+        with open(os.path.join(folder_path, _LEXICAL_NAME), "w", encoding="utf-8") as f:
+            json.dump(self.lexical.to_dict(), f)
+        if isinstance(self.vector_store.docstore, SqliteDocstore):
+            self.vector_store.docstore.save(os.path.join(folder_path, _DOCSTORE_NAME))
+
+    @classmethod
+    def load_local(
+        cls, folder_path: str, embeddings: Embeddings, read_only: bool = False
+    ) -> "RagIndex":
+        """
+        Load an index written by `save_local`.
+
+        With `read_only` the FAISS data and the chunk database are memory-mapped
+        / opened in place instead of copied, so processes opening the same
+        folder share one copy through the OS page cache. The folder must then
+        stay unchanged, and the index must not be modified.
+        """
+        with open(os.path.join(folder_path, _META_NAME), encoding="utf-8") as f:
+            meta = json.load(f)
+        io_flags = mmap_io_flags(meta["factory"]) if read_only else 0
+        vector_store = FAISS.load_local(
+            folder_path, embeddings, allow_dangerous_deserialization=True, io_flags=io_flags
+        )
+        apply_search_params(vector_store.index)
+        docstore_path = os.path.join(folder_path, _DOCSTORE_NAME)
+        if os.path.exists(docstore_path):
+            if read_only:
+                vector_store.docstore = SqliteDocstore.open_read_only(docstore_path)
+            else:
+                vector_store.docstore = SqliteDocstore.load(docstore_path, DOCSTORE_DIR)
+        with open(os.path.join(folder_path, _LEXICAL_NAME), encoding="utf-8") as f:
+            lexical = BM25Index.from_dict(json.load(f))
+        return cls(vector_store, meta["files"], meta["factory"], lexical, meta.get("overview"))
+
+    # -------------------
+    # Internals
+    # -------------------
+    def _add_lexical(self, chunks: List[Document], ids: List[str]) -> None:
+        for chunk, doc_id in zip(chunks, ids):
+            self.lexical.add(doc_id, chunk.page_content)
+
+    def _documents(self, doc_ids: List[str]) -> List[Document]:
+        docstore = self.vector_store.docstore
+        if hasattr(docstore, "mget"):
+            return docstore.mget(doc_ids)
+        return [docstore.search(doc_id) for doc_id in doc_ids]
+
+    def _lexical_match(self, query: str, doc_id: str) -> bool:
+        """True if `doc_id` contains every identifier and quoted phrase of `query`."""
+        text = self._documents([doc_id])[0].page_content.lower()
+        phrases = re.findall(r'"([^"]+)"', query.lower())
+        return self.lexical.contains_all(doc_id, query_identifiers(query)) and all(
+            phrase in text for phrase in phrases
+        )
+
+    def _embed_queries(self, queries: List[str]) -> np.ndarray:
+        embedder = self.vector_store.embedding_function
+        if hasattr(embedder, "embed_queries"):
+            vectors = embedder.embed_queries(queries)
+        else:
+            vectors = [embedder.embed_query(query) for query in queries]
+        return np.asarray(vectors, dtype=np.float32)
+
+    def _dense_search(self, vectors: np.ndarray, k: int) -> List[List[Document]]:
+        """One FAISS search for a batch of query vectors."""
+        store = self.vector_store
+        _, rows = store.index.search(vectors, min(store.index.ntotal, k))
+        # Fetch the hits of every query at once.
+        hit_ids = [[store.index_to_docstore_id[row] for row in row_ids if row != -1] for row_ids in rows]
+
+        docs = iter(self._documents([doc_id for doc_ids in hit_ids for doc_id in doc_ids]))
+        return [[next(docs) for _ in doc_ids] for doc_ids in hit_ids]
+
+def retrieve_across(
+    indexes: List[Tuple[str, RagIndex]], queries: List[str], k: int = 4
+) -> List[Tuple[List[Document], str]]:
+    """
+    Run `queries` against several document indexes and merge the results.
+
+    `indexes` pairs each index with the filename its results are labelled with
+    (`source_file` metadata); indexes are shared between threads, so the label
+    belongs to the caller. When any document answers a query on the lexical
+    path, only lexical answers are kept for it, since an exact identifier match
+    beats nearest neighbours. Rankings from several documents are merged with
+    reciprocal rank fusion.
+    """
+    per_index = [(name, rag_index.retrieve_many(queries, k=k)) for name, rag_index in indexes]
+
+    merged = []
+    for position in range(len(queries)):
+        answers = [(name, results[position]) for name, results in per_index]
+        lexical = [(name, answer) for name, answer in answers if answer[1] == "lexical"]
+        if lexical:
+            answers = lexical
+        if not answers:
+            merged.append(([], "dense"))
+            continue
+
+        by_id: Dict[str, Document] = {}
+        rankings = []
+        for name, (docs, _) in answers:
+            for doc in docs:
+                by_id[doc.id] = Document(
+                    id=doc.id,
+                    page_content=doc.page_content,
+                    metadata={**doc.metadata, "source_file": name},
+                )
+            rankings.append([doc.id for doc in docs])
+
+        paths = {path for _, (_, path) in answers}
+        path = paths.pop() if len(paths) == 1 else "hybrid"
+        ranked = rankings[0] if len(rankings) == 1 else reciprocal_rank_fusion(rankings)
+        merged.append(([by_id[doc_id] for doc_id in ranked[:k]], path))
+    return merged
+
+
+def _embed(chunks: List[Document], embeddings: Embeddings) -> np.ndarray:
+    vectors = embeddings.embed_documents([chunk.page_content for chunk in chunks])
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def _add_vectors(
+    vector_store: FAISS, chunks: List[Document], vectors: np.ndarray, ids: List[str]
+) -> None:
+    vector_store.add_embeddings(
+        zip([chunk.page_content for chunk in chunks], vectors.tolist()),
+        metadatas=[chunk.metadata for chunk in chunks],
+        ids=ids,
+    )
+
+
+def _tag_chunks(chunks: List[Document], filename: str) -> List[str]:
+    """Stamp each chunk with its source file and return fresh docstore ids."""
+    for chunk in chunks:
+        chunk.metadata["source_file"] = filename
+    return [str(uuid.uuid4()) for _ in chunks]
@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import math
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+
+# Words plus identifiers that keep their inner punctuation ("A-123", "4.2.1",
+# "ISO_9001"), so part and clause numbers survive tokenization intact.
+_TOKEN_RE = re.compile(r"[A-Za-z0-9]+(?:[-_./:][A-Za-z0-9]+)*")
+_PART_RE = re.compile(r"[A-Za-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased terms; compound identifiers are emitted whole and split."""
+    terms: List[str] = []
+    for token in _TOKEN_RE.findall(text):
+        token = token.lower()
+        terms.append(token)
+        parts = _PART_RE.findall(token)
+        if len(parts) > 1:
+            terms.extend(parts)
+    return terms
+
+
+def is_identifier(token: str) -> bool:
+    """Part numbers, clause numbers, codes: anything mixing digits or punctuation, or ALL CAPS."""
+    return (
+        any(ch.isdigit() for ch in token)
+        or bool(re.search(r"[-_./:]", token))
+        or (len(token) > 1 and token.isupper())
+    )
+
+
+def query_identifiers(query: str) -> List[str]:
+    return [token.lower() for token in _TOKEN_RE.findall(query) if is_identifier(token)]
+
+
+def is_keyword_query(query: str) -> bool:
+    """
+    True for queries dense retrieval handles poorly and BM25 handles well:
+    quoted phrases, or short queries built around identifiers.
+    """
+    if '"' in query:
+        return True
+    tokens = _TOKEN_RE.findall(query)
+    identifiers = [token for token in tokens if is_identifier(token)]
+    if not identifiers:
+        return False
+    return len(tokens) <= 6 or len(identifiers) / len(tokens) >= 0.3
+
+
+class BM25Index:
+    """Okapi BM25 over chunk ids, kept next to the FAISS index of a `RagIndex`."""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.doc_lengths: Dict[str, int] = {}
+        self.total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def add(self, doc_id: str, text: str) -> None:
+        terms = Counter(tokenize(text))
+        for term, count in terms.items():
+            self.postings.setdefault(term, {})[doc_id] = count
+        length = sum(terms.values())
+        self.doc_lengths[doc_id] = length
+        self.total_length += length
+
+    def search(self, query: str, k: int = 4) -> List[Tuple[str, float]]:
+        """Top-k (doc_id, score) pairs."""
+        num_docs = len(self.doc_lengths)
+        if not num_docs:
+            return []
+        avg_length = self.total_length / num_docs
+
+        scores: Dict[str, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (num_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    def contains_all(self, doc_id: str, terms: Iterable[str]) -> bool:
+        return all(doc_id in self.postings.get(term, {}) for term in terms)
+
+    def estimate_bytes(self) -> int:
+        # ~100 bytes per posting entry (dict slot, id reference, int) plus
+        # per-document bookkeeping.
+        entries = sum(len(postings) for postings in self.postings.values())
+        return entries * 100 + len(self.doc_lengths) * 200
+
+    def to_dict(self) -> dict:
+        return {
+            "k1": self.k1,
+            "b": self.b,
+            "postings": self.postings,
+            "doc_lengths": self.doc_lengths,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BM25Index":
+        index = cls(k1=data["k1"], b=data["b"])
+        index.postings = data["postings"]
+        index.doc_lengths = data["doc_lengths"]
+        index.total_length = sum(index.doc_lengths.values())
+        return index
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[str]:
+    """Merge several ranked id lists; ids ranked high in any list come first."""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import re
+import warnings
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple, Union
+
+import tiktoken
+from langchain_core.documents import Document
+
+from rag_lexical import tokenize
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+|\n{2,}")
+_CHARS_PER_TOKEN = 4  # rough average for English text with OpenAI tokenizers
+
+
+class _CharEstimate:
+    """tiktoken's encode/decode on fixed-size character pieces, ~len/4 tokens."""
+
+    def encode(self, text: str) -> List[str]:
+        return [text[i : i + _CHARS_PER_TOKEN] for i in range(0, len(text), _CHARS_PER_TOKEN)]
+
+    def decode(self, tokens: List[str]) -> str:
+        return "".join(tokens)
+
+
+@lru_cache(maxsize=1)
+def _encoding() -> Union[tiktoken.Encoding, _CharEstimate]:
+    # Loaded on first use: tiktoken downloads the BPE file unless it is cached
+    # (TIKTOKEN_CACHE_DIR). Offline, counts fall back to an estimate.
+    try:
+        return tiktoken.get_encoding("o200k_base")  # gpt-4o family
+    except Exception as e:
+        warnings.warn(f"tiktoken encoding unavailable ({type(e).__name__}); estimating tokens from length")
+        return _CharEstimate()
+
+
+def count_tokens(text: str) -> int:
+    return len(_encoding().encode(text))
+
+
+def pack_context(
+    query: str,
+    docs: List[Document],
+    k: int = 4,
+    token_budget: int = 1500,
+    compress: bool = False,
+    mmr_lambda: float = 0.7,
+) -> Tuple[List[dict], dict]:
+    """
+    Turn ranked `docs` (best first, usually more than `k`) into passages.
+
+    Chunks are split with an overlap, so neighbouring hits repeat text. This
+    picks a diverse subset (MMR), merges chunks that overlap or touch on the
+    same page, optionally keeps only the sentences most relevant to the query
+    and trims the result to `token_budget` tokens.
+
+    Returns the passages ({"content", "source_file", "page"}) and stats with the
+    token count of the top-`k` chunks as retrieved ("tokens_before") and of the
+    packed passages ("tokens_after").
+    """
+    tokens_before = sum(count_tokens(doc.page_content) for doc in docs[:k])
+
+    selected = _mmr(docs, k, mmr_lambda)
+    passages = _merge_adjacent(selected)
+    if compress:
+        passages = [
+            {**passage, "content": _compress(query, passage["content"])} for passage in passages
+        ]
+    passages = _fit_budget(passages, token_budget)
+
+    tokens_after = sum(count_tokens(passage["content"]) for passage in passages)
+    return passages, {
+        "chunks_retrieved": len(docs),
+        "passages": len(passages),
+        "tokens_before": tokens_before,
+        "tokens_after": tokens_after,
+    }
+
+
+def _mmr(docs: List[Document], k: int, mmr_lambda: float) -> List[Document]:
+    """Maximal marginal relevance with rank as relevance and term overlap as redundancy."""
+    terms = [set(tokenize(doc.page_content)) for doc in docs]
+    relevance = [1.0 / (rank + 1) for rank in range(len(docs))]
+
+    chosen: List[int] = []
+    remaining = list(range(len(docs)))
+    while remaining and len(chosen) < k:
+        def score(i: int) -> float:
+            redundancy = max((_jaccard(terms[i], terms[j]) for j in chosen), default=0.0)
+            return mmr_lambda * relevance[i] - (1 - mmr_lambda) * redundancy
+
+        best = max(remaining, key=score)
+        chosen.append(best)
+        remaining.remove(best)
+    return [docs[i] for i in chosen]
+
+
+def _jaccard(a: set, b: set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _merge_adjacent(docs: List[Document]) -> List[dict]:
+    """
+    Merge chunks of the same page whose character ranges overlap or touch.
+
+    Passages keep the rank of their best chunk. Chunks without a
+    `start_index` (indexed before it was recorded) are passed through.
+    """
+    passages: List[dict] = []
+    spans: Dict[Tuple[Optional[str], Optional[int]], List[dict]] = {}
+    for doc in docs:
+        meta = doc.metadata
+        passage = {
+            "content": doc.page_content,
+            "source_file": meta.get("source_file"),
+            "page": meta.get("page_label", meta.get("page")),
+        }
+        start = meta.get("start_index")
+        if start is None:
+            passages.append(passage)
+            continue
+
+        passage["_start"] = start
+        passage["_end"] = start + len(doc.page_content)
+        for other in spans.setdefault((passage["source_file"], meta.get("page")), []):
+            if passage["_start"] <= other["_end"] and other["_start"] <= passage["_end"]:
+                _absorb(other, passage)
+                break
+        else:
+            spans[(passage["source_file"], meta.get("page"))].append(passage)
+            passages.append(passage)
+
+    for passage in passages:
+        passage.pop("_start", None)
+        passage.pop("_end", None)
+    return passages
+
+
+def _absorb(target: dict, other: dict) -> None:
+    """Extend `target` with the part of `other` it does not already contain."""
+    if other["_start"] < target["_start"]:
+        first, second = other, target
+    else:
+        first, second = target, other
+    overlap = first["_end"] - second["_start"]
+    content = first["content"] + second["content"][max(0, overlap):]
+    target["content"] = content
+    target["_start"] = first["_start"]
+    target["_end"] = max(first["_end"], second["_end"])
+
+
+def _compress(query: str, text: str, keep_ratio: float = 0.5) -> str:
+    """Keep the sentences sharing the most terms with the query, in original order."""
+    sentences = [s for s in _SENTENCE_RE.split(text) if s.strip()]
+    if len(sentences) <= 2:
+        return text
+    query_terms = set(tokenize(query))
+    scored = sorted(
+        range(len(sentences)),
+        key=lambda i: len(query_terms & set(tokenize(sentences[i]))),
+        reverse=True,
+    )
+    keep = set(scored[: max(1, int(len(sentences) * keep_ratio))])
+    return " ".join(sentences[i].strip() for i in sorted(keep))
+
+
+def _fit_budget(passages: List[dict], token_budget: int) -> List[dict]:
+    """Keep passages in rank order until the budget is spent; cut the last one short."""
+    fitted = []
+    remaining = token_budget
+    for passage in passages:
+        tokens = _encoding().encode(passage["content"])
+        if len(tokens) <= remaining:
+            fitted.append(passage)
+            remaining -= len(tokens)
+            continue
+        if remaining > 0:
+            fitted.append({**passage, "content": _encoding().decode(tokens[:remaining])})
+        break
+    return fitted
@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import atexit
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+import faiss
+
+# Rough per-chunk cost of a langchain `Document` in the in-memory docstore
+# (object header, metadata dict, docstore id string and index mapping).
+_DOC_OVERHEAD_BYTES = 1000
+# Chunks held outside Python (SqliteDocstore) only cost their entry in the
+# FAISS row -> docstore id mapping.
+_ID_MAP_BYTES = 150
+
+
+def _faiss_bytes_per_vector(index: faiss.Index) -> int:
+    index = faiss.downcast_index(index)
+    if hasattr(index, "hnsw"):
+        # HNSW keeps a level-0 neighbour list of int32 ids next to each code.
+        return _faiss_bytes_per_vector(index.storage) + index.hnsw.nb_neighbors(0) * 4
+    try:
+        bytes_per_vector = index.sa_code_size()
+    except RuntimeError:
+        # Index types without a standalone codec: assume float32 vectors.
+        bytes_per_vector = index.d * 4
+    if faiss.try_extract_index_ivf(index) is not None:
+        # Inverted lists store an int64 id per vector.
+        bytes_per_vector += 8
+    return bytes_per_vector
+
+
+def estimate_index_bytes(store: Any) -> int:
+    """Estimate the resident size of a FAISS vector store in bytes."""
+    index = store.index
+    total = index.ntotal * _faiss_bytes_per_vector(index)
+
+    docs = getattr(store.docstore, "_dict", None)
+    if docs is None:
+        return total + len(store.index_to_docstore_id) * _ID_MAP_BYTES
+    for doc in docs.values():
+        total += len(doc.page_content.encode("utf-8")) + _DOC_OVERHEAD_BYTES
+    return total
+
+
+class RetrieverRegistry:
+    """
+    Keeps document indexes in memory up to a byte budget.
+
+    Keys are the documents' content hashes, so an index is shared by every
+    thread that uploaded the same PDF.
+
+    When the budget is exceeded the least recently used store is written to
+    `spill_dir` and dropped from memory. The next `get` for that key loads it
+    back with `loader`. A store larger than the whole budget stays resident on
+    its own rather than being evicted as soon as it is added.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[str], Any],
+        budget_bytes: int,
+        spill_dir: str,
+        sizer: Callable[[Any], int] = estimate_index_bytes,
+    ):
+        self._loader = loader
+        self._sizer = sizer
+        self.budget_bytes = budget_bytes
+
+        os.makedirs(spill_dir, exist_ok=True)
+        # One private directory per registry so a restarted process never
+        # picks up spill files it does not own.
+        self._spill_dir = tempfile.mkdtemp(prefix="spill_", dir=spill_dir)
+        atexit.register(shutil.rmtree, self._spill_dir, True)
+
+        self._lock = threading.RLock()
+        self._resident: "OrderedDict[str, Any]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._spilled: Dict[str, str] = {}
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._reloads = 0
+        self._reload_seconds_total = 0.0
+        self._reload_seconds_max = 0.0
+        self._last_reload_seconds = 0.0
+
+    def __contains__(self, key: object) -> bool:
+        with self._lock:
+            return key in self._resident or key in self._spilled
+
+    def put(self, key: str, store: Any) -> None:
+        """Add or replace the store for `key` and re-measure its footprint."""
+        with self._lock:
+            self._drop_spilled(key)
+            self._resident[key] = store
+            self._resident.move_to_end(key)
+            self._sizes[key] = self._sizer(store)
+            self._evict_over_budget(keep=key)
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the store for `key`, reloading it from disk if it was evicted."""
+        with self._lock:
+            if key in self._resident:
+                self._hits += 1
+                self._resident.move_to_end(key)
+                return self._resident[key]
+
+            path = self._spilled.get(key)
+            if path is None:
+                return None
+
+            self._misses += 1
+            start = time.perf_counter()
+            store = self._loader(path)
+            elapsed = time.perf_counter() - start
+
+            self._reloads += 1
+            self._reload_seconds_total += elapsed
+            self._reload_seconds_max = max(self._reload_seconds_max, elapsed)
+            self._last_reload_seconds = elapsed
+
+            self.put(key, store)
+            return store
+
+    def discard(self, key: str) -> None:
+        """Forget `key` entirely, both in memory and on disk."""
+        with self._lock:
+            self._resident.pop(key, None)
+            self._sizes.pop(key, None)
+            self._drop_spilled(key)
+
+    def resident_bytes(self) -> int:
+        with self._lock:
+            return sum(self._sizes.values())
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return {
+                "budget_bytes": self.budget_bytes,
+                "resident_bytes": sum(self._sizes.values()),
+                "resident_indexes": len(self._resident),
+                "spilled_indexes": len(self._spilled),
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "reloads": self._reloads,
+                "reload_seconds_total": self._reload_seconds_total,
+                "reload_seconds_max": self._reload_seconds_max,
+                "last_reload_seconds": self._last_reload_seconds,
+            }
+
+    # -------------------
+    # Internals
+    # -------------------
+    def _evict_over_budget(self, keep: str) -> None:
+        while sum(self._sizes.values()) > self.budget_bytes:
+            victim = next((k for k in self._resident if k != keep), None)
+            if victim is None:
+                return
+            self._spill(victim)
+
+    def _spill(self, key: str) -> None:
+        store = self._resident.pop(key)
+        self._sizes.pop(key, None)
+        path = os.path.join(
+            self._spill_dir, hashlib.sha1(key.encode("utf-8")).hexdigest()
+        )
+        store.save_local(path)
+        self._spilled[key] = path
+        self._evictions += 1
+
+    def _drop_spilled(self, key: str) -> None:
+        path = self._spilled.pop(key, None)
+        if path is not None:
+            shutil.rmtree(path, ignore_errors=True)
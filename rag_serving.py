@@ -0,0 +1,195 @@
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import uuid
+from typing import Dict, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from profiling import memory_snapshot
+from rag_index import RagIndex
+
+_MANIFEST_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    content_hash TEXT PRIMARY KEY,
+    documents INTEGER NOT NULL,
+    chunks INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS thread_files (
+    thread_id TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    uploaded_at REAL NOT NULL DEFAULT (julianday('now')),
+    PRIMARY KEY (thread_id, filename)
+);
+CREATE INDEX IF NOT EXISTS thread_files_by_hash ON thread_files (content_hash);
+"""
+_OVERVIEW_NAME = "overview.json"
+
+
+class SharedIndexStore:
+    """
+    Document indexes and the thread -> document manifest shared by several
+    server processes through one directory.
+
+    Layout under `root`:
+
+        indexes/<content_hash>/   a `RagIndex.save_local` folder, never modified
+        manifest.db               documents and thread_files tables (SQLite)
+
+    An index is written to a temporary folder and renamed into place, so a
+    worker sees either nothing or the complete index; if two workers build
+    the same PDF, the first rename wins. Workers open indexes with
+    `RagIndex.load_local(read_only=True)`: FAISS data and chunk text are
+    memory-mapped and the OS page cache holds one copy for all of them (the
+    BM25 postings and HNSW graph links are still read into each process).
+
+    Unreferenced indexes are not deleted while serving, since another worker
+    may be attaching the same PDF at that moment; `prune_unreferenced` removes
+    them during maintenance.
+    """
+
+    def __init__(self, root: str, embeddings: Embeddings):
+        self.root = root
+        self.embeddings = embeddings
+        self._indexes_dir = os.path.join(root, "indexes")
+        os.makedirs(self._indexes_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._opened: Dict[str, RagIndex] = {}
+        self._conn = sqlite3.connect(
+            os.path.join(root, "manifest.db"), timeout=30, check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_MANIFEST_SCHEMA)
+
+    def _path(self, content_hash: str) -> str:
+        return os.path.join(self._indexes_dir, content_hash)
+
+    # -------------------
+    # Indexes
+    # -------------------
+    def is_published(self, content_hash: str) -> bool:
+        return os.path.isdir(self._path(content_hash))
+
+    def publish(self, content_hash: str, rag_index: RagIndex, stats: dict) -> bool:
+        """Atomically publish a finished index; False if another worker already did."""
+        # Stats go in first, so a published index always has them.
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO documents VALUES (?, ?, ?)",
+                (content_hash, stats["documents"], stats["chunks"]),
+            )
+
+        staging = os.path.join(self._indexes_dir, f".tmp-{uuid.uuid4().hex}")
+        rag_index.save_local(staging)
+        try:
+            os.rename(staging, self._path(content_hash))
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)
+            return False
+        return True
+
+    def open(self, content_hash: str) -> Optional[RagIndex]:
+        """The published index, memory-mapped on first use in this process."""
+        with self._lock:
+            rag_index = self._opened.get(content_hash)
+            if rag_index is None and self.is_published(content_hash):
+                with memory_snapshot("retriever_open"):
+                    rag_index = RagIndex.load_local(
+                        self._path(content_hash), self.embeddings, read_only=True
+                    )
+                self._opened[content_hash] = rag_index
+            return rag_index
+
+    def document_stats(self, content_hash: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT documents, chunks FROM documents WHERE content_hash = ?", (content_hash,)
+            ).fetchone()
+        return {"documents": row[0], "chunks": row[1]} if row else None
+
+    def write_overview(self, content_hash: str, overview: dict) -> None:
+        """Replace the document's overview next to its (otherwise immutable) index."""
+        path = os.path.join(self._path(content_hash), _OVERVIEW_NAME)
+        staging = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(staging, "w", encoding="utf-8") as f:
+            json.dump(overview, f)
+        os.replace(staging, path)
+
+    def read_overview(self, content_hash: str) -> dict:
+        try:
+            with open(os.path.join(self._path(content_hash), _OVERVIEW_NAME), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            rag_index = self.open(content_hash)
+            return rag_index.overview if rag_index is not None else {}
+
+    def prune_unreferenced(self) -> int:
+        """Delete published indexes no thread references. Run while no worker ingests."""
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT content_hash FROM documents WHERE content_hash NOT IN "
+                "(SELECT content_hash FROM thread_files)"
+            ).fetchall()
+            self._conn.executemany("DELETE FROM documents WHERE content_hash = ?", rows)
+        for (content_hash,) in rows:
+            with self._lock:
+                self._opened.pop(content_hash, None)
+            shutil.rmtree(self._path(content_hash), ignore_errors=True)
+        return len(rows)
+
+    # -------------------
+    # Manifest
+    # -------------------
+    def thread_files(self, thread_id: str) -> Dict[str, dict]:
+        """filename -> {"filename", "documents", "chunks", "content_hash"}, oldest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT f.filename, d.documents, d.chunks, f.content_hash "
+                "FROM thread_files f JOIN documents d USING (content_hash) "
+                "WHERE f.thread_id = ? ORDER BY f.uploaded_at",
+                (thread_id,),
+            ).fetchall()
+        return {
+            filename: {
+                "filename": filename,
+                "documents": documents,
+                "chunks": chunks,
+                "content_hash": content_hash,
+            }
+            for filename, documents, chunks, content_hash in rows
+        }
+
+    def attach(self, thread_id: str, filename: str, content_hash: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO thread_files (thread_id, filename, content_hash) "
+                "VALUES (?, ?, ?)",
+                (thread_id, filename, content_hash),
+            )
+
+    def detach(self, thread_id: str, filename: str) -> bool:
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "DELETE FROM thread_files WHERE thread_id = ? AND filename = ?",
+                (thread_id, filename),
+            )
+        return cursor.rowcount > 0
+
+    def metrics(self) -> dict:
+        with self._lock:
+            documents, references = self._conn.execute(
+                "SELECT (SELECT COUNT(*) FROM documents), (SELECT COUNT(*) FROM thread_files)"
+            ).fetchone()
+            opened = len(self._opened)
+        return {
+            "documents": documents,
+            "references": references,
+            "copies_avoided": max(0, references - documents),
+            "opened_in_process": opened,
+        }
@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import io
+from typing import Any, Callable, List, Optional
+
+from langchain_core.documents import Document
+from langchain_core.language_models import BaseChatModel
+from langchain_core.runnables import Runnable, RunnableLambda
+from pydantic import BaseModel, Field
+from pypdf import PdfReader
+
+
+class _ExcerptSummary(BaseModel):
+    summary: str = Field(description="A 3-5 sentence summary of the excerpt.")
+    headings: List[str] = Field(
+        description="Section or chapter headings that appear in the excerpt, in order."
+    )
+
+
+class _CombinedSummary(BaseModel):
+    summary: str = Field(description="A single summary covering all the partial summaries.")
+
+
+def extract_outline(file_bytes: bytes) -> List[dict]:
+    """The PDF's own bookmarks as [{"title", "page", "level"}]; empty if it has none."""
+    reader = PdfReader(io.BytesIO(file_bytes))
+    entries: List[dict] = []
+
+    def walk(items, level):
+        for item in items:
+            # pypdf nests an entry's children as a list right after it.
+            if isinstance(item, list):
+                walk(item, level + 1)
+                continue
+            try:
+                page = reader.get_destination_page_number(item) + 1
+            except Exception:
+                page = None
+            entries.append({"title": item.title, "page": page, "level": level})
+
+    try:
+        walk(reader.outline, 1)
+    except Exception:
+        return []
+    return entries
+
+
+def _gated(runnable: Runnable, gate_call: Optional[Callable[..., Any]]) -> Runnable:
+    """`runnable` with each call made through `gate_call`, e.g. PROVIDER_GATE.call."""
+    if gate_call is None:
+        return runnable
+    return RunnableLambda(lambda value, config: gate_call(runnable.invoke, value, config=config))
+
+
+def build_overview(
+    chunks: List[Document],
+    llm: BaseChatModel,
+    outline: List[dict],
+    batch_size: int = 8,
+    max_concurrency: int = 4,
+    gate_call: Optional[Callable[..., Any]] = None,
+) -> dict:
+    """
+    Map-reduce summary of a whole document.
+
+    Each batch of `batch_size` chunks is summarized (map), then the partial
+    summaries are combined `batch_size` at a time until one remains (reduce).
+    Headings found during the map step stand in for `outline` when the PDF has
+    no bookmarks. Every model call goes through `gate_call` when given.
+    """
+    config = {"max_concurrency": max_concurrency, "run_name": "document_overview"}
+    batches = [chunks[i : i + batch_size] for i in range(0, len(chunks), batch_size)]
+
+    mapper = _gated(llm.with_structured_output(_ExcerptSummary), gate_call)
+    mapped = mapper.batch(
+        [
+            "Summarize this excerpt of a document and list the headings it contains.\n\n"
+            + "\n\n".join(chunk.page_content for chunk in batch)
+            for batch in batches
+        ],
+        config=config,
+    )
+
+    sections = []
+    derived_outline = []
+    for batch, excerpt in zip(batches, mapped):
+        pages = [chunk.metadata.get("page", 0) + 1 for chunk in batch]
+        sections.append({"pages": f"{min(pages)}-{max(pages)}", "summary": excerpt.summary})
+        for heading in excerpt.headings:
+            if heading not in (entry["title"] for entry in derived_outline):
+                derived_outline.append({"title": heading, "page": min(pages), "level": 1})
+
+    reducer = _gated(llm.with_structured_output(_CombinedSummary), gate_call)
+    summaries = [section["summary"] for section in sections]
+    while len(summaries) > 1:
+        groups = [summaries[i : i + batch_size] for i in range(0, len(summaries), batch_size)]
+        combined = reducer.batch(
+            [
+                "Combine these consecutive partial summaries of one document into a "
+                "single summary.\n\n" + "\n\n".join(group)
+                for group in groups
+            ],
+            config=config,
+        )
+        summaries = [result.summary for result in combined]
+
+    return {
+        "summary": summaries[0] if summaries else "",
+        "outline": outline or derived_outline,
+        "sections": sections,
+    }
@@ -0,0 +1,93 @@
+"""
+Split a checkpoint database into shards, or move threads when the shard
+count changes (see checkpoint_shards.py):
+
+    python shard_checkpoints.py split chatbot.db --shards 4
+    python shard_checkpoints.py rebalance chatbot.db --shards 6
+    python shard_checkpoints.py status chatbot.db --shards 6
+
+`split` copies every thread of chatbot.db to chatbot.shard0.db ...; the
+original file is left as it is, as a backup. `rebalance` moves the threads
+whose shard changes (about 1/N of them when adding one) and removes the
+shard files no longer used once they are empty. Then start the app with
+CHECKPOINT_SHARDS set to the new count.
+
+Stop the app first. Both commands copy rows without deserializing them and
+are safe to rerun after an interruption.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+
+from checkpoint_shards import (
+    copy_threads,
+    database_threads,
+    existing_shards,
+    plan_moves,
+    shard_counts,
+    shard_name,
+    shard_path,
+    split_plan,
+)
+
+BATCH_SIZE = 200  # threads per transaction
+
+
+def _batches(items, size):
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+def split(path, shards):
+    if not os.path.exists(path):
+        raise SystemExit(f"{path} does not exist")
+    for name, thread_ids in sorted(split_plan(path, shards).items()):
+        target = shard_path(path, name)
+        copied = sum(
+            copy_threads(path, target, batch, delete=False) for batch in _batches(thread_ids, BATCH_SIZE)
+        )
+        print(f"{target}: {len(thread_ids)} threads, {copied} checkpoints")
+
+
+def rebalance(path, shards):
+    moves = plan_moves(path, shards)
+    if not moves:
+        print("nothing to move")
+    for (source, target), thread_ids in sorted(moves.items()):
+        copied = sum(
+            copy_threads(shard_path(path, source), shard_path(path, target), batch, delete=True)
+            for batch in _batches(thread_ids, BATCH_SIZE)
+        )
+        print(f"{source} -> {target}: {len(thread_ids)} threads, {copied} checkpoints")
+    kept = {shard_name(index) for index in range(shards)}
+    for name, file_path in existing_shards(path).items():
+        if name not in kept and not database_threads(file_path):
+            for candidate in (file_path, f"{file_path}-wal", f"{file_path}-shm"):
+                if os.path.exists(candidate):
+                    os.remove(candidate)
+            print(f"removed {file_path}")
+
+
+def status(path, shards):
+    moves = plan_moves(path, shards)
+    leaving = {}
+    for (source, _), thread_ids in moves.items():
+        leaving[source] = leaving.get(source, 0) + len(thread_ids)
+    for name, count in shard_counts(path).items():
+        print(f"{shard_path(path, name)}: {count} threads, {leaving.get(name, 0)} to move for {shards} shards")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=("split", "rebalance", "status"))
+    parser.add_argument("database", help="the unsharded database path, e.g. chatbot.db")
+    parser.add_argument("--shards", type=int, required=True)
+    args = parser.parse_args()
+    if args.shards < 1:
+        parser.error("--shards must be at least 1")
+    {"split": split, "rebalance": rebalance, "status": status}[args.command](args.database, args.shards)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,11 @@
 import streamlit as st
 import uuid
 
-from langgraph_database_backend import chatbot,retrive_all_threads
-from langchain_core.messages import HumanMessage, AIMessage
+from admission_control import AdmissionTimeout
+from chat_service_client import ChatServiceError, make_client, queue_message
+
+# In-process graph, or chat_service.py when CHAT_SERVICE_URL is set.
+client = make_client("database")
 
 
 # ============================================================
@@ -30,10 +33,7 @@ def reset_chat():
 
 def load_conversation(thread_id):
     """Load messages from LangGraph memory"""
-    state = chatbot.get_state(
-        config={"configurable": {"thread_id": thread_id}}
-    )
-    return state.values.get("messages", [])
+    return client.history(thread_id)
 
 
 # ============================================================
@@ -41,7 +41,7 @@ def load_conversation(thread_id):
 # ============================================================
 
 if "chat_threads" not in st.session_state:
-    st.session_state["chat_threads"] = retrive_all_threads( )
+    st.session_state["chat_threads"] = client.list_threads()
 
 if "message_history" not in st.session_state:
     st.session_state["message_history"] = []
@@ -70,9 +70,9 @@ for thread_id in st.session_state["chat_threads"][::-1]:
         ui_messages = []
 
         for msg in messages:
-            role = "user" if isinstance(msg, HumanMessage) else "assistant"
+            role = "user" if msg["role"] == "user" else "assistant"
             ui_messages.append(
-                {"role": role, "content": msg.content}
+                {"role": role, "content": msg["content"]}
             )
 
         st.session_state["message_history"] = ui_messages
@@ -98,42 +98,28 @@ if user_input:
     with st.chat_message("user"):
         st.markdown(user_input)
 
-    # LangGraph config
-    config = {
-        "configurable": {"thread_id": st.session_state["thread_id"]},
-        "metadata":{
-            "thread_id":st.session_state["thread_id"]
-        },
-        "run_name":"chat_turn"
-    }
-
-    # Convert FULL UI history to LangChain messages
-    langchain_messages = []
-    for msg in st.session_state["message_history"]:
-        if msg["role"] == "user":
-            langchain_messages.append(
-                HumanMessage(content=msg["content"])
-            )
-        else:
-            langchain_messages.append(
-                AIMessage(content=msg["content"])
-            )
-
     # Stream assistant response
     with st.chat_message("assistant"):
+        queue_notice = st.empty()
         ai_chunks = []
 
+        # The checkpointer already holds the earlier turns, so only the new
+        # message is sent.
         def ai_only_stream():
-            for message_chunk, metadata in chatbot.stream(
-                {"messages": langchain_messages},
-                config=config,
-                stream_mode="messages"
-            ):
-                if isinstance(message_chunk, AIMessage):
-                    ai_chunks.append(message_chunk.content)
-                    yield message_chunk.content
-
-        st.write_stream(ai_only_stream())
+            for event in client.stream_turn(st.session_state["thread_id"], user_input):
+                if event["event"] == "queued":
+                    queue_notice.info(queue_message(event))
+                    continue
+                queue_notice.empty()
+                if event["event"] == "token":
+                    ai_chunks.append(event["content"])
+                    yield event["content"]
+
+        try:
+            st.write_stream(ai_only_stream())
+        except (AdmissionTimeout, ChatServiceError) as e:
+            queue_notice.empty()
+            st.error(str(e))
 
     # Save assistant message
     final_ai_message = "".join(ai_chunks)
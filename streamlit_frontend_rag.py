@@ -2,14 +2,13 @@
 import uuid
 
 import streamlit as st
-from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
 
-from langgraph_rag_backend import (
-    chatbot,
-    ingest_pdf,
-    retrieve_all_threads,
-    thread_document_metadata,
-)
+from admission_control import AdmissionTimeout
+from chat_service_client import ChatServiceError, make_client, queue_message
+from turn_runner import CANCELLED_NOTE
+
+# In-process graph, or chat_service.py when CHAT_SERVICE_URL is set.
+client = make_client("rag")
 
 
 # =========================== Utilities ===========================
@@ -30,8 +29,14 @@ def add_thread(thread_id):
 
 
 def load_conversation(thread_id):
-    state = chatbot.get_state(config={"configurable": {"thread_id": thread_id}})
-    return state.values.get("messages", [])
+    return client.history(str(thread_id))
+
+
+def display_history(thread_id):
+    return [
+        {"role": "user" if msg["role"] == "user" else "assistant", "content": msg["content"]}
+        for msg in load_conversation(thread_id)
+    ]
 
 
 # ======================= Session Initialization ===================
@@ -42,7 +47,7 @@ if "thread_id" not in st.session_state:
     st.session_state["thread_id"] = generate_thread_id()
 
 if "chat_threads" not in st.session_state:
-    st.session_state["chat_threads"] = retrieve_all_threads()
+    st.session_state["chat_threads"] = client.list_threads()
 
 if "ingested_docs" not in st.session_state:
     st.session_state["ingested_docs"] = {}
@@ -62,12 +67,25 @@ if st.sidebar.button("New Chat", use_container_width=True):
     reset_chat()
     st.rerun()
 
-if thread_docs:
-    latest_doc = list(thread_docs.values())[-1]
-    st.sidebar.success(
-        f"Using `{latest_doc.get('filename')}` "
-        f"({latest_doc.get('chunks')} chunks from {latest_doc.get('documents')} pages)"
-    )
+if st.sidebar.button("⏹ Stop generating", use_container_width=True):
+    client.cancel_turn(thread_key)
+    # Wait for the partial answer to be saved, then show the thread as stored.
+    for _ in client.resume_turn(thread_key):
+        pass
+    st.session_state["message_history"] = display_history(thread_key)
+
+indexed_files = client.documents(thread_key).get("files", [])
+if indexed_files:
+    st.sidebar.success(f"{len(indexed_files)} PDF(s) indexed for this chat")
+    for doc in indexed_files:
+        doc_col, remove_col = st.sidebar.columns([4, 1])
+        doc_col.caption(
+            f"`{doc.get('filename')}` "
+            f"({doc.get('chunks')} chunks from {doc.get('documents')} pages)"
+        )
+        if remove_col.button("✕", key=f"remove-doc-{thread_key}-{doc.get('filename')}"):
+            client.remove_document(thread_key, doc.get("filename"))
+            st.rerun()
 else:
     st.sidebar.info("No PDF indexed yet.")
 
@@ -78,10 +96,8 @@ if uploaded_pdf:
     else:
         try:
             with st.sidebar.status("Indexing PDF…", expanded=True) as status_box:
-                summary = ingest_pdf(
-                    uploaded_pdf.getvalue(),
-                    thread_id=thread_key,
-                    filename=uploaded_pdf.name,
+                summary = client.ingest_pdf(
+                    thread_key, uploaded_pdf.getvalue(), filename=uploaded_pdf.name
                 )
                 thread_docs[uploaded_pdf.name] = summary
                 status_box.update(label="✅ PDF indexed", state="complete", expanded=False)
@@ -89,6 +105,9 @@ if uploaded_pdf:
         except Exception as e:
             st.sidebar.error(f"❌ Error indexing PDF: {str(e)}")
 
+# Writes a CPU profile of each turn of this session (see profiling.py)
+st.sidebar.toggle("Profile turns", key="profile_turns")
+
 st.sidebar.subheader("Past conversations")
 if not threads:
     st.sidebar.write("No past conversations yet.")
@@ -105,6 +124,18 @@ for message in st.session_state["message_history"]:
     with st.chat_message(message["role"]):
         st.markdown(message["content"])
 
+# A turn that outlived an interrupted run of this script (CHAT_ON_DISCONNECT=detach):
+# follow it to the end, then show the thread as saved.
+if client.turn_status(thread_key)["status"] in ("queued", "running"):
+    with st.chat_message("assistant"):
+        st.write_stream(
+            event["content"]
+            for event in client.resume_turn(thread_key)
+            if event["event"] == "token"
+        )
+    st.session_state["message_history"] = display_history(thread_key)
+    st.rerun()
+
 user_input = st.chat_input("Ask about your document or use tools")
 
 if user_input:
@@ -112,32 +143,23 @@ if user_input:
     with st.chat_message("user"):
         st.text(user_input)
 
-    CONFIG = {
-        "configurable": {"thread_id": thread_key},
-        "metadata": {"thread_id": thread_key},
-        "run_name": "chat_turn",
-    }
-
-    # Convert full UI history to LangChain messages
-    langchain_messages = []
-    for msg in st.session_state["message_history"]:
-        if msg["role"] == "user":
-            langchain_messages.append(HumanMessage(content=msg["content"]))
-        else:
-            langchain_messages.append(AIMessage(content=msg["content"]))
-
     with st.chat_message("assistant"):
-        status_holder = {"box": None}
+        status_holder = {"box": None, "stopped": False, "profile": None}
+        queue_notice = st.empty()
         ai_chunks = []
 
+        # The checkpointer already holds the earlier turns, so only the new
+        # message is sent.
         def ai_only_stream():
-            for message_chunk, _ in chatbot.stream(
-                {"messages": langchain_messages},
-                config=CONFIG,
-                stream_mode="messages",
+            for event in client.stream_turn(
+                thread_key, user_input, profile=st.session_state["profile_turns"] or None
             ):
-                if isinstance(message_chunk, ToolMessage):
-                    tool_name = getattr(message_chunk, "name", "tool")
+                if event["event"] == "queued":
+                    queue_notice.info(queue_message(event))
+                    continue
+                queue_notice.empty()
+                if event["event"] == "tool":
+                    tool_name = event["name"]
                     if status_holder["box"] is None:
                         status_holder["box"] = st.status(
                             f"🔧 Using `{tool_name}` …", expanded=True
@@ -149,12 +171,27 @@ if user_input:
                             expanded=True,
                         )
 
-                elif isinstance(message_chunk, AIMessage):
-                    ai_chunks.append(message_chunk.content)
-                    yield message_chunk.content
+                elif event["event"] == "token":
+                    ai_chunks.append(event["content"])
+                    yield event["content"]
 
-        st.write_stream(ai_only_stream())
+                elif event["event"] == "cancelled":
+                    status_holder["stopped"] = True
+
+                elif event["event"] == "done":
+                    status_holder["profile"] = event.get("profile")
+
+        try:
+            st.write_stream(ai_only_stream())
+        except (AdmissionTimeout, ChatServiceError) as e:
+            queue_notice.empty()
+            st.error(str(e))
+        if status_holder["profile"]:
+            st.caption(f"Profile: `{status_holder['profile']}`")
         ai_message = "".join(ai_chunks) if ai_chunks else ""
+        if status_holder["stopped"]:
+            ai_message = f"{ai_message} {CANCELLED_NOTE}".strip()
+            st.caption(CANCELLED_NOTE)
 
         if status_holder["box"] is not None:
             status_holder["box"].update(
@@ -165,10 +202,10 @@ if user_input:
         {"role": "assistant", "content": ai_message}
     )
 
-    doc_meta = thread_document_metadata(thread_key)
+    doc_meta = client.documents(thread_key)
     if doc_meta:
         st.caption(
-            f"Document indexed: {doc_meta.get('filename')} "
+            f"Documents indexed: {len(doc_meta.get('files', []))} "
             f"(chunks: {doc_meta.get('chunks')}, pages: {doc_meta.get('documents')})"
         )
 
@@ -176,12 +213,6 @@ st.divider()
 
 if selected_thread:
     st.session_state["thread_id"] = selected_thread
-    messages = load_conversation(selected_thread)
-
-    temp_messages = []
-    for msg in messages:
-        role = "user" if isinstance(msg, HumanMessage) else "assistant"
-        temp_messages.append({"role": role, "content": msg.content})
-    st.session_state["message_history"] = temp_messages
+    st.session_state["message_history"] = display_history(selected_thread)
     st.session_state["ingested_docs"].setdefault(str(selected_thread), {})
     st.rerun()
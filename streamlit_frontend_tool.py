@@ -1,8 +1,12 @@
 import streamlit as st
-from langgraph_tool_backend import chatbot,retrieve_all_threads
-from langchain_core.messages import HumanMessage,AIMessage,ToolMessage
+from admission_control import AdmissionTimeout
+from chat_service_client import ChatServiceError, make_client, queue_message
+from turn_runner import CANCELLED_NOTE
 import uuid
 
+# In-process graph, or chat_service.py when CHAT_SERVICE_URL is set.
+client = make_client("tools")
+
 
 
 #------------------thread_id function-------------------
@@ -24,8 +28,14 @@ def reset_chat():
 
 
 def load_conversation(thread_id):
-    state=chatbot.get_state(config={"configurable":{"thread_id":thread_id}})
-    return state.values.get("messages",[])
+    return client.history(str(thread_id))
+
+
+def display_history(thread_id):
+    return [
+        {"role": "user" if msg["role"] == "user" else "assistant", "content": msg["content"]}
+        for msg in load_conversation(thread_id)
+    ]
 
 
 #-------------------- Session Initialization ------------------------------
@@ -35,7 +45,7 @@ if "message_history" not in st.session_state:
 if "thread_id" not in st.session_state:
     st.session_state["thread_id"]=generate_thread_id()
 if "chat_threads" not in st.session_state:
-    st.session_state["chat_threads"]=retrieve_all_threads()
+    st.session_state["chat_threads"]=client.list_threads()
 
 #-------------------- Sidebar -------------------------------------------------
 
@@ -43,17 +53,22 @@ st.sidebar.title("LangGraph Chatbot")
 if st.sidebar.button("New Chat"):
     reset_chat()
 
+if st.sidebar.button("⏹ Stop generating"):
+    thread_key = str(st.session_state["thread_id"])
+    client.cancel_turn(thread_key)
+    # Wait for the partial answer to be saved, then show the thread as stored.
+    for _ in client.resume_turn(thread_key):
+        pass
+    st.session_state["message_history"] = display_history(thread_key)
+
+# Writes a CPU profile of each turn of this session (see profiling.py)
+st.sidebar.toggle("Profile turns", key="profile_turns")
+
 st.sidebar.header("My Conversations")
 for thread_id in st.session_state["chat_threads"][::-1]:
     if st.sidebar.button(str(thread_id)):
         st.session_state["thread_id"]=thread_id
-        messages=load_conversation(thread_id)
-
-        temp_messages=[]
-        for msg in messages:
-            role="user" if isinstance(msg,HumanMessage) else"assistant"
-            temp_messages.append({"role":role,"content":msg.content})
-        st.session_state["message_history"]=temp_messages
+        st.session_state["message_history"]=display_history(thread_id)
 
 
 #------------------------- Main UI -----------------------------------------
@@ -63,32 +78,45 @@ for message in st.session_state["message_history"]:
         st.markdown(message["content"])
 
 
+# A turn that outlived an interrupted run of this script (CHAT_ON_DISCONNECT=detach):
+# follow it to the end, then show the thread as saved.
+if client.turn_status(str(st.session_state["thread_id"]))["status"] in ("queued", "running"):
+    with st.chat_message("assistant"):
+        st.write_stream(
+            event["content"]
+            for event in client.resume_turn(str(st.session_state["thread_id"]))
+            if event["event"] == "token"
+        )
+    st.session_state["message_history"] = display_history(st.session_state["thread_id"])
+    st.rerun()
+
 user_input=st.chat_input("Type here")
 
 if user_input:
     st.session_state["message_history"].append({"role":"user","content":user_input})
     with st.chat_message("user"):
         st.text(user_input)
-    CONFIG={
-        "configurable":{"thread_id":st.session_state["thread_id"]},
-        "metadata":{"thread_id":st.session_state["thread_id"]},
-        "run_name":"chat_turn"
-    }
     # Assistant streaming block
     with st.chat_message("assistant"):
         # Use a mutable holder so the generator can set/modify it
-        status_holder = {"box": None}
+        status_holder = {"box": None, "stopped": False, "profile": None}
+        queue_notice = st.empty()
         ai_chunks = []
 
         def ai_only_stream():
-            for message_chunk, metadata in chatbot.stream(
-                {"messages": [HumanMessage(content=user_input)]},
-                config=CONFIG,
-                stream_mode="messages",
+            for event in client.stream_turn(
+                str(st.session_state["thread_id"]),
+                user_input,
+                profile=st.session_state["profile_turns"] or None,
             ):
+                # Shown while the turn waits for a free slot
+                if event["event"] == "queued":
+                    queue_notice.info(queue_message(event))
+                    continue
+                queue_notice.empty()
                 # Lazily create & update the SAME status container when any tool runs
-                if isinstance(message_chunk, ToolMessage):
-                    tool_name = getattr(message_chunk, "name", "tool")
+                if event["event"] == "tool":
+                    tool_name = event["name"]
                     if status_holder["box"] is None:
                         status_holder["box"] = st.status(
                             f"🔧 Using `{tool_name}` …", expanded=True
@@ -101,12 +129,28 @@ if user_input:
                         )
 
                 # Stream ONLY assistant tokens
-                elif isinstance(message_chunk, AIMessage):
-                    ai_chunks.append(message_chunk.content)
-                    yield message_chunk.content
-
-        st.write_stream(ai_only_stream())
+                elif event["event"] == "token":
+                    ai_chunks.append(event["content"])
+                    yield event["content"]
+
+                # Stopped from the sidebar; the partial answer is kept
+                elif event["event"] == "cancelled":
+                    status_holder["stopped"] = True
+
+                elif event["event"] == "done":
+                    status_holder["profile"] = event.get("profile")
+
+        try:
+            st.write_stream(ai_only_stream())
+        except (AdmissionTimeout, ChatServiceError) as e:
+            queue_notice.empty()
+            st.error(str(e))
+        if status_holder["profile"]:
+            st.caption(f"Profile: `{status_holder['profile']}`")
         ai_message = "".join(ai_chunks)
+        if status_holder["stopped"]:
+            ai_message = f"{ai_message} {CANCELLED_NOTE}".strip()
+            st.caption(CANCELLED_NOTE)
 
         # Finalize only if a tool was actually used
         if status_holder["box"] is not None:
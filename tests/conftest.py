@@ -0,0 +1,54 @@
+"""
+Shared setup: the backends run offline, on databases in a scratch directory.
+
+The backend modules open chatbot.db etc. relative to the working directory
+when imported, so the directory is changed before any test imports them. The
+model, embeddings and network tools are load_test.py's stand-ins.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import tempfile
+from typing import Annotated, TypedDict
+
+import pytest
+from langchain_core.messages import AIMessage, BaseMessage
+from langgraph.graph import START, StateGraph
+from langgraph.graph.message import add_messages
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+os.environ.setdefault("OPENAI_API_KEY", "sk-test")  # ChatOpenAI() refuses to build without one
+os.chdir(tempfile.mkdtemp(prefix="chatbot-tests-"))
+
+
+@pytest.fixture(scope="session")
+def backends():
+    """Graph name -> backend module, for the tools and rag graphs, with stand-ins."""
+    import load_test
+
+    return load_test.install_fakes(
+        argparse.Namespace(llm_ms=1, token_ms=0, tokens=5, tool_ms=1, embed_ms=0)
+    )
+
+
+class _ChatState(TypedDict):
+    messages: Annotated[list[BaseMessage], add_messages]
+
+
+@pytest.fixture
+def echo_chatbot():
+    """Compiles a one-node graph answering every message with "ok(<message>)"."""
+
+    def build(checkpointer):
+        def chat_node(state: _ChatState):
+            return {"messages": [AIMessage(content=f"ok({state['messages'][-1].content})")]}
+
+        graph = StateGraph(_ChatState)
+        graph.add_node("chat_node", chat_node)
+        graph.add_edge(START, "chat_node")
+        return graph.compile(checkpointer=checkpointer)
+
+    return build
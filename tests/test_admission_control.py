@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import time
+
+import pytest
+
+from admission_control import ProviderGate
+
+
+class _ProviderError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = type("Response", (), {"status_code": status_code, "headers": headers or {}})()
+
+
+def _failing(*errors):
+    """A call that raises `errors` in turn, then returns "ok"; and its call count."""
+    calls = []
+
+    def call():
+        calls.append(time.monotonic())
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return "ok"
+
+    return call, calls
+
+
+def test_rate_limit_pauses_then_retries():
+    gate = ProviderGate(max_retries=3, max_backoff=1.0)
+    call, calls = _failing(_ProviderError(429, {"retry-after-ms": "200"}))
+    assert gate.call(call) == "ok"
+    assert calls[1] - calls[0] >= 0.19
+    metrics = gate.metrics()
+    assert (metrics["rate_limited"], metrics["retries"], metrics["in_flight"]) == (1, 1, 0)
+
+
+def test_transient_errors_are_retried():
+    gate = ProviderGate(max_retries=2, max_backoff=0.01)
+    call, calls = _failing(_ProviderError(503), _ProviderError(408))
+    assert gate.call(call) == "ok"
+    assert len(calls) == 3
+    assert gate.metrics()["transient_errors"] == 2
+    assert gate.metrics()["paused_seconds_total"] == 0  # other callers are not paused
+
+
+def test_other_errors_and_exhausted_retries_raise():
+    gate = ProviderGate(max_retries=1, max_backoff=0.01)
+    call, calls = _failing(_ProviderError(400))
+    with pytest.raises(_ProviderError):
+        gate.call(call)
+    assert len(calls) == 1
+
+    call, calls = _failing(_ProviderError(500), _ProviderError(500))
+    with pytest.raises(_ProviderError):
+        gate.call(call)
+    assert len(calls) == 2
+
+
+def test_backend_models_leave_retries_to_the_gate():
+    import langgraph_backend
+    import langgraph_database_backend
+
+    assert langgraph_backend.model.max_retries == 0
+    assert langgraph_database_backend.model.max_retries == 0
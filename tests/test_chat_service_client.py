@@ -0,0 +1,27 @@
+from __future__ import annotations
+
+import uuid
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+from chat_service_client import GRAPH_MODULES, LocalChatClient
+
+
+@pytest.mark.parametrize("graph", sorted(GRAPH_MODULES))
+def test_list_threads(backends, graph):
+    client = LocalChatClient(graph)
+    thread_id = f"test-{uuid.uuid4().hex[:8]}"
+    client.backend.chatbot.update_state(
+        {"configurable": {"thread_id": thread_id}},
+        {"messages": [HumanMessage(content="hi"), AIMessage(content="hello")]},
+        as_node="chat_node",
+    )
+    flush = getattr(client.backend.checkpointer, "flush", None)
+    if flush is not None:
+        flush()
+
+    threads = client.list_threads()
+    assert thread_id in threads
+    assert len(threads) == len(set(threads))
+    assert [entry["role"] for entry in client.history(thread_id)] == ["user", "assistant"]
@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import sqlite3
+
+import pytest
+
+from langchain_core.messages import HumanMessage, RemoveMessage
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+import migrate_checkpoints
+from checkpointing import MessageStoreSaver
+
+THREADS = [f"thread-{i}" for i in range(5)]
+
+
+def _config(thread_id):
+    return {"configurable": {"thread_id": thread_id}}
+
+
+def _converse(chatbot, turns=4):
+    for thread_id in THREADS:
+        for turn in range(turns):
+            chatbot.invoke({"messages": [HumanMessage(content=f"{thread_id} #{turn}")]}, _config(thread_id))
+
+
+def _every_checkpoint(saver):
+    """checkpoint_id -> message contents, for every checkpoint of every thread."""
+    return {
+        saved.config["configurable"]["checkpoint_id"]: [
+            message.content for message in saved.checkpoint["channel_values"].get("messages", [])
+        ]
+        for thread_id in THREADS
+        for saved in saver.list(_config(thread_id))
+    }
+
+
+def test_messages_stored_once(tmp_path, echo_chatbot):
+    saver = MessageStoreSaver(sqlite3.connect(str(tmp_path / "chat.db"), check_same_thread=False), durability="sync")
+    chatbot = echo_chatbot(saver)
+    _converse(chatbot)
+
+    stored = saver.conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+    assert stored == len(THREADS) * 4 * 2
+    state = chatbot.get_state(_config("thread-2"))
+    assert [m.content for m in state.values["messages"]][-2:] == ["thread-2 #3", "ok(thread-2 #3)"]
+
+    # Not append-only: removing a message leaves a gap the refs must skip.
+    first = state.values["messages"][0]
+    chatbot.update_state(_config("thread-2"), {"messages": [RemoveMessage(id=first.id)]})
+    contents = [m.content for m in chatbot.get_state(_config("thread-2")).values["messages"]]
+    assert contents[0] == "ok(thread-2 #0)" and len(contents) == 7
+
+
+def test_migrate_sqlite_saver_database(tmp_path, echo_chatbot, capsys):
+    path = str(tmp_path / "chat.db")
+    plain = SqliteSaver(sqlite3.connect(path, check_same_thread=False))
+    _converse(echo_chatbot(plain))
+    before = _every_checkpoint(plain)
+    # The first checkpoint of a thread has no messages channel yet.
+    with_messages = sum("messages" in saved.checkpoint["channel_values"] for saved in plain.list(None))
+    plain.conn.close()
+
+    migrate_checkpoints.migrate(path, batch_size=3, vacuum=True)
+    assert f"{with_messages} of {len(before)} checkpoints migrated" in capsys.readouterr().out
+    migrate_checkpoints.migrate(path, batch_size=3, vacuum=False)
+    assert f"0 of {len(before)} checkpoints migrated" in capsys.readouterr().out
+
+    saver = MessageStoreSaver(sqlite3.connect(path, check_same_thread=False), durability="sync")
+    assert _every_checkpoint(saver) == before
+    assert saver.conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0] == len(THREADS) * 4 * 2
+
+    # Migrated threads carry on where they stopped.
+    chatbot = echo_chatbot(saver)
+    chatbot.invoke({"messages": [HumanMessage(content="again")]}, _config("thread-0"))
+    contents = [m.content for m in chatbot.get_state(_config("thread-0")).values["messages"]]
+    expected = [text for turn in range(4) for text in (f"thread-0 #{turn}", f"ok(thread-0 #{turn})")]
+    assert contents == expected + ["again", "ok(again)"]
+
+
+@pytest.mark.parametrize("durability", ["sync", "async"])
+def test_two_writers_of_one_thread(tmp_path, echo_chatbot, durability):
+    path = str(tmp_path / "chat.db")
+    # Two processes: separate connections, separate sequence caches.
+    a, b = (
+        echo_chatbot(MessageStoreSaver(sqlite3.connect(path, check_same_thread=False), durability=durability))
+        for _ in range(2)
+    )
+    config = _config("t")
+    a.invoke({"messages": [HumanMessage(content="hi")]}, config)
+    a.checkpointer.flush()
+    parent = b.update_state(config, {"messages": []})  # b now caches the thread's numbers too
+    b.checkpointer.flush()
+
+    # Both append to the same state; b's cache still says the next number is free.
+    a.update_state(config, {"messages": [HumanMessage(content="from a")]})
+    a.checkpointer.flush()
+    b.update_state(parent, {"messages": [HumanMessage(content="from b")]})
+    b.checkpointer.flush()
+
+    reader = MessageStoreSaver(sqlite3.connect(path, check_same_thread=False), durability="sync", latest_cache=0)
+    latest = [saved.checkpoint["channel_values"]["messages"] for saved in reader.list(config, limit=2)]
+    assert [[m.content for m in messages] for messages in latest] == [["hi", "ok(hi)", "from b"], ["hi", "ok(hi)", "from a"]]
@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import sqlite3
+
+from langchain_core.messages import HumanMessage
+
+import shard_checkpoints
+from checkpoint_shards import HashRing, ShardedSaver, database_threads, existing_shards, shard_name
+from checkpointing import DeferredSqliteSaver
+
+
+def _chat(chatbot, thread_ids):
+    for thread_id in thread_ids:
+        chatbot.invoke({"messages": [HumanMessage(content=thread_id)]}, {"configurable": {"thread_id": thread_id}})
+    chatbot.checkpointer.flush()
+
+
+def _contents(chatbot, thread_id):
+    state = chatbot.get_state({"configurable": {"thread_id": thread_id}})
+    return [message.content for message in state.values["messages"]]
+
+
+THREADS = [f"thread-{i}" for i in range(40)]
+
+
+def test_ring_moves_only_to_the_new_shard():
+    before = HashRing([shard_name(i) for i in range(4)])
+    after = HashRing([shard_name(i) for i in range(5)])
+    ids = [f"t{i}" for i in range(2000)]
+    moved = [t for t in ids if before.owner(t) != after.owner(t)]
+    assert all(after.owner(t) == "shard4" for t in moved)
+    assert 0.1 < len(moved) / len(ids) < 0.3  # about 1/5
+    assert {before.owner(t) for t in ids} == {shard_name(i) for i in range(4)}
+
+
+def test_sharded_saver_routes_threads(tmp_path, echo_chatbot):
+    path = str(tmp_path / "chat.db")
+    saver = ShardedSaver.open(path, 3, durability="sync")
+    chatbot = echo_chatbot(saver)
+    _chat(chatbot, THREADS)
+
+    assert sorted(saver.thread_ids()) == sorted(THREADS)
+    for name, file_path in existing_shards(path).items():
+        assert all(saver.ring.owner(t) == name for t in database_threads(file_path))
+    assert _contents(chatbot, "thread-7") == ["thread-7", "ok(thread-7)"]
+    ids = [saved.config["configurable"]["checkpoint_id"] for saved in saver.list(None)]
+    assert ids == sorted(ids, reverse=True)
+    assert len({saved.config["configurable"]["thread_id"] for saved in saver.list(None)}) == len(THREADS)
+    saver.close()
+
+
+def test_split_then_rebalance(tmp_path, capsys, echo_chatbot):
+    path = str(tmp_path / "chat.db")
+    single = DeferredSqliteSaver(sqlite3.connect(path, check_same_thread=False), durability="sync")
+    _chat(echo_chatbot(single), THREADS)
+    single.close()
+
+    shard_checkpoints.split(path, 2)
+    assert sorted(database_threads(path)) == sorted(THREADS)  # kept as a backup
+    shard_checkpoints.split(path, 2)  # rerunnable
+
+    shard_checkpoints.rebalance(path, 3)
+    shard_checkpoints.rebalance(path, 3)
+    assert "nothing to move" in capsys.readouterr().out
+    ring = HashRing([shard_name(i) for i in range(3)])
+    placed = []
+    for name, file_path in existing_shards(path).items():
+        threads = database_threads(file_path)
+        assert all(ring.owner(t) == name for t in threads)
+        placed.extend(threads)
+    assert sorted(placed) == sorted(THREADS)
+
+    saver = ShardedSaver.open(path, 3, durability="sync")
+    chatbot = echo_chatbot(saver)
+    assert all(_contents(chatbot, t) == [t, f"ok({t})"] for t in THREADS)
+    saver.close()
+
+    shard_checkpoints.rebalance(path, 1)
+    assert list(existing_shards(path)) == ["shard0"]
+    assert sorted(database_threads(existing_shards(path)["shard0"])) == sorted(THREADS)
@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import sqlite3
+import time
+
+import pytest
+from langchain_core.messages import HumanMessage
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+from checkpointing import DeferredSqliteSaver
+
+CONFIG = {"configurable": {"thread_id": "t"}}
+
+
+def _saver(path, durability, flush_ms=10_000, timeout=5.0):
+    return DeferredSqliteSaver(
+        sqlite3.connect(path, timeout=timeout, check_same_thread=False), durability=durability, flush_ms=flush_ms
+    )
+
+
+def _on_disk(path):
+    """The thread's latest messages as a fresh connection reads them."""
+    saved = SqliteSaver(sqlite3.connect(path, check_same_thread=False)).get_tuple(CONFIG)
+    return [m.content for m in saved.checkpoint["channel_values"]["messages"]] if saved else None
+
+
+# -------------------
+# Durability modes
+# -------------------
+@pytest.mark.parametrize("durability", ["sync", "async", "exit"])
+def test_turn_is_durable_after_flush(tmp_path, echo_chatbot, durability):
+    path = str(tmp_path / "chat.db")
+    saver = _saver(path, durability)
+    saver.setup()
+    chatbot = echo_chatbot(saver)
+    chatbot.invoke({"messages": [HumanMessage(content="hi")]}, CONFIG, durability=saver.graph_durability)
+
+    if durability == "sync":
+        assert saver.metrics()["pending_statements"] == 0
+        assert _on_disk(path) == ["hi", "ok(hi)"]
+    else:
+        # Buffered: not on disk until the flush (the writer waits 10 s here).
+        assert saver.metrics()["pending_statements"] > 0
+        assert _on_disk(path) is None
+    saver.close()  # as at shutdown
+    assert saver.metrics()["pending_statements"] == 0
+    assert _on_disk(path) == ["hi", "ok(hi)"]
+    if durability == "exit":
+        assert len(list(saver.list(CONFIG))) == 1  # only the end of the turn
+
+
+def test_failed_commit_keeps_the_buffer(tmp_path, echo_chatbot):
+    path = str(tmp_path / "chat.db")
+    saver = _saver(path, "async", flush_ms=10, timeout=0.05)
+    saver.setup()
+    blocker = sqlite3.connect(path)
+    blocker.execute("BEGIN IMMEDIATE")  # another writer holds the lock
+
+    echo_chatbot(saver).invoke({"messages": [HumanMessage(content="hi")]}, CONFIG)
+    time.sleep(0.3)  # the background writer tries, fails and keeps the rows
+    assert saver.metrics()["pending_statements"] > 0
+    with pytest.raises(sqlite3.OperationalError, match="locked"):
+        saver.thread_ids()  # reads flush first, and report the failure
+
+    blocker.rollback()
+    saver.flush()
+    assert saver.metrics()["pending_statements"] == 0
+    assert _on_disk(path) == ["hi", "ok(hi)"]
+
+
+# -------------------
+# Latest-checkpoint cache
+# -------------------
+def test_other_connections_writes_invalidate_the_cache(tmp_path, echo_chatbot):
+    path = str(tmp_path / "chat.db")
+    first, second = (echo_chatbot(_saver(path, "sync")) for _ in range(2))
+    first.invoke({"messages": [HumanMessage(content="one")]}, CONFIG)
+    first.get_state(CONFIG)
+    stats = first.checkpointer.metrics()["latest_cache"]
+    assert stats["hits"] >= 1
+
+    # A write to another thread: the entry is checked and still current.
+    second.invoke({"messages": [HumanMessage(content="other")]}, {"configurable": {"thread_id": "u"}})
+    assert [m.content for m in first.get_state(CONFIG).values["messages"]] == ["one", "ok(one)"]
+    assert first.checkpointer.metrics()["latest_cache"]["revalidated"] == stats["revalidated"] + 1
+
+    # A new checkpoint of this thread: the entry is dropped and re-read.
+    second.invoke({"messages": [HumanMessage(content="two")]}, CONFIG)
+    messages = first.get_state(CONFIG).values["messages"]
+    assert [m.content for m in messages] == ["one", "ok(one)", "two", "ok(two)"]
+    assert first.checkpointer.metrics()["latest_cache"]["invalidated"] == stats["invalidated"] + 1
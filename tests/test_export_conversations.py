@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+import sqlite3
+
+from langchain_core.messages import HumanMessage
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+import export_conversations
+from checkpoint_shards import shard_path
+
+
+class _Collect:
+    def __init__(self):
+        self.records = []
+
+    def write(self, records):
+        self.records.extend(records)
+
+
+def _chat(echo_chatbot, path, *threads):
+    conn = sqlite3.connect(path, check_same_thread=False)
+    chatbot = echo_chatbot(SqliteSaver(conn))
+    for thread_id in threads:
+        chatbot.invoke({"messages": [HumanMessage(content=thread_id)]}, {"configurable": {"thread_id": thread_id}})
+    return conn
+
+
+def _export(*databases):
+    writer, state = _Collect(), {}
+    counts = export_conversations.export(list(databases), writer, workers=1, batch_size=10, state=state)
+    export_conversations._READERS.clear()
+    return counts, {r["thread_id"]: [m["content"] for m in r["messages"]] for r in writer.records}
+
+
+def test_exports_a_database_from_before_task_path(tmp_path, echo_chatbot):
+    path = str(tmp_path / "old.db")
+    conn = _chat(echo_chatbot, path, "a", "b")
+    conn.execute("ALTER TABLE writes DROP COLUMN task_path")
+    conn.commit()
+    conn.close()
+
+    counts, threads = _export(path)
+    assert counts == {path: 2}
+    assert threads == {"a": ["a", "ok(a)"], "b": ["b", "ok(b)"]}
+
+
+def test_skips_shard_files_without_tables(tmp_path, echo_chatbot):
+    path = str(tmp_path / "chatbot.db")
+    _chat(echo_chatbot, shard_path(path, "shard0"), "a").close()
+    sqlite3.connect(shard_path(path, "shard1")).close()  # created, never written
+
+    counts, threads = _export(path)
+    assert sorted(counts.values()) == [0, 1]
+    assert threads == {"a": ["a", "ok(a)"]}
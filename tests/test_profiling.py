@@ -0,0 +1,73 @@
+from __future__ import annotations
+
+import tracemalloc
+
+import pytest
+from langgraph.checkpoint.memory import InMemorySaver
+
+import profiling
+from admission_control import AdmissionController
+from turn_runner import TurnRunner
+
+
+@pytest.fixture
+def unwritable(tmp_path, monkeypatch):
+    blocker = tmp_path / "file"
+    blocker.write_text("")
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(blocker / "profiles"))
+
+
+def test_failed_profile_write_is_reported_not_raised(unwritable):
+    with pytest.warns(UserWarning, match="not written"):
+        with profiling.sampled("x") as profile:
+            pass
+    assert profile.paths == []
+
+
+@pytest.mark.filterwarnings("ignore:profile of")
+def test_turn_ends_when_its_profile_cannot_be_written(unwritable, echo_chatbot):
+    admission = AdmissionController()
+    turn = TurnRunner(echo_chatbot(InMemorySaver()), admission).start("t", "hi", profile=True)
+    events = list(turn.events())
+    assert events[-1] == {"event": "done", "content": "ok(hi)"}
+    assert (turn.status, turn.profile_path) == ("done", None)
+    assert admission.metrics()["active_turns"] == 0
+
+
+@pytest.fixture
+def memory(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_MEMORY", True)
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+    assert not tracemalloc.is_tracing()
+
+
+def test_memory_snapshots_stop_tracing_when_the_last_ends(memory, tmp_path):
+    with profiling.memory_snapshot("outer"):
+        with profiling.memory_snapshot("inner"):
+            assert tracemalloc.is_tracing()
+        assert tracemalloc.is_tracing()
+    assert not tracemalloc.is_tracing()
+    assert len(list(tmp_path.glob("*.memory.txt"))) == 2
+
+    # Tracing started elsewhere is left on.
+    tracemalloc.start()
+    try:
+        with profiling.memory_snapshot("x"):
+            pass
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+
+
+def test_failed_memory_report_keeps_the_result(memory, monkeypatch):
+    def fail(*args):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(profiling, "_write_memory_report", fail)
+    ingest = profiling.memory_snapshot("ingest")(lambda: "indexed")
+    with pytest.warns(UserWarning, match="disk full"):
+        assert ingest() == "indexed"
+    with pytest.warns(UserWarning), pytest.raises(ValueError):
+        with profiling.memory_snapshot("ingest"):
+            raise ValueError("bad pdf")
+    assert not tracemalloc.is_tracing()
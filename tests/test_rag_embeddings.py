@@ -0,0 +1,86 @@
+from __future__ import annotations
+
+import pytest
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_openai import OpenAIEmbeddings
+
+from rag_embeddings import CachedQueryEmbeddings, make_embeddings
+
+
+class _Counting(DeterministicFakeEmbedding):
+    calls: list = []
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return super().embed_documents(texts)
+
+
+def test_repeated_queries_are_not_embedded_again():
+    inner = _Counting(size=8, calls=[])
+    cached = CachedQueryEmbeddings(inner, max_entries=2)
+    vector = cached.embed_query("pump rating")
+    assert cached.embed_query("  pump rating ") == vector  # whitespace does not matter
+    assert inner.calls == [["pump rating"]]
+
+    # One provider call for all misses of a batch, each text once.
+    vectors = cached.embed_queries(["valve", "pump rating", "valve", "notice"])
+    assert inner.calls[1:] == [["valve", "notice"]]
+    assert vectors[0] == vectors[2] and vectors[1] == vector
+    assert cached.metrics()["embedding_calls"] == 2
+
+    # Least recently used entries make room: "pump rating" was evicted.
+    cached.embed_query("pump rating")
+    assert inner.calls[2:] == [["pump rating"]]
+
+
+def test_documents_pass_through():
+    inner = _Counting(size=8, calls=[])
+    cached = CachedQueryEmbeddings(inner)
+    cached.embed_documents(["a", "a"])
+    cached.embed_documents(["a"])
+    assert inner.calls == [["a", "a"], ["a"]]
+    assert cached.metrics()["entries"] == 0
+
+
+# -------------------
+# Providers
+# -------------------
+def test_openai_provider(monkeypatch):
+    monkeypatch.delenv("RAG_EMBEDDING_PROVIDER", raising=False)
+    embeddings = make_embeddings(model="text-embedding-3-large", max_retries=0)
+    assert isinstance(embeddings, OpenAIEmbeddings)
+    assert (embeddings.model, embeddings.max_retries) == ("text-embedding-3-large", 0)
+
+
+def test_local_provider(monkeypatch, tmp_path):
+    # Optional dependencies of the local provider; no model is downloaded.
+    pytest.importorskip("torch")
+    langchain_huggingface = pytest.importorskip("langchain_huggingface")
+    built = []
+
+    class _Recorder:
+        def __init__(self, **kwargs):
+            built.append(kwargs)
+
+    monkeypatch.setattr(langchain_huggingface, "HuggingFaceEmbeddings", _Recorder)
+    monkeypatch.setenv("RAG_EMBEDDING_PROVIDER", "local")
+    monkeypatch.setenv("RAG_LOCAL_EMBEDDING_BATCH_SIZE", "16")
+
+    make_embeddings()
+    assert built[-1]["model_name"] == "sentence-transformers/all-MiniLM-L6-v2"
+    assert built[-1]["model_kwargs"] == {"device": "cpu", "local_files_only": False}
+    assert built[-1]["encode_kwargs"] == {"batch_size": 16, "normalize_embeddings": True}
+
+    # A downloaded model directory loads offline; ONNX runtimes pick their file.
+    make_embeddings(model=str(tmp_path), runtime="onnx-int8")
+    assert built[-1]["model_kwargs"] == {
+        "device": "cpu",
+        "local_files_only": True,
+        "backend": "onnx",
+        "model_kwargs": {"file_name": "onnx/model_qint8_avx512.onnx"},
+    }
+
+    with pytest.raises(ValueError, match="runtime"):
+        make_embeddings(runtime="tpu")
+    with pytest.raises(ValueError, match="provider"):
+        make_embeddings(provider="elsewhere")
@@ -0,0 +1,30 @@
+from __future__ import annotations
+
+import pytest
+
+import rag_index
+from rag_index import choose_index_factory, ivf_nlist
+
+DIM = 384
+
+
+@pytest.mark.parametrize(
+    "chunks, factory",
+    [
+        (1, "Flat"),
+        (2000, "Flat"),
+        (2001, f"IVF{ivf_nlist(2001)},Flat"),
+        (50000, f"IVF{ivf_nlist(50000)},Flat"),
+        (50001, f"IVF{ivf_nlist(50001)},SQfp16"),
+    ],
+)
+def test_index_tiers(chunks, factory):
+    assert choose_index_factory(chunks, DIM) == factory
+
+
+def test_tier_options(monkeypatch):
+    monkeypatch.setattr(rag_index, "MEDIUM_INDEX", "hnsw")
+    monkeypatch.setattr(rag_index, "LARGE_STORAGE", "pq")
+    assert choose_index_factory(2001, DIM) == "HNSW32"
+    assert choose_index_factory(50001, DIM) == f"IVF{ivf_nlist(50001)},PQ48np"
+    assert ivf_nlist(2001) == 51  # at least 39 training points per list
@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import hashlib
+import uuid
+
+import pytest
+
+from load_test import synthetic_pdf
+
+
+@pytest.fixture
+def rag(backends):
+    return backends["rag"]
+
+
+def _thread():
+    return f"rag-{uuid.uuid4().hex[:8]}"
+
+
+def _embedded_texts(rag):
+    return rag.embedding_batcher_metrics()["texts"]
+
+
+def test_uploads_accumulate_per_thread(rag):
+    thread_id = _thread()
+    first, second = synthetic_pdf(901), synthetic_pdf(902)
+    rag.ingest_pdf(first, thread_id=thread_id, filename="first.pdf")
+    rag.ingest_pdf(second, thread_id=thread_id, filename="second.pdf")
+
+    metadata = rag.thread_document_metadata(thread_id)
+    assert [f["filename"] for f in metadata["files"]] == ["first.pdf", "second.pdf"]
+    assert metadata["chunks"] == sum(f["chunks"] for f in metadata["files"])
+    for filename in ("first.pdf", "second.pdf"):
+        results, error = rag._search_thread(thread_id, ["valve safety"], filename)
+        assert error is None
+        assert {doc.metadata["source_file"] for doc in results[0][0]} == {filename}
+
+
+def test_known_pdf_is_shared_not_embedded_again(rag):
+    pdf = synthetic_pdf(903)
+    rag.ingest_pdf(pdf, thread_id=_thread(), filename="one.pdf")
+    embedded = _embedded_texts(rag)
+    assert embedded > 0
+
+    other = _thread()
+    rag.ingest_pdf(pdf, thread_id=other, filename="copy.pdf")
+    assert _embedded_texts(rag) == embedded
+    results, _ = rag._search_thread(other, ["pump budget"], None)
+    assert {doc.metadata["source_file"] for doc in results[0][0]} == {"copy.pdf"}
+
+
+def test_same_name_replaces_the_upload(rag):
+    thread_id = _thread()
+    old, new = synthetic_pdf(904), synthetic_pdf(905)
+    rag.ingest_pdf(old, thread_id=thread_id, filename="report.pdf")
+    rag.ingest_pdf(new, thread_id=thread_id, filename="report.pdf")
+
+    files = rag.thread_document_metadata(thread_id)["files"]
+    assert len(files) == 1
+    # No other thread used the old upload, so its index is gone.
+    assert hashlib.sha256(old).hexdigest() not in rag._DOCUMENT_INDEXES
+    assert hashlib.sha256(new).hexdigest() in rag._DOCUMENT_INDEXES
+
+    assert rag.remove_document(thread_id, "report.pdf")
+    assert not rag.thread_has_document(thread_id)
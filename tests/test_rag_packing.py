@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+import pytest
+import tiktoken
+from langchain_core.documents import Document
+
+import rag_packing
+
+
+@pytest.fixture
+def offline(monkeypatch):
+    """tiktoken as without network: its BPE file cannot be fetched."""
+
+    def unavailable(name):
+        raise OSError("no network")
+
+    monkeypatch.setattr(tiktoken, "get_encoding", unavailable)
+    rag_packing._encoding.cache_clear()
+    yield
+    rag_packing._encoding.cache_clear()
+
+
+def test_count_tokens_offline(offline):
+    with pytest.warns(UserWarning, match="estimating tokens"):
+        assert rag_packing.count_tokens("x" * 400) == 100
+    assert rag_packing.count_tokens("") == 0
+
+
+def test_pack_context_offline(offline):
+    docs = [
+        Document(id=str(i), page_content=f"passage {i} " + "word " * 200, metadata={"page": i})
+        for i in range(6)
+    ]
+    with pytest.warns(UserWarning):
+        passages, _ = rag_packing.pack_context("word", docs, k=4, token_budget=300)
+    assert passages
+    assert sum(rag_packing.count_tokens(p["content"]) for p in passages) <= 300
@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from rag_index import RagIndex
+from rag_registry import RetrieverRegistry
+
+QUERIES = ["valve pressure rating", "pump A-7 maintenance", '"safety notice"']
+
+
+def _index(name, embeddings):
+    chunks = [
+        Document(page_content=f"{name} section {i}: pump A-{i} valve pressure safety notice {i * 7}")
+        for i in range(50)
+    ]
+    return RagIndex.from_documents(chunks, embeddings, f"{name}.pdf")
+
+
+def _results(rag_index):
+    results = rag_index.retrieve_many(QUERIES)
+    return [([(doc.id, doc.page_content) for doc in docs], path) for docs, path in results]
+
+
+def test_spill_and_reload(tmp_path):
+    embeddings = DeterministicFakeEmbedding(size=32)
+    first, second = _index("first", embeddings), _index("second", embeddings)
+    before = _results(first)
+    registry = RetrieverRegistry(
+        loader=lambda path: RagIndex.load_local(path, embeddings),
+        budget_bytes=first.estimate_bytes() + second.estimate_bytes() // 2,
+        spill_dir=str(tmp_path),
+        sizer=lambda rag_index: rag_index.estimate_bytes(),
+    )
+    registry.put("first", first)
+    registry.put("second", second)  # over budget: the least recently used is spilled
+    metrics = registry.metrics()
+    assert (metrics["resident_indexes"], metrics["spilled_indexes"], metrics["evictions"]) == (1, 1, 1)
+    assert "first" in registry
+
+    reloaded = registry.get("first")
+    assert reloaded is not first
+    assert _results(reloaded) == before
+    metrics = registry.metrics()
+    assert (metrics["reloads"], metrics["misses"], metrics["spilled_indexes"]) == (1, 1, 1)  # now "second"
+    assert registry.get("first") is reloaded and registry.metrics()["hits"] == 1
+
+    registry.discard("second")
+    assert "second" not in registry and registry.get("second") is None
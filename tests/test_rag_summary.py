@@ -0,0 +1,35 @@
+from __future__ import annotations
+
+import threading
+
+from langchain_core.documents import Document
+from langchain_core.runnables import RunnableLambda
+
+from rag_summary import build_overview
+
+
+class _StructuredModel:
+    """Answers with_structured_output(schema) prompts with a canned instance."""
+
+    def with_structured_output(self, schema):
+        fields = {"summary": "s", "headings": ["Intro"]}
+        return RunnableLambda(lambda prompt: schema(**{k: v for k, v in fields.items() if k in schema.model_fields}))
+
+
+def test_overview_calls_go_through_the_gate():
+    calls = []
+    lock = threading.Lock()
+
+    def gate_call(fn, *args, **kwargs):
+        with lock:
+            calls.append(fn)
+        return fn(*args, **kwargs)
+
+    chunks = [Document(page_content=f"chunk {i}", metadata={"page": i // 4}) for i in range(70)]
+    overview = build_overview(chunks, _StructuredModel(), [], batch_size=8, gate_call=gate_call)
+
+    # 9 map calls, then 2 + 1 reduce calls.
+    assert len(calls) == 12
+    assert overview["summary"] == "s"
+    assert len(overview["sections"]) == 9
+    assert overview["outline"] == [{"title": "Intro", "page": 1, "level": 1}]
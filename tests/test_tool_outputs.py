@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import json
+from types import SimpleNamespace
+
+import pytest
+from langchain_core.messages import ToolMessage
+
+import tool_outputs
+from rag_packing import count_tokens
+from tool_outputs import compact, compact_tool_output, fit
+
+TRUNCATED = " … [truncated]"
+
+
+# -------------------
+# Size limits
+# -------------------
+def test_fit_drops_trailing_list_items():
+    payload = {"query": "q", "context": [f"passage {i} " + "word " * 40 for i in range(10)]}
+    text, cut = fit(payload, 200)
+    assert cut and count_tokens(text) <= 200
+    fitted = json.loads(text)
+    kept = len(fitted["context"])
+    assert 1 <= kept < 10
+    assert fitted["context"] == payload["context"][:kept]  # best first: the head is kept
+    assert fitted["omitted_items"] == 10 - kept
+
+
+def test_fit_cuts_text_last():
+    text, cut = fit("word " * 1000, 50)
+    assert cut and text.endswith(TRUNCATED)
+    assert count_tokens(text[: -len(TRUNCATED)]) <= 50
+    assert not text[: -len(TRUNCATED)].endswith(" ")  # cut at a word boundary
+
+    # A single list item that is still too long is cut as text.
+    text, cut = fit({"context": ["word " * 1000]}, 50)
+    assert cut and text.endswith(TRUNCATED)
+
+
+def test_fit_leaves_small_payloads():
+    assert fit({"a": [1, 2]}, 50) == ('{"a": [1, 2]}', False)
+
+
+# -------------------
+# compact
+# -------------------
+def test_unchanged_results_are_returned_as_is():
+    content = '{"first_num":1,  "second_num":2, "result":3}'  # not how json.dumps writes it
+    assert compact("calculator", content) == (content, False)
+    assert compact("duckduckgo_search", "one two") == ("one two", False)
+
+
+def test_projection_and_limit_mark_changed():
+    quote = {"Global Quote": {"01. symbol": "X", "05. price": "1.0", "06. volume": "7"}}
+    text, changed = compact("get_stock_price", json.dumps(quote))
+    assert changed and json.loads(text) == {"symbol": "X", "price": "1.0"}
+
+    text, changed = compact("calculator", json.dumps({"items": ["word " * 50] * 200}))
+    assert changed and count_tokens(text) <= tool_outputs.DEFAULT_TOKEN_LIMIT
+
+
+@pytest.fixture
+def archive(tmp_path, monkeypatch):
+    archive = tool_outputs._Archive(str(tmp_path / "tool_outputs.db"))
+    monkeypatch.setattr(tool_outputs, "_ARCHIVE", archive)
+    monkeypatch.setattr(tool_outputs, "_STATS", {})
+    return archive
+
+
+def _call(tool, content, call_id):
+    request = SimpleNamespace(
+        tool_call={"name": tool, "id": call_id},
+        runtime=SimpleNamespace(config={"configurable": {"thread_id": "t"}}),
+    )
+    result = ToolMessage(content=content, name=tool, tool_call_id=call_id)
+    return compact_tool_output(request, lambda _: result), result
+
+
+def test_only_compacted_results_are_archived_and_counted(archive):
+    compacted, unchanged = json.dumps({"items": ["word " * 50] * 200}), '{"result": 3}'
+    out, _ = _call("calculator", compacted, "c1")
+    assert out.content != compacted
+    kept, original = _call("calculator", unchanged, "c2")
+    assert kept is original
+
+    assert archive.get("t", "c1") == compacted
+    assert archive.get("t", "c2") is None
+    stats = tool_outputs.metrics()["calculator"]
+    assert (stats["calls"], stats["compacted"]) == (2, 1)
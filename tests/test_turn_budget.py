@@ -0,0 +1,188 @@
+from __future__ import annotations
+
+import json
+import threading
+import time
+import uuid
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+from langgraph.graph import END
+
+import turn_budget
+from admission_control import ProviderGate
+from turn_budget import (
+    FALLBACK_ANSWER,
+    NOT_RUN_NOTE,
+    TIMED_OUT_NOTE,
+    TurnDeadlineExceeded,
+    call_model,
+    final_answer,
+    route_after_model,
+    with_turn_deadline,
+)
+
+
+def _tool_call(name="get_stock_price"):
+    return {"name": name, "args": {"symbol": "X"}, "id": f"call-{uuid.uuid4().hex[:8]}"}
+
+
+def _rounds(rounds):
+    """A conversation in which the model asked for tools `rounds` times."""
+    messages = [HumanMessage(content="q")]
+    for _ in range(rounds):
+        call = _tool_call()
+        messages += [AIMessage(content="", tool_calls=[call]), ToolMessage(content="r", tool_call_id=call["id"])]
+    return messages[:-1]  # the last round's tools have not run yet
+
+
+class _RecordingModel:
+    def __init__(self, error=None):
+        self.prompts = []
+        self.error = error
+
+    def invoke(self, prompt, config=None):
+        self.prompts.append(prompt)
+        if self.error is not None:
+            raise self.error
+        return AIMessage(content="final")
+
+
+def _direct(fn, *args, **kwargs):
+    return fn(*args, **kwargs)
+
+
+@pytest.fixture
+def budget(monkeypatch):
+    monkeypatch.setattr(turn_budget, "MAX_TOOL_ROUNDS", 2)
+    monkeypatch.setattr(turn_budget, "FINAL_ANSWER_RESERVE_SECONDS", 0.5)
+
+
+# -------------------
+# Routing
+# -------------------
+def test_route_after_model(budget):
+    config = with_turn_deadline({"configurable": {"thread_id": "t"}}, seconds=30)
+    assert route_after_model({"messages": _rounds(0) + [AIMessage(content="a")]}, config) == END
+    assert route_after_model({"messages": _rounds(2)}, config) == "tools"
+    before = turn_budget.metrics()["exhausted"].get("tool_rounds", 0)
+    assert route_after_model({"messages": _rounds(3)}, config) == "final_answer"
+    assert turn_budget.metrics()["exhausted"]["tool_rounds"] == before + 1
+    # The model call ran out of time and added nothing.
+    assert route_after_model({"messages": [HumanMessage(content="q")]}, config) == "final_answer"
+
+    spent = with_turn_deadline({"configurable": {"thread_id": "t"}}, seconds=0.2)
+    assert route_after_model({"messages": _rounds(1)}, spent) == "final_answer"
+    # Rounds count from the user's last message only.
+    assert route_after_model({"messages": _rounds(2) + [ToolMessage(content="r", tool_call_id="x")] + _rounds(1)}, config) == "tools"
+
+
+# -------------------
+# Final answer
+# -------------------
+def test_final_answer_closes_pending_tool_calls():
+    answered, pending = _tool_call(), _tool_call("duckduckgo_search")
+    messages = [
+        HumanMessage(content="q"),
+        AIMessage(content="", tool_calls=[answered, pending]),
+        ToolMessage(content="done", tool_call_id=answered["id"]),
+    ]
+    model = _RecordingModel()
+    system = SystemMessage(content="persona")
+    update = final_answer({"messages": messages}, {"configurable": {}}, model, _direct, system)
+
+    not_run, answer = update["messages"]
+    assert (not_run.tool_call_id, not_run.content) == (pending["id"], NOT_RUN_NOTE)
+    assert answer.content == "final"
+    prompt = model.prompts[0]
+    assert prompt[0] is system
+    assert prompt[1:4] == messages and prompt[4] is not_run
+    assert "Do not call any tools" in prompt[-1].content
+
+
+def test_final_answer_falls_back():
+    model = _RecordingModel(error=RuntimeError("provider down"))
+    update = final_answer({"messages": _rounds(1)}, {"configurable": {}}, model, _direct)
+    assert [m.content for m in update["messages"]] == [NOT_RUN_NOTE, FALLBACK_ANSWER]
+    assert turn_budget.metrics()["recent"][-1]["kind"] == "final_answer_failed"
+
+
+# -------------------
+# Abandoned calls
+# -------------------
+def test_abandoned_call_gives_back_its_gate_slot(budget):
+    gate = ProviderGate(max_concurrent_calls=1)
+    release = threading.Event()
+
+    def hanging(prompt, config=None):
+        release.wait(10)
+        return AIMessage(content="late")
+
+    config = with_turn_deadline({"configurable": {"thread_id": "t"}}, seconds=0.8)
+    start = time.monotonic()
+    with pytest.raises(TurnDeadlineExceeded):
+        call_model(config, gate.call, hanging, [HumanMessage(content="q")])
+    assert time.monotonic() - start < 1.0
+    assert gate.metrics()["abandoned_running"] == 1
+
+    # The only slot is free again for the next turn.
+    done = []
+    thread = threading.Thread(target=lambda: done.append(gate.call(lambda: "next")))
+    thread.start()
+    thread.join(1)
+    assert done == ["next"]
+
+    release.set()
+    deadline = time.monotonic() + 2
+    while gate.metrics()["abandoned_running"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    metrics = gate.metrics()
+    assert (metrics["abandoned"], metrics["abandoned_running"], metrics["in_flight"]) == (1, 0, 0)
+
+
+# -------------------
+# In the tools graph
+# -------------------
+def _run(chatbot, message, seconds):
+    thread_id = f"budget-{uuid.uuid4().hex[:8]}"
+    config = with_turn_deadline({"configurable": {"thread_id": thread_id}}, seconds=seconds)
+    start = time.monotonic()
+    chatbot.invoke({"messages": [HumanMessage(content=message)]}, config)
+    elapsed = time.monotonic() - start
+    return elapsed, chatbot.get_state(config).values["messages"]
+
+
+def test_tool_loop_is_cut_off(backends, budget, monkeypatch):
+    import load_test
+
+    class Looping(load_test.FakeChatModel):
+        def _tool_call(self, messages):
+            if isinstance(messages[-1], SystemMessage):
+                return None  # the final answer prompt
+            args = json.dumps({"first_num": 1, "second_num": 2, "operation": "add"})
+            return {"name": "calculator", "args": args, "id": f"call-{uuid.uuid4().hex[:8]}", "index": 0}
+
+    backend = backends["tools"]
+    monkeypatch.setattr(backend, "llm_with_tools", Looping(first_token_ms=1, token_ms=0, answer_tokens=3))
+    _, messages = _run(backend.chatbot, "loop", seconds=30)
+
+    requested = [m for m in messages if isinstance(m, AIMessage) and m.tool_calls]
+    assert len(requested) == 3
+    assert messages[-2].content == NOT_RUN_NOTE
+    assert isinstance(messages[-1], AIMessage) and not messages[-1].tool_calls
+
+
+def test_hanging_tool_times_out(backends, budget, monkeypatch):
+    import load_test
+
+    backend = backends["tools"]
+    tools = dict(backend.tool_node._tools_by_name)
+    for name in ("calculator", "get_stock_price", "duckduckgo_search"):
+        monkeypatch.setitem(backend.tool_node._tools_by_name, name, load_test._fake_tool(name, 5000))
+    elapsed, messages = _run(backend.chatbot, "tools: anything", seconds=1.5)
+    backend.tool_node._tools_by_name.update(tools)
+
+    assert elapsed < 1.5
+    tool_messages = [m for m in messages if isinstance(m, ToolMessage)]
+    assert [m.content for m in tool_messages] == [TIMED_OUT_NOTE]
+    assert messages[-1].content.startswith("word0")
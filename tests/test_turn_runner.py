@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+import time
+import uuid
+
+import pytest
+from langchain_core.messages import AIMessage, ToolMessage
+
+import chat_service_client
+import load_test
+from admission_control import AdmissionController
+from chat_service_client import LocalChatClient
+from turn_runner import CANCELLED_NOTE, TurnRunner
+
+
+@pytest.fixture
+def tools(backends, monkeypatch):
+    """The tools graph with a slow stand-in model: 40 tokens, 20 ms apart."""
+    backend = backends["tools"]
+    model = load_test.FakeChatModel(first_token_ms=1, token_ms=20, answer_tokens=40)
+    monkeypatch.setattr(backend, "llm_with_tools", model)
+    return backend
+
+
+def _thread():
+    return f"turn-{uuid.uuid4().hex[:8]}"
+
+
+def _messages(backend, thread_id):
+    return backend.chatbot.get_state({"configurable": {"thread_id": thread_id}}).values["messages"]
+
+
+def _until(events, name):
+    """Read events up to and including the first `name` event."""
+    for event in events:
+        if event["event"] == name:
+            return event
+    raise AssertionError(f"no {name} event")
+
+
+def test_cancel_mid_answer_saves_the_partial_answer(tools):
+    admission = AdmissionController()
+    thread_id = _thread()
+    turn = TurnRunner(tools.chatbot, admission).start(thread_id, "hello")
+    events = turn.events()
+    _until(events, "token")
+    assert turn.cancel()
+
+    final = list(events)[-1]
+    assert final["event"] == "cancelled" and final["content"].startswith("word0")
+    assert turn.status == "cancelled"
+    saved = _messages(tools, thread_id)[-1]
+    assert isinstance(saved, AIMessage)
+    assert saved.content.startswith("word0 ") and saved.content.endswith(f" {CANCELLED_NOTE}")
+    assert admission.metrics()["active_turns"] == 0
+
+
+def test_cancel_during_a_tool_answers_its_call(tools, monkeypatch):
+    for name in ("calculator", "get_stock_price", "duckduckgo_search"):
+        monkeypatch.setitem(tools.tool_node._tools_by_name, name, load_test._fake_tool(name, 300))
+    thread_id = _thread()
+    turn = TurnRunner(tools.chatbot, AdmissionController()).start(thread_id, "tools: anything")
+    while turn.status != "running":
+        time.sleep(0.01)
+    time.sleep(0.1)  # the model has asked for the tool, which is running
+    assert turn.cancel()
+    assert [event["event"] for event in turn.events()][-1] == "cancelled"
+
+    call, result, stopped = _messages(tools, thread_id)[-3:]
+    assert isinstance(result, ToolMessage) and result.tool_call_id == call.tool_calls[0]["id"]
+    assert stopped.content == CANCELLED_NOTE
+
+
+def test_cancel_while_queued(tools):
+    admission = AdmissionController(max_concurrent_turns=1, poll_seconds=0.05)
+    with admission.turn("busy"):
+        thread_id = _thread()
+        turn = TurnRunner(tools.chatbot, admission).start(thread_id, "hello")
+        events = turn.events()
+        _until(events, "queued")
+        assert turn.cancel()
+        assert list(events) == [{"event": "cancelled", "content": ""}]
+        # Nothing was admitted, so nothing was released: the other turn still holds the slot.
+        assert admission.metrics()["active_turns"] == 1
+    assert not tools.chatbot.get_state({"configurable": {"thread_id": thread_id}}).values  # never ran
+
+
+@pytest.mark.parametrize("on_disconnect", ["cancel", "detach"])
+def test_reader_going_away(tools, monkeypatch, on_disconnect):
+    monkeypatch.setattr(chat_service_client, "ON_DISCONNECT", on_disconnect)
+    client = LocalChatClient("tools")
+    thread_id = _thread()
+    stream = client.stream_turn(thread_id, "hello")
+    _until(stream, "token")
+    stream.close()  # the tab was closed
+
+    replay = list(client.resume_turn(thread_id))
+    assert replay[0]["event"] == "token"
+    if on_disconnect == "cancel":
+        assert replay[-1]["event"] == "cancelled"
+        assert _messages(tools, thread_id)[-1].content.endswith(CANCELLED_NOTE)
+    else:
+        assert replay[-1] == {"event": "done", "content": "".join(f"word{i} " for i in range(40))}
+        assert client.turn_status(thread_id)["status"] == "done"
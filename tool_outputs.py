@@ -0,0 +1,263 @@
+"""
+Compact tool results before they enter the conversation.
+
+A ToolMessage is re-sent to the model on every later turn of its thread, so
+raw payloads (Alpha Vantage's quote JSON, long search snippet blobs,
+retrieval metadata) are paid for again and again. `compact_tool_output` is a
+ToolNode `wrap_tool_call` hook that, per tool:
+
+    projects   the result to the fields the model needs (PROJECTORS)
+    limits     it to TOOL_OUTPUT_TOKEN_LIMITS tokens, dropping trailing list
+               items first and cutting text last
+    archives   the full payload in TOOL_OUTPUT_ARCHIVE (SQLite, keyed by
+               tool_call_id) for display, see `archived_output`
+
+TOOL_OUTPUT_COMPACT=0 passes results through untouched. `metrics()` reports
+calls and tokens before and after, per tool.
+"""
+from __future__ import annotations
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from langchain_core.messages import ToolMessage
+
+from rag_packing import count_tokens
+
+COMPACT = os.getenv("TOOL_OUTPUT_COMPACT", "1") == "1"
+ARCHIVE_PATH = os.getenv("TOOL_OUTPUT_ARCHIVE", "tool_outputs.db")  # "" disables the archive
+DEFAULT_TOKEN_LIMIT = int(os.getenv("TOOL_OUTPUT_DEFAULT_TOKEN_LIMIT", "2000"))
+# rag_tool's context is already packed to RAG_CONTEXT_TOKEN_BUDGET; the limit only catches outliers.
+_TOKEN_LIMITS = (
+    "duckduckgo_search=400,get_stock_price=150,rag_tool=4000,rag_multi_tool=4000,document_overview_tool=3000"
+)
+
+
+def _parse_limits(value: str) -> Dict[str, int]:
+    limits = {}
+    for part in filter(None, (part.strip() for part in value.split(","))):
+        name, _, limit = part.partition("=")
+        limits[name.strip()] = int(limit)
+    return limits
+
+
+TOKEN_LIMITS = {**_parse_limits(_TOKEN_LIMITS), **_parse_limits(os.getenv("TOOL_OUTPUT_TOKEN_LIMITS", ""))}
+
+_ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tool_outputs (
+    tool_call_id TEXT PRIMARY KEY,
+    thread_id TEXT,
+    tool TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    payload TEXT NOT NULL
+);
+"""
+
+
+# -------------------
+# Projections
+# -------------------
+def _stock_quote(payload: Any) -> Any:
+    """Alpha Vantage GLOBAL_QUOTE -> the quote's fields, without "05. " prefixes."""
+    if not isinstance(payload, dict):
+        return payload
+    for key in ("Error Message", "Note", "Information"):
+        if key in payload:
+            return {"error": payload[key]}
+    quote = payload.get("Global Quote")
+    if not isinstance(quote, dict):
+        return payload
+    if not quote:
+        return {"error": "Unknown symbol"}
+    fields = {re.sub(r"^\d+\.\s*", "", key): value for key, value in quote.items()}
+    kept = ("symbol", "price", "change", "change percent", "previous close", "latest trading day")
+    return {key.replace(" ", "_"): fields[key] for key in kept if key in fields}
+
+
+def _search_snippets(payload: Any) -> Any:
+    """DuckDuckGo's snippet blob with whitespace collapsed."""
+    if isinstance(payload, str):
+        return re.sub(r"\s+", " ", payload).strip()
+    return payload
+
+
+def _source(meta: dict) -> dict:
+    return {"file": meta.get("source_file"), "page": meta.get("page_label", meta.get("page"))}
+
+
+def _rag_result(payload: Any) -> Any:
+    """rag_tool: the passages and where they come from, without retrieval stats."""
+    if not isinstance(payload, dict) or "error" in payload or "context" not in payload:
+        return payload
+    metadata = payload.get("metadata") or [{}] * len(payload["context"])
+    return {
+        "query": payload.get("query"),
+        "context": [
+            {"content": content, "source": _source(meta)} for content, meta in zip(payload["context"], metadata)
+        ],
+    }
+
+
+def _rag_multi_result(payload: Any) -> Any:
+    """rag_multi_tool: queries with their chunk positions, chunks with their source."""
+    if not isinstance(payload, dict) or "error" in payload or "chunks" not in payload:
+        return payload
+    return {
+        "queries": [{"query": q["query"], "results": q["results"]} for q in payload.get("queries", [])],
+        "chunks": [
+            {"content": chunk["content"], "source": _source(chunk.get("metadata") or {})}
+            for chunk in payload["chunks"]
+        ],
+    }
+
+
+PROJECTORS: Dict[str, Callable[[Any], Any]] = {
+    "get_stock_price": _stock_quote,
+    "duckduckgo_search": _search_snippets,
+    "rag_tool": _rag_result,
+    "rag_multi_tool": _rag_multi_result,
+}
+
+
+# -------------------
+# Size limits
+# -------------------
+def _dumps(payload: Any) -> str:
+    return payload if isinstance(payload, str) else json.dumps(payload, ensure_ascii=False)
+
+
+def _cut(text: str, limit: int) -> str:
+    """`text` cut to about `limit` tokens, at a word boundary."""
+    # Shrink by the measured ratio; a few rounds settle on the limit.
+    while count_tokens(text) > limit:
+        keep = int(len(text) * limit / count_tokens(text) * 0.95)
+        text = text[:keep].rsplit(" ", 1)[0] if " " in text[:keep] else text[:keep]
+    return text + " … [truncated]"
+
+
+def fit(payload: Any, limit: int) -> Tuple[str, bool]:
+    """The payload as message content of at most `limit` tokens; whether it was cut."""
+    text = _dumps(payload)
+    if count_tokens(text) <= limit:
+        return text, False
+    if isinstance(payload, dict):
+        payload = dict(payload)
+        lists = [key for key, value in payload.items() if isinstance(value, list)]
+        omitted = 0
+        # Retrieval results are ordered best first: drop from the end of the longest list.
+        while lists and count_tokens(text) > limit:
+            key = max(lists, key=lambda k: len(_dumps(payload[k])))
+            if len(payload[key]) <= 1:
+                lists.remove(key)
+                continue
+            payload[key] = payload[key][:-1]
+            omitted += 1
+            text = _dumps({**payload, "omitted_items": omitted})
+        if count_tokens(text) <= limit:
+            return text, True
+    return _cut(text, limit), True
+
+
+# -------------------
+# Archive
+# -------------------
+class _Archive:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_ARCHIVE_SCHEMA)
+        return self._conn
+
+    def put(self, tool_call_id: str, thread_id: Optional[str], tool: str, payload: str) -> None:
+        with self._lock:
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO tool_outputs VALUES (?, ?, ?, ?, ?)",
+                    (tool_call_id, thread_id, tool, time.time(), payload),
+                )
+
+    def get(self, thread_id: str, tool_call_id: str) -> Optional[str]:
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT payload FROM tool_outputs WHERE tool_call_id = ? AND thread_id = ?",
+                (tool_call_id, thread_id),
+            ).fetchone()
+        return row[0] if row else None
+
+
+_ARCHIVE = _Archive(ARCHIVE_PATH) if ARCHIVE_PATH else None
+_STATS: Dict[str, Dict[str, int]] = {}
+_STATS_LOCK = threading.Lock()
+
+
+def archived_output(thread_id: str, tool_call_id: str) -> Optional[str]:
+    """The full result of a compacted tool call of the thread, or None if it was not archived."""
+    return _ARCHIVE.get(str(thread_id), tool_call_id) if _ARCHIVE is not None else None
+
+
+# -------------------
+# ToolNode hook
+# -------------------
+def compact(tool: str, content: Any) -> Tuple[Any, bool]:
+    """(content for the model, whether it was projected or cut)."""
+    if not isinstance(content, str):
+        return content, False  # content blocks (images etc.) pass through
+    try:
+        payload: Any = json.loads(content)
+    except ValueError:
+        payload = content
+    projector = PROJECTORS.get(tool)
+    projected = projector(payload) if projector is not None else payload
+    limit = TOKEN_LIMITS.get(tool, DEFAULT_TOKEN_LIMIT)
+    if projected == payload and count_tokens(content) <= limit:
+        # Nothing to drop: keep the original text rather than re-serializing it.
+        return content, False
+    text, _ = fit(projected, limit)
+    return text, True
+
+
+def compact_tool_output(request, execute):
+    """ToolNode `wrap_tool_call`: run the tool, then compact its ToolMessage."""
+    result = execute(request)
+    if not COMPACT or not isinstance(result, ToolMessage) or result.status == "error":
+        return result
+    tool = result.name or request.tool_call["name"]
+    content, changed = compact(tool, result.content)
+    before = count_tokens(result.content) if isinstance(result.content, str) else 0
+    after = count_tokens(content) if changed else before
+    with _STATS_LOCK:
+        stats = _STATS.setdefault(tool, {"calls": 0, "compacted": 0, "tokens_before": 0, "tokens_after": 0})
+        stats["calls"] += 1
+        stats["compacted"] += changed
+        stats["tokens_before"] += before
+        stats["tokens_after"] += after
+    if not changed:
+        return result
+    if _ARCHIVE is not None and result.tool_call_id:
+        config = getattr(request.runtime, "config", None) or {}
+        thread_id = config.get("configurable", {}).get("thread_id")
+        thread_id = str(thread_id) if thread_id is not None else None
+        _ARCHIVE.put(result.tool_call_id, thread_id, tool, result.content)
+    return result.model_copy(update={"content": content})
+
+
+def metrics() -> dict:
+    """Per tool: calls, how many were compacted, and tokens before/after."""
+    with _STATS_LOCK:
+        stats = {tool: dict(values) for tool, values in _STATS.items()}
+    for values in stats.values():
+        before = values["tokens_before"]
+        values["reduction"] = round(1 - values["tokens_after"] / before, 3) if before else 0.0
+    return stats
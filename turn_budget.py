@@ -0,0 +1,272 @@
+"""
+Time and tool-round budgets for the chat_node <-> tools loop.
+
+    CHAT_TURN_DEADLINE_SECONDS         wall-clock budget of a turn (default 60, 0 = none)
+    CHAT_MAX_TOOL_ROUNDS               model calls that may request tools per turn (default 5)
+    CHAT_FINAL_ANSWER_RESERVE_SECONDS  time kept back for the final answer (default 10)
+
+`with_turn_deadline(config)` stamps the deadline into the run config
+(TurnRunner does it once a turn is admitted), so every node and tool call of
+the turn sees it. Model calls (`call_model`) and tool calls (`tool_deadline`)
+get the time left before the reserve; a call still running then is abandoned:
+its thread is left to finish (Python cannot stop it), its streaming is cut
+off at its next token, and the PROVIDER_GATE slots of the provider calls it
+is making are given back and not retried (see admission_control), so
+timed-out turns do not hold up new ones.
+
+`route_after_model` replaces `tools_condition`: when the model asks for
+tools after CHAT_MAX_TOOL_ROUNDS rounds, or its call ran out of time
+(`model_step`), the turn goes to the backend's final_answer node
+(`final_answer`). It answers the pending tool calls as not run and asks the
+model, with the backend's system prompt but without tools and within the
+reserve, to answer from what was gathered. If even that fails, a fixed
+apology is the answer, so a turn ends by its deadline either way.
+
+Every exhaustion is recorded; `metrics()` has the counts and the latest ones.
+"""
+from __future__ import annotations
+
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler, BaseCallbackManager
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.runnables import RunnableConfig
+from langgraph.graph import END
+
+from admission_control import CALL_ABANDON, CallAbandon
+
+TURN_DEADLINE_SECONDS = float(os.getenv("CHAT_TURN_DEADLINE_SECONDS", "60"))
+MAX_TOOL_ROUNDS = int(os.getenv("CHAT_MAX_TOOL_ROUNDS", "5"))
+FINAL_ANSWER_RESERVE_SECONDS = float(os.getenv("CHAT_FINAL_ANSWER_RESERVE_SECONDS", "10"))
+
+DEADLINE_KEY = "turn_deadline"  # configurable key: epoch seconds
+FINAL_ANSWER_PROMPT = (
+    "You have run out of time or tool calls for this request. Do not call any tools. "
+    "Answer the user now using only the information gathered above, and say briefly "
+    "what you could not find out."
+)
+FALLBACK_ANSWER = (
+    "Sorry, I could not finish this request within its time limit. "
+    "Please try again, or ask a narrower question."
+)
+NOT_RUN_NOTE = "Not run: the turn's tool budget ran out."
+TIMED_OUT_NOTE = "Timed out: the turn's time budget ran out."
+
+
+class TurnDeadlineExceeded(Exception):
+    """A model or tool call did not finish before the turn's deadline."""
+
+
+# -------------------
+# Deadlines
+# -------------------
+def with_turn_deadline(config: dict, seconds: float = TURN_DEADLINE_SECONDS) -> dict:
+    """`config` with a deadline `seconds` from now (unchanged when `seconds` is 0)."""
+    if seconds <= 0:
+        return config
+    configurable = {**config.get("configurable", {}), DEADLINE_KEY: time.time() + seconds}
+    return {**config, "configurable": configurable}
+
+
+def remaining_seconds(config: Optional[dict], final: bool = False) -> Optional[float]:
+    """Seconds left for a call; before the final answer's reserve unless `final`. None: no deadline."""
+    deadline = ((config or {}).get("configurable") or {}).get(DEADLINE_KEY)
+    if deadline is None:
+        return None
+    left = deadline - time.time()
+    return left if final else left - FINAL_ANSWER_RESERVE_SECONDS
+
+
+def _run_bounded(timeout: Optional[float], fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """fn(*args, **kwargs), or TurnDeadlineExceeded after `timeout` seconds."""
+    if timeout is None:
+        return fn(*args, **kwargs)
+    if timeout <= 0:
+        raise TurnDeadlineExceeded()
+    outcome: Dict[str, Any] = {}
+    done = threading.Event()
+    context = contextvars.copy_context()  # keeps the run config for get_config() and callbacks
+    abandon = CallAbandon()
+    context.run(CALL_ABANDON.set, abandon)
+
+    def target() -> None:
+        try:
+            outcome["value"] = context.run(fn, *args, **kwargs)
+        except BaseException as e:
+            outcome["error"] = e
+        finally:
+            done.set()
+
+    threading.Thread(target=target, name="turn-budget-call", daemon=True).start()
+    if not done.wait(timeout):
+        abandon.abandon()  # frees its provider gate slots
+        raise TurnDeadlineExceeded()
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["value"]
+
+
+class _Abandoned(Exception):
+    pass
+
+
+class _AbandonHandler(BaseCallbackHandler):
+    """Stops an abandoned model call at its next token, so it streams nothing more."""
+
+    raise_error = True
+
+    def __init__(self):
+        self.abandoned = threading.Event()
+
+    def on_llm_new_token(self, *args: Any, **kwargs: Any) -> None:
+        if self.abandoned.is_set():
+            raise _Abandoned()
+
+
+def call_model(config: dict, fn: Callable[..., Any], *args: Any, final: bool = False) -> Any:
+    """
+    fn(*args, config=...) within the turn's remaining time, e.g.
+    `call_model(config, PROVIDER_GATE.call, llm.invoke, messages)`.
+    """
+    timeout = remaining_seconds(config, final)
+    if timeout is None:
+        return fn(*args, config=config)
+    handler = _AbandonHandler()
+    callbacks = config.get("callbacks")
+    if isinstance(callbacks, BaseCallbackManager):
+        callbacks = callbacks.copy()
+        callbacks.add_handler(handler, inherit=True)
+    else:
+        callbacks = [*(callbacks or []), handler]
+    try:
+        return _run_bounded(timeout, fn, *args, config={**config, "callbacks": callbacks})
+    except TurnDeadlineExceeded:
+        handler.abandoned.set()
+        raise
+
+
+def model_step(config: dict, fn: Callable[..., Any], *args: Any) -> dict:
+    """A chat node's update: the model's response, or nothing if it ran out of time."""
+    try:
+        return {"messages": [call_model(config, fn, *args)]}
+    except TurnDeadlineExceeded:
+        record("deadline", config, stage="model")
+        return {"messages": []}
+
+
+# -------------------
+# Exhaustion events
+# -------------------
+_EVENTS: Deque[dict] = deque(maxlen=200)
+_COUNTS: Dict[str, int] = {}
+_EVENTS_LOCK = threading.Lock()
+
+
+def record(kind: str, config: Optional[dict], **details: Any) -> None:
+    """kind: tool_rounds | deadline (stage: model | tools) | tool_timeout | final_answer_failed"""
+    thread_id = ((config or {}).get("configurable") or {}).get("thread_id")
+    with _EVENTS_LOCK:
+        _COUNTS[kind] = _COUNTS.get(kind, 0) + 1
+        _EVENTS.append({"kind": kind, "thread_id": thread_id, "at": time.time(), **details})
+
+
+def metrics() -> dict:
+    with _EVENTS_LOCK:
+        return {"exhausted": dict(_COUNTS), "recent": list(_EVENTS)[-20:]}
+
+
+# -------------------
+# Graph pieces
+# -------------------
+def tool_rounds(messages: List[Any]) -> int:
+    """Model calls that requested tools since the user's last message."""
+    rounds = 0
+    for message in reversed(messages):
+        if isinstance(message, HumanMessage):
+            break
+        if isinstance(message, AIMessage) and message.tool_calls:
+            rounds += 1
+    return rounds
+
+
+def route_after_model(state: dict, config: RunnableConfig) -> str:
+    """`tools_condition` with budgets: "tools", "final_answer" or END."""
+    messages = state["messages"]
+    last = messages[-1] if messages else None
+    if not isinstance(last, AIMessage):
+        # The model call ran out of time (chat_node added nothing).
+        return "final_answer"
+    if not last.tool_calls:
+        return END
+    rounds = tool_rounds(messages)
+    if rounds > MAX_TOOL_ROUNDS:
+        record("tool_rounds", config, rounds=rounds - 1)
+        return "final_answer"
+    left = remaining_seconds(config)
+    if left is not None and left <= 0:
+        record("deadline", config, stage="tools")
+        return "final_answer"
+    return "tools"
+
+
+def tool_deadline(wrapper: Optional[Callable] = None) -> Callable:
+    """
+    A ToolNode `wrap_tool_call` bounding each tool call by the turn's
+    remaining time; `wrapper` (e.g. compact_tool_output) runs around it.
+    """
+
+    def bounded(request, execute):
+        def run(request):
+            config = getattr(request.runtime, "config", None)
+            try:
+                return _run_bounded(remaining_seconds(config), execute, request)
+            except TurnDeadlineExceeded:
+                call = request.tool_call
+                record("tool_timeout", config, tool=call["name"])
+                return ToolMessage(
+                    content=TIMED_OUT_NOTE, tool_call_id=call["id"], name=call["name"], status="error"
+                )
+
+        return wrapper(request, run) if wrapper is not None else run(request)
+
+    return bounded
+
+
+def final_answer(
+    state: dict,
+    config: RunnableConfig,
+    llm,
+    gate_call: Callable[..., Any],
+    system_message: Optional[SystemMessage] = None,
+) -> dict:
+    """
+    The final_answer node's update: the pending tool calls answered as not
+    run, then the tool-less model's answer (through `gate_call`, e.g.
+    PROVIDER_GATE.call, after the backend's `system_message`) or
+    FALLBACK_ANSWER.
+    """
+    messages = state["messages"]
+    updates: List[Any] = []
+    last = next((m for m in reversed(messages) if isinstance(m, AIMessage)), None)
+    if last is not None:
+        # Every tool call needs an answer before the model is called again.
+        answered = {m.tool_call_id for m in messages if isinstance(m, ToolMessage)}
+        updates = [
+            ToolMessage(content=NOT_RUN_NOTE, tool_call_id=call["id"], name=call["name"])
+            for call in last.tool_calls or []
+            if call["id"] not in answered
+        ]
+    prompt = [*messages, *updates, SystemMessage(content=FINAL_ANSWER_PROMPT)]
+    if system_message is not None:
+        prompt.insert(0, system_message)
+    try:
+        answer = call_model(config, gate_call, llm.invoke, prompt, final=True)
+    except Exception as e:
+        record("final_answer_failed", config, error=type(e).__name__)
+        answer = AIMessage(content=FALLBACK_ANSWER)
+    return {"messages": [*updates, answer]}
@@ -0,0 +1,358 @@
+"""
+Background execution of chat turns, with cancellation and reattachment.
+
+A turn runs in its own thread and buffers its events, so the caller that
+started it is only one reader. If that reader goes away (a closed tab, a
+Streamlit rerun), `CHAT_ON_DISCONNECT` decides what happens to the turn:
+
+    cancel  (default) abort the model stream and pending tool calls, and save
+            the partial answer to the thread
+    detach  let the turn finish and checkpoint; a reconnecting client replays
+            its events with `TurnRunner.current(thread_id).events()` or simply
+            reads the finished answer from the thread history
+
+`TurnRunner.cancel(thread_id)` stops a running or queued turn explicitly.
+
+A turn started with `profile=True` (default: CHAT_PROFILE_TURNS) is sampled
+while it runs, and its report path is in its summary and `done` event (see
+profiling.py).
+
+Each turn's config carries a deadline once it is admitted (see turn_budget.py).
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+from admission_control import AdmissionController
+from profiling import PROFILE_TURNS, sampled
+from turn_budget import with_turn_deadline
+
+ON_DISCONNECT = os.getenv("CHAT_ON_DISCONNECT", "cancel").strip().lower()
+# How long a finished turn's events stay available for replay.
+KEEP_FINISHED_SECONDS = float(os.getenv("CHAT_KEEP_FINISHED_TURN_SECONDS", "300"))
+
+CANCELLED_NOTE = "[stopped]"
+
+
+def _write_seconds(checkpointer, thread_id: str) -> float:
+    """Time spent in checkpoint writes for the thread, if the saver measures it."""
+    measure = getattr(checkpointer, "write_seconds", None)
+    return measure(thread_id) if measure is not None else 0.0
+
+
+class TurnCancelled(Exception):
+    """Raised inside the graph to abort a cancelled turn."""
+
+
+class _CancellationHandler(BaseCallbackHandler):
+    """
+    Aborts the graph at its next model start, streamed token or tool start
+    once the turn's cancel event is set. `raise_error` makes LangChain
+    propagate the exception instead of logging it.
+    """
+
+    raise_error = True
+
+    def __init__(self, cancelled: threading.Event):
+        self.cancelled = cancelled
+
+    def _check(self, *args: Any, **kwargs: Any) -> None:
+        if self.cancelled.is_set():
+            raise TurnCancelled()
+
+    on_llm_start = _check
+    on_chat_model_start = _check
+    on_llm_new_token = _check
+    on_tool_start = _check
+
+
+class Turn:
+    """One turn's status and event buffer."""
+
+    def __init__(self, thread_id: str, message: str, profile: bool = False):
+        self.thread_id = thread_id
+        self.message = message
+        self.profile = profile
+        self.profile_path: Optional[str] = None
+        self.status = "queued"  # queued | running | done | cancelled | failed
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.error: Optional[BaseException] = None
+        # Time the turn waited on checkpoint writes, including the final flush.
+        self.checkpoint_ms: Optional[float] = None
+        self._events: List[dict] = []
+        self._cond = threading.Condition()
+        self._cancelled = threading.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+    def cancel(self) -> bool:
+        """Request cancellation; False if the turn has already finished."""
+        if self.finished:
+            return False
+        self._cancelled.set()
+        with self._cond:
+            self._cond.notify_all()
+        return True
+
+    def events(self, start: int = 0) -> Iterator[dict]:
+        """Events from index `start`, waiting for new ones until the turn ends."""
+        position = start
+        while True:
+            with self._cond:
+                while position >= len(self._events) and not self.finished:
+                    self._cond.wait()
+                batch = self._events[position:]
+                finished = self.finished
+            for event in batch:
+                yield event
+            position += len(batch)
+            if finished and not batch:
+                return
+
+    def summary(self) -> dict:
+        return {
+            "thread_id": self.thread_id,
+            "status": self.status,
+            "events": len(self._events),
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "checkpoint_ms": self.checkpoint_ms,
+            "profile": self.profile_path,
+        }
+
+    def _emit(self, event: dict) -> None:
+        with self._cond:
+            self._events.append(event)
+            self._cond.notify_all()
+
+    def _fail(self, error: BaseException) -> None:
+        self.error = error
+        self._emit({"event": "error", "detail": str(error), "type": type(error).__name__})
+        self._finish("failed")
+
+    def _finish(self, status: str) -> None:
+        with self._cond:
+            self.status = status
+            self.finished_at = time.time()
+            self._cond.notify_all()
+
+
+class TurnRunner:
+    """Starts turns of one compiled graph in background threads."""
+
+    def __init__(self, chatbot, admission: AdmissionController):
+        self.chatbot = chatbot
+        self.admission = admission
+        self._lock = threading.Lock()
+        self._turns: Dict[str, List[Turn]] = {}  # thread_id -> turns, oldest first
+        self._checkpoint_ms: Deque[float] = deque(maxlen=1000)  # recent turns
+
+    def start(self, thread_id: str, message: str, profile: Optional[bool] = None) -> Turn:
+        turn = Turn(str(thread_id), message, PROFILE_TURNS if profile is None else profile)
+        with self._lock:
+            self._forget_finished()
+            self._turns.setdefault(turn.thread_id, []).append(turn)
+        threading.Thread(
+            target=self._run, args=(turn,), name=f"turn-{turn.thread_id}", daemon=True
+        ).start()
+        return turn
+
+    def current(self, thread_id: str) -> Optional[Turn]:
+        """The thread's latest turn, while running or recently finished."""
+        with self._lock:
+            turns = self._turns.get(str(thread_id))
+            return turns[-1] if turns else None
+
+    def cancel(self, thread_id: str) -> bool:
+        """Cancel every unfinished turn of the thread (e.g. one from another tab)."""
+        with self._lock:
+            turns = list(self._turns.get(str(thread_id), []))
+        cancelled = [turn.cancel() for turn in turns]
+        return any(cancelled)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            statuses = [turn.status for turns in self._turns.values() for turn in turns]
+            checkpoint_ms = sorted(self._checkpoint_ms)
+        metrics: Dict[str, Any] = {
+            "turns": {status: statuses.count(status) for status in set(statuses)},
+        }
+        checkpointer_metrics = getattr(self.chatbot.checkpointer, "metrics", None)
+        if checkpointer_metrics is not None:
+            metrics["checkpointer"] = checkpointer_metrics()
+        if checkpoint_ms:
+            metrics["checkpoint_ms_per_turn"] = {
+                "mean": round(sum(checkpoint_ms) / len(checkpoint_ms), 3),
+                "p50": checkpoint_ms[len(checkpoint_ms) // 2],
+                "p95": checkpoint_ms[min(len(checkpoint_ms) - 1, int(len(checkpoint_ms) * 0.95))],
+            }
+        return metrics
+
+    # -------------------
+    # Internals
+    # -------------------
+    def _forget_finished(self) -> None:
+        cutoff = time.time() - KEEP_FINISHED_SECONDS
+        for thread_id, turns in list(self._turns.items()):
+            # Keep the latest turn of a thread for replay until it expires.
+            kept = [
+                turn
+                for turn in turns
+                if not turn.finished or (turn is turns[-1] and turn.finished_at >= cutoff)
+            ]
+            if kept:
+                self._turns[thread_id] = kept
+            else:
+                del self._turns[thread_id]
+
+    def _run(self, turn: Turn) -> None:
+        admission = self.admission.admit(turn.thread_id)
+        admitted = False
+        try:
+            for status in admission:
+                if turn._cancelled.is_set():
+                    break
+                turn._emit({"event": "queued", **status})
+            else:
+                admitted = True
+        except Exception as e:
+            turn._fail(e)
+            return
+        finally:
+            admission.close()
+        if not admitted:
+            # Cancelled while queued: nothing ran and nothing needs releasing.
+            turn._emit({"event": "cancelled", "content": ""})
+            turn._finish("cancelled")
+            return
+
+        turn.status = "running"
+        try:
+            with sampled(f"turn-{turn.thread_id}", enabled=turn.profile) as profile:
+                outcome = self._execute(turn)
+            if profile is not None and profile.paths:
+                turn.profile_path = profile.paths[0]
+            if outcome is None:
+                return
+            status, answer = outcome
+            event = {"event": status, "content": answer}
+            if turn.profile_path:
+                event["profile"] = turn.profile_path
+            turn._emit(event)
+            turn._finish(status)
+        except Exception as e:
+            # `_execute` has released admission; readers still need a final event.
+            if not turn.finished:
+                turn._fail(e)
+
+    def _execute(self, turn: Turn) -> Optional[Tuple[str, str]]:
+        """Run an admitted turn; (final status, answer), or None if it failed."""
+        checkpointer = self.chatbot.checkpointer
+        written_before = _write_seconds(checkpointer, turn.thread_id)
+        config = with_turn_deadline(
+            {
+                "configurable": {"thread_id": turn.thread_id},
+                "metadata": {"thread_id": turn.thread_id},
+                "run_name": "chat_turn",
+                "callbacks": [_CancellationHandler(turn._cancelled)],
+            }
+        )
+        ai_chunks: List[str] = []
+        # Tokens of the model call in progress, saved if the turn is cancelled.
+        partial: List[str] = []
+        partial_id: Optional[str] = None
+        try:
+            try:
+                for message_chunk, _ in self.chatbot.stream(
+                    {"messages": [HumanMessage(content=turn.message)]},
+                    config=config,
+                    stream_mode="messages",
+                    durability=getattr(checkpointer, "graph_durability", None),
+                ):
+                    # Cancellation is raised inside the graph by _CancellationHandler,
+                    # so the step in progress shuts down cleanly.
+                    if isinstance(message_chunk, ToolMessage):
+                        partial, partial_id = [], None
+                        turn._emit({"event": "tool", "name": getattr(message_chunk, "name", None) or "tool"})
+                    elif isinstance(message_chunk, AIMessage) and isinstance(message_chunk.content, str):
+                        if message_chunk.id != partial_id:
+                            partial, partial_id = [], message_chunk.id
+                        if message_chunk.content:
+                            ai_chunks.append(message_chunk.content)
+                            partial.append(message_chunk.content)
+                            turn._emit({"event": "token", "content": message_chunk.content})
+                status = "done"
+            except TurnCancelled:
+                self._save_partial(config, "".join(partial), partial_id)
+                status = "cancelled"
+            # A finished turn is durable before it is reported (see checkpointing).
+            self._persist(turn, written_before)
+        except Exception as e:
+            self.admission.release(turn.thread_id)
+            turn._fail(e)
+            return None
+        self.admission.release(turn.thread_id)
+        return status, "".join(ai_chunks)
+
+    def _persist(self, turn: Turn, written_before: float) -> None:
+        """Flush a buffering checkpointer and record the turn's checkpoint write time."""
+        checkpointer = self.chatbot.checkpointer
+        start = time.perf_counter()
+        flush = getattr(checkpointer, "flush", None)
+        if flush is not None:
+            flush()
+        turn.checkpoint_ms = round(
+            1000 * (_write_seconds(checkpointer, turn.thread_id) - written_before + time.perf_counter() - start),
+            3,
+        )
+        with self._lock:
+            self._checkpoint_ms.append(turn.checkpoint_ms)
+
+    def _save_partial(self, config: dict, partial: str, partial_id: Optional[str]) -> None:
+        """
+        Close the thread after a cancelled turn: answer the tool calls of the
+        last model call (with their result if the tool had already finished),
+        then record the partial answer so the next turn and the history see
+        what the user saw.
+        """
+        config = {"configurable": config["configurable"]}
+        # `update_state` builds on the last checkpoint, so start from its
+        # messages; tool results written since then are only pending writes.
+        saved = self.chatbot.checkpointer.get_tuple(config)
+        messages = saved.checkpoint["channel_values"].get("messages", []) if saved else []
+        finished: Dict[str, ToolMessage] = {}
+        for task in self.chatbot.get_state(config).tasks:
+            result = task.result if isinstance(task.result, dict) else {}
+            for message in result.get("messages") or []:
+                if isinstance(message, ToolMessage):
+                    finished[message.tool_call_id] = message
+
+        answered = {m.tool_call_id for m in messages if isinstance(m, ToolMessage)}
+        updates: List[Any] = []
+        last = messages[-1] if messages else None
+        if isinstance(last, AIMessage):
+            for call in last.tool_calls or []:
+                if call["id"] in answered:
+                    continue
+                updates.append(
+                    finished.get(call["id"])
+                    or ToolMessage(
+                        content="Cancelled by the user.",
+                        tool_call_id=call["id"],
+                        name=call["name"],
+                    )
+                )
+        if partial_id is not None and any(m.id == partial_id for m in messages):
+            partial = ""  # the model call had completed and is already saved
+        updates.append(AIMessage(content=f"{partial} {CANCELLED_NOTE}".strip()))
+        self.chatbot.update_state(config, {"messages": updates}, as_node="chat_node")